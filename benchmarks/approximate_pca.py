@@ -0,0 +1,225 @@
+"""Quality and speed of `ApproximatePCA` against exact `PCA`.
+
+For each data set and each `fracRow`/`minRow` setting, the script fits
+`ApproximatePCA` and reports, relative to `PCA` on the same data:
+
+    time      median wall time of `fit_transform` over `--repeat` fits
+    memory    peak memory allocated during one fit (tracemalloc)
+    angle     largest principal angle in degrees between the approximate and
+              the exact principal subspaces
+    recall    fraction of the pairs selected with exact PCA that are also
+              selected with the approximate reduction (`select_pairs` with
+              `--distance`)
+    pairs     number of pairs selected with the approximate reduction,
+              relative to exact PCA
+
+Data sets are synthetic with the shapes given by `--shape`:
+
+    lowrank       `dimLow` strong directions plus isotropic noise
+    blobs         Gaussian clusters whose centers lie in a low-rank subspace
+    heavy_tailed  lowrank data with log-normal row norms, so a few rows
+                  dominate the norm-proportional row sampling
+
+Usage:
+    python benchmarks/approximate_pca.py [--shape 100000x50 20000x784]
+        [--frac-row 0.001 0.01 0.1] [--min-row 150 1000] [--csv out.csv]
+"""
+import argparse
+import csv
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import scipy.linalg
+
+from sparsecomputation import ApproximatePCA, PCA, SparseComputation
+
+DATASETS = ("lowrank", "blobs", "heavy_tailed")
+COLUMNS = (
+    "dataset", "n", "p", "fracRow", "minRow", "time", "speedup", "memory",
+    "memoryRatio", "angle", "recall", "pairs",
+)
+
+
+def _low_rank_basis(rng, rank, p):
+    """`rank` x p matrix with orthonormal rows."""
+    basis, _ = np.linalg.qr(rng.normal(size=(p, rank)))
+    return basis.T
+
+
+def make_data(name, n, p, dimLow, seed=0):
+    """Synthetic n x p data set.
+    Args:
+        name (str): one of `DATASETS`
+        n (int): number of observations
+        p (int): number of features
+        dimLow (int): dimension of the dominant subspace
+        seed=0 (int): random seed
+    Returns:
+        n x p numpy array
+    """
+    rng = np.random.RandomState(seed)
+    rank = min(dimLow, p)
+    basis = _low_rank_basis(rng, rank, p)
+    scales = np.linspace(10.0, 5.0, rank)
+    if name in ("lowrank", "heavy_tailed"):
+        data = (rng.normal(size=(n, rank)) * scales).dot(basis)
+        data += rng.normal(size=(n, p))
+        if name == "heavy_tailed":
+            data *= rng.lognormal(sigma=1.5, size=(n, 1))
+    elif name == "blobs":
+        centers = (rng.normal(size=(20, rank)) * scales).dot(basis)
+        data = centers[rng.randint(len(centers), size=n)]
+        data += rng.normal(size=(n, p))
+    else:
+        raise ValueError(
+            "Current dataset: %s is not defined. " % name
+            + "Use one of %s." % ", ".join(DATASETS)
+        )
+    return data
+
+
+def time_fit(reducer, data, repeat):
+    """Median wall time of `reducer.fit_transform(data)`."""
+    times = []
+    for seed in range(repeat):
+        start = time.time()
+        reducer.fit_transform(data, seed=seed)
+        times.append(time.time() - start)
+    return float(np.median(times))
+
+
+def peak_memory(reducer, data):
+    """Peak bytes allocated by one `reducer.fit_transform(data)`."""
+    tracemalloc.start()
+    try:
+        reducer.fit_transform(data, seed=0)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def subspace_angle(exact, approximate):
+    """Largest principal angle in degrees between the fitted subspaces."""
+    angles = scipy.linalg.subspace_angles(
+        exact._pca.components_.T, approximate._pca.components_.T
+    )
+    return float(np.degrees(angles.max()))
+
+
+def _pair_codes(pairs, n):
+    pairs = np.sort(pairs, axis=1).astype(np.int64)
+    return np.unique(pairs[:, 0] * n + pairs[:, 1])
+
+
+def pair_recall(exactPairs, pairs, n):
+    """Fraction of `exactPairs` that are in `pairs`."""
+    exactCodes = _pair_codes(exactPairs, n)
+    if len(exactCodes) == 0:
+        return 1.0
+    isFound = np.isin(exactCodes, _pair_codes(pairs, n), assume_unique=True)
+    return float(isFound.mean())
+
+
+def run(args):
+    """Yield one result dict per data set, shape and setting."""
+    for shape in args.shape:
+        n, p = [int(x) for x in shape.lower().split("x")]
+        for name in args.dataset:
+            data = make_data(name, n, p, args.dim_low, seed=args.seed)
+
+            exact = PCA(args.dim_low)
+            exactTime = time_fit(exact, data, args.repeat)
+            exactMemory = peak_memory(exact, data)
+            sc = SparseComputation(
+                exact, distance=args.distance, rescale=args.rescale
+            )
+            exactPairs = sc.select_pairs(data, as_array=True)
+
+            for fracRow in args.frac_row:
+                for minRow in args.min_row:
+                    approximate = ApproximatePCA(
+                        args.dim_low, fracRow=fracRow, minRow=minRow
+                    )
+                    fitTime = time_fit(approximate, data, args.repeat)
+                    memory = peak_memory(approximate, data)
+                    angle = subspace_angle(exact, approximate)
+
+                    sc = SparseComputation(
+                        approximate, distance=args.distance,
+                        rescale=args.rescale,
+                    )
+                    pairs = sc.select_pairs(data, seed=0, as_array=True)
+
+                    yield {
+                        "dataset": name,
+                        "n": n,
+                        "p": p,
+                        "fracRow": fracRow,
+                        "minRow": minRow,
+                        "time": fitTime,
+                        "speedup": exactTime / fitTime,
+                        "memory": memory,
+                        "memoryRatio": float(memory) / exactMemory,
+                        "angle": angle,
+                        "recall": pair_recall(exactPairs, pairs, n),
+                        "pairs": float(len(pairs)) / max(len(exactPairs), 1),
+                    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--shape", nargs="+", default=["100000x50", "20000x784"],
+        help="shapes of the data sets as NxP",
+    )
+    parser.add_argument(
+        "--dataset", nargs="+", choices=DATASETS, default=list(DATASETS)
+    )
+    parser.add_argument("--dim-low", type=int, default=3)
+    parser.add_argument(
+        "--frac-row", nargs="+", type=float, default=[0.001, 0.01, 0.1]
+    )
+    parser.add_argument("--min-row", nargs="+", type=int, default=[150, 1000])
+    parser.add_argument("--distance", type=float, default=0.02)
+    parser.add_argument(
+        "--rescale", default="quantile",
+        help="rescaling of `select_pairs`; the rank-based default keeps the "
+        "heavy-tailed data from collapsing into a few boxes",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    header = (
+        "%-12s %7s %4s %7s %6s %8s %7s %9s %6s %6s %6s %6s"
+        % ("dataset", "n", "p", "fracRow", "minRow", "time", "speedup",
+           "memory", "memory", "angle", "recall", "pairs")
+    )
+    print(header)
+    rows = []
+    for row in run(args):
+        rows.append(row)
+        print(
+            "%-12s %7d %4d %7g %6d %7.3fs %6.1fx %8.1fM %5.2fx %6.2f %6.3f "
+            "%5.2fx"
+            % (row["dataset"], row["n"], row["p"], row["fracRow"],
+               row["minRow"], row["time"], row["speedup"],
+               row["memory"] / 2.0 ** 20, row["memoryRatio"], row["angle"],
+               row["recall"], row["pairs"])
+        )
+        sys.stdout.flush()
+
+    if args.csv is not None:
+        with open(args.csv, "w") as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
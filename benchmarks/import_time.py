@@ -0,0 +1,87 @@
+"""Cold-start cost of `import sparsecomputation` and of the first call.
+
+Each import runs in a fresh interpreter. The script reports the median import
+time relative to `import numpy` and the median time of the first
+`select_pairs` call on `--num-objects` points, e.g. in a short-lived worker.
+It lists heavy modules that were imported eagerly, and exits with status 1 if
+the import overhead exceeds `--max-overhead` seconds, the first call takes
+more than `--max-first-call` seconds, or a heavy module is imported.
+
+Usage:
+    python benchmarks/import_time.py [--repeat 7] [--max-overhead 0.1]
+        [--num-objects 1000] [--max-first-call 0.1]
+"""
+import argparse
+import subprocess
+import sys
+import timeit
+
+HEAVY_MODULES = ("sklearn", "scipy", "numba", "six", "pyarrow")
+
+
+def time_import(statement, repeat):
+    """Median wall time of running `statement` in a fresh interpreter."""
+    command = [sys.executable, "-c", statement]
+    times = sorted(
+        timeit.repeat(
+            lambda: subprocess.check_call(command), number=1, repeat=repeat
+        )
+    )
+    return times[len(times) // 2]
+
+
+def first_call_statement(numObjects):
+    """Statement that imports the package and selects the pairs of
+    `numObjects` random points once."""
+    return (
+        "import numpy as np, sparsecomputation; "
+        "data = np.random.RandomState(0).uniform(size=(%d, 2)); "
+        "sc = sparsecomputation.SparseComputation(None, resolution=20); "
+        "sc.select_pairs(data, as_array=True)" % numObjects
+    )
+
+
+def eager_modules():
+    """Heavy modules loaded by `import sparsecomputation`."""
+    statement = (
+        "import sys, sparsecomputation; "
+        "print(' '.join(m for m in %r if m in sys.modules))" % (HEAVY_MODULES,)
+    )
+    output = subprocess.check_output([sys.executable, "-c", statement])
+    return output.decode().split()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--max-overhead", type=float, default=0.1)
+    parser.add_argument("--num-objects", type=int, default=1000)
+    parser.add_argument("--max-first-call", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    baseline = time_import("import numpy", args.repeat)
+    total = time_import("import sparsecomputation", args.repeat)
+    overhead = total - baseline
+    firstCall = time_import(
+        first_call_statement(args.num_objects), args.repeat
+    )
+    firstCall -= total
+    modules = eager_modules()
+
+    print("import numpy:             %.3f s" % baseline)
+    print("import sparsecomputation: %.3f s" % total)
+    print("overhead:                 %.3f s" % overhead)
+    print(
+        "first select_pairs:       %.3f s (%d objects)"
+        % (firstCall, args.num_objects)
+    )
+    print("eager heavy modules:      %s" % (" ".join(modules) or "none"))
+    return int(
+        overhead > args.max_overhead
+        or firstCall > args.max_first_call
+        or bool(modules)
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
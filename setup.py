@@ -20,5 +20,9 @@ setup(
     long_description_content_type="text/markdown",
     packages=find_packages("src"),
     package_dir={"": "src"},
-    install_requires=["numpy", "scipy", "sklearn", "six"],
+    install_requires=["numpy", "scipy", "sklearn"],
+    extras_require={"numba": ["numba"], "parquet": ["pyarrow"]},
+    entry_points={
+        "console_scripts": ["sparsecomputation=sparsecomputation.cli:main"]
+    },
 )
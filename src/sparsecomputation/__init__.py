@@ -1,3 +1,7 @@
 from .dimreducer import ApproximatePCA
 from .dimreducer import PCA
 from .sparsecomputation import SparseComputation
+from .sparsecomputation import PairMemoryError
+from .distributed import DistributedSparseComputation
+from .index import GridIndex
+from .index import StreamingGridIndex
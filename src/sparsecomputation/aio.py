@@ -0,0 +1,112 @@
+"""Asyncio facade of a fitted `GridIndex`.
+
+Concurrent `await query(point)` calls are collected into micro-batches. Each
+batch is projected and looked up with a single vectorized `GridIndex.query_csr`
+call in an executor, so the event loop is never blocked, and the candidates
+are fanned back out to the waiting callers. A query waits at most `max_delay`
+seconds for its batch to fill up.
+
+This module requires Python 3 and is not imported by the package.
+"""
+import asyncio
+
+import numpy as np
+
+
+class AsyncGridIndex(object):
+    def __init__(
+        self,
+        index,
+        max_batch_size=256,
+        max_delay=0.002,
+        executor=None,
+        reduced=False,
+    ):
+        """Micro-batching candidate lookups for asyncio services.
+        Args:
+            index (GridIndex): fitted index
+            max_batch_size=256 (int): a batch is sent as soon as it holds this
+                many queries
+            max_delay=0.002 (float): seconds a query waits for its batch to
+                fill up
+            executor=None: `concurrent.futures` executor running the lookups.
+                The default executor of the event loop is used if None.
+            reduced=False (bool): query points are already projected onto the
+                low-dimensional space.
+        """
+        if not isinstance(max_batch_size, int) or max_batch_size < 1:
+            raise ValueError("max_batch_size should be a positive integer")
+        if max_delay < 0:
+            raise ValueError("max_delay should be nonnegative")
+
+        self.index = index
+        self.maxBatchSize = max_batch_size
+        self.maxDelay = max_delay
+        self.executor = executor
+        self.reduced = reduced
+
+        self._pending = []
+        self._flushHandle = None
+        self._batchTasks = set()
+        self.stats = {"numQueries": 0, "numBatches": 0, "maxBatchSize": 0}
+
+    async def query(self, point):
+        """Objects in the same or an adjacent box as a point.
+        Args:
+            point (p numpy array): vector of the query point
+        Returns:
+            int numpy array of candidates in increasing order.
+        Raises:
+            ValueError if the point does not match the dimension of the index.
+            Only this query fails and the rest of its batch is answered.
+        """
+        point = np.asarray(point).reshape(1, -1)
+        self.index.check_points(point, self.reduced)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((point, future))
+
+        if len(self._pending) >= self.maxBatchSize:
+            self._flush(loop)
+        elif self._flushHandle is None:
+            self._flushHandle = loop.call_later(
+                self.maxDelay, self._flush, loop
+            )
+        return await future
+
+    def _flush(self, loop):
+        """Send the pending queries as one batch."""
+        if self._flushHandle is not None:
+            self._flushHandle.cancel()
+            self._flushHandle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        self.stats["numQueries"] += len(batch)
+        self.stats["numBatches"] += 1
+        self.stats["maxBatchSize"] = max(
+            self.stats["maxBatchSize"], len(batch)
+        )
+
+        # keep a reference so the task is not garbage collected
+        task = loop.create_task(self._run_batch(loop, batch))
+        self._batchTasks.add(task)
+        task.add_done_callback(self._batchTasks.discard)
+
+    async def _run_batch(self, loop, batch):
+        try:
+            points = np.concatenate([point for point, _ in batch])
+            indptr, candidates = await loop.run_in_executor(
+                self.executor, self.index.query_csr, points, self.reduced
+            )
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for i, (_, future) in enumerate(batch):
+            if not future.done():
+                future.set_result(candidates[indptr[i]:indptr[i + 1]])
@@ -0,0 +1,353 @@
+"""Command-line tool that selects the pairs of a data file.
+
+The input is a .npy file (memory mapped), a .npz archive, a CSV file or a
+Parquet file (read with pyarrow, memory mapped). The pairs are written as an
+int64 .npy array with one pair per row, as a directory with the CSR
+adjacency (`indptr.npy` and `indices.npy`) listing both directions of each
+pair, or as a compact pair file (see `sparsecomputation.pairfile`). Output
+arrays are written in chunks into memory-mapped .npy files. With
+--memory-limit and --spill-dir, pairs that do not fit in memory are selected
+into a temporary file in the spill directory. The time of each stage and the
+pair selection stats are printed as JSON.
+
+Example:
+    sparsecomputation data.npy pairs.npy --reducer approximate_pca \\
+        --dim-low 3 --resolution 20 --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from .dimreducer import ApproximatePCA, PCA
+from .distributed import DistributedSparseComputation
+from .pairfile import write_pair_file
+from .sparsecomputation import SparseComputation
+
+REDUCERS = ("none", "pca", "approximate_pca")
+METHODS = ("block_enumeration", "object_shifting", "block_shifting")
+RESCALES = ("min_max", "quantile_min_max", "zscore", "quantile", "none")
+FORMATS = ("pairs", "csr", "compact")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="sparsecomputation",
+        description="Select the pairs of observations that are close in a "
+        "low-dimensional space.",
+    )
+    parser.add_argument(
+        "input", help="input file (.npy, .npz, .csv or .parquet)"
+    )
+    parser.add_argument(
+        "output",
+        help="output .npy file of pairs, output directory for --format csr, "
+        "or pair file for --format compact",
+    )
+
+    group = parser.add_argument_group("input")
+    group.add_argument("--key", help="array of a .npz file (default: first)")
+    group.add_argument(
+        "--columns", help="comma-separated columns of a Parquet file"
+    )
+    group.add_argument(
+        "--delimiter", default=",", help="delimiter of a CSV file"
+    )
+    group.add_argument(
+        "--skip-rows", type=int, default=0, help="header rows of a CSV file"
+    )
+
+    group = parser.add_argument_group("pair selection")
+    group.add_argument("--reducer", choices=REDUCERS, default="none")
+    group.add_argument(
+        "--dim-low", type=int, default=3, help="dimension of the reduction"
+    )
+    group.add_argument("--method", choices=METHODS, default="block_shifting")
+    grid = group.add_mutually_exclusive_group(required=True)
+    grid.add_argument("--resolution", type=float)
+    grid.add_argument("--distance", type=float)
+    group.add_argument("--rescale", choices=RESCALES, default="min_max")
+    group.add_argument("--seed", type=int)
+    group.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes; the grid is sharded if > 1",
+    )
+    group.add_argument(
+        "--memory-limit",
+        type=float,
+        help="memory limit of the selected pairs in MB",
+    )
+    group.add_argument(
+        "--spill-dir",
+        help="directory of the pairs that exceed --memory-limit",
+    )
+
+    group = parser.add_argument_group("output")
+    group.add_argument("--format", choices=FORMATS, default="pairs")
+    group.add_argument(
+        "--chunk-size",
+        type=int,
+        help="number of rows written at once (default: 1000000), or number "
+        "of objects per chunk of a compact pair file (default: 4096)",
+    )
+    group.add_argument(
+        "--stats", help="write the JSON stats to this file instead of stdout"
+    )
+    return parser
+
+
+def load_data(path, key=None, columns=None, delimiter=",", skipRows=0):
+    """Load the observations of a data file.
+    Args:
+        path (str): .npy, .npz, .csv or .parquet file
+        key=None (str): array of a .npz file. Defaults to the first array.
+        columns=None (list): columns of a Parquet file. Defaults to all.
+        delimiter="," (str): delimiter of a CSV file
+        skipRows=0 (int): number of header rows of a CSV file
+    Returns:
+        n x p numpy array
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        return np.load(path, mmap_mode="r")
+    elif extension == ".npz":
+        with np.load(path) as archive:
+            return archive[key if key is not None else archive.files[0]]
+    elif extension in (".csv", ".txt"):
+        return np.loadtxt(
+            path, delimiter=delimiter, skiprows=skipRows, ndmin=2
+        )
+    elif extension in (".parquet", ".pq"):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Reading Parquet files requires pyarrow")
+        table = pyarrow.parquet.read_table(
+            path, columns=columns, memory_map=True
+        )
+        return np.column_stack(
+            [column.to_numpy() for column in table.columns]
+        )
+    else:
+        raise ValueError(
+            "Current input format: %s is not defined. " % extension
+            + "Use a .npy, .npz, .csv or .parquet file."
+        )
+
+
+def get_sparse_computation(args):
+    """SparseComputation object configured by the command-line arguments."""
+    if args.reducer == "none":
+        dimReducer = None
+    elif args.reducer == "pca":
+        dimReducer = PCA(args.dim_low)
+    else:
+        dimReducer = ApproximatePCA(args.dim_low, random_state=args.seed)
+
+    rescale = None if args.rescale == "none" else args.rescale
+    memoryLimit = None
+    if args.memory_limit is not None:
+        memoryLimit = int(args.memory_limit * 2 ** 20)
+    if args.workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        return DistributedSparseComputation(
+            dimReducer,
+            distance=args.distance,
+            resolution=args.resolution,
+            method=args.method,
+            rescale=rescale,
+            executor=ProcessPoolExecutor(args.workers),
+            num_shards=args.workers,
+            memory_limit=memoryLimit,
+            spill_dir=args.spill_dir,
+        )
+    return SparseComputation(
+        dimReducer,
+        distance=args.distance,
+        resolution=args.resolution,
+        method=args.method,
+        rescale=rescale,
+        memory_limit=memoryLimit,
+        spill_dir=args.spill_dir,
+    )
+
+
+def write_array(path, array, chunkSize):
+    """Write an array into a .npy file in chunks of rows."""
+    if array.size == 0:
+        # empty files cannot be memory mapped
+        np.save(path, np.asarray(array, dtype=np.int64))
+        return
+
+    out = np.lib.format.open_memmap(
+        path, mode="w+", dtype=np.int64, shape=array.shape
+    )
+    for start in range(0, len(array), chunkSize):
+        out[start:start + chunkSize] = array[start:start + chunkSize]
+    out.flush()
+    del out
+
+
+def write_pairs(path, pairs, chunkSize):
+    """Write the pairs as a k x 2 int64 .npy array."""
+    write_array(path, pairs, chunkSize)
+
+
+def write_csr(path, pairs, numObjects, chunkSize):
+    """Write both directions of each pair as a CSR adjacency with sorted
+    neighbors into the directory `path`. The pairs are read in chunks of
+    `chunkSize` rows and their neighbors are scattered into the
+    memory-mapped indices, which are then sorted in runs of about
+    `chunkSize` entries, so only O(numObjects + chunkSize) is held in memory.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    degrees = np.zeros(numObjects, dtype=np.int64)
+    for start in range(0, len(pairs), chunkSize):
+        chunk = np.asarray(pairs[start:start + chunkSize])
+        degrees += np.bincount(chunk.ravel(), minlength=numObjects)
+    indptr = np.zeros(numObjects + 1, dtype=np.int64)
+    np.cumsum(degrees, out=indptr[1:])
+    write_array(os.path.join(path, "indptr.npy"), indptr, chunkSize)
+
+    indicesPath = os.path.join(path, "indices.npy")
+    if indptr[-1] == 0:
+        write_array(indicesPath, np.zeros(0, dtype=np.int64), chunkSize)
+        return
+    indices = np.lib.format.open_memmap(
+        indicesPath, mode="w+", dtype=np.int64, shape=(int(indptr[-1]),)
+    )
+
+    # scatter both directions of each chunk after the neighbors so far
+    ends = indptr[:-1].copy()
+    for start in range(0, len(pairs), chunkSize):
+        chunk = np.asarray(pairs[start:start + chunkSize])
+        sources = np.concatenate((chunk[:, 0], chunk[:, 1]))
+        targets = np.concatenate((chunk[:, 1], chunk[:, 0]))
+        order = np.argsort(sources, kind="mergesort")
+        sources, targets = sources[order], targets[order]
+        objects, first, counts = np.unique(
+            sources, return_index=True, return_counts=True
+        )
+        ranks = np.arange(len(sources)) - np.repeat(first, counts)
+        indices[ends[sources] + ranks] = targets
+        ends[objects] += counts
+
+    # sort the neighbors of runs of consecutive objects
+    row = 0
+    while row < numObjects:
+        end = np.searchsorted(indptr, indptr[row] + chunkSize, side="right")
+        end = min(max(end - 1, row + 1), numObjects)
+        block = np.asarray(indices[indptr[row]:indptr[end]])
+        rows = np.repeat(np.arange(row, end), degrees[row:end])
+        indices[indptr[row]:indptr[end]] = block[np.lexsort((block, rows))]
+        row = end
+    indices.flush()
+    del indices
+
+
+# Stats left out of the JSON report; the occupancy histogram has one entry
+# per box size and is summarized by the maximum and mean box occupancy
+_OMITTED_STATS = ("boxOccupancyHistogram",)
+
+
+def _to_json(value):
+    """Convert numpy values in the stats to JSON types."""
+    if isinstance(value, dict):
+        return dict(
+            (str(key), _to_json(x))
+            for key, x in value.items()
+            if key not in _OMITTED_STATS
+        )
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def main(argv=None):
+    """Run the command-line tool.
+    Args:
+        argv=None (list): command-line arguments. Defaults to `sys.argv`.
+    Returns:
+        Exit status
+    """
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers should be a positive integer")
+    if args.chunk_size is None:
+        args.chunk_size = 4096 if args.format == "compact" else 1000000
+    elif args.chunk_size < 1:
+        parser.error("--chunk-size should be a positive integer")
+    if args.memory_limit is not None and args.memory_limit < 0:
+        parser.error("--memory-limit should be nonnegative")
+
+    timings = {}
+    start = time.time()
+    columns = args.columns.split(",") if args.columns else None
+    try:
+        data = load_data(
+            args.input,
+            key=args.key,
+            columns=columns,
+            delimiter=args.delimiter,
+            skipRows=args.skip_rows,
+        )
+    except (ValueError, ImportError) as error:
+        parser.error(str(error))
+    timings["load"] = time.time() - start
+
+    start = time.time()
+    scObject = get_sparse_computation(args)
+    try:
+        pairs = scObject.select_pairs(
+            np.asarray(data), seed=args.seed, as_array=True
+        )
+    finally:
+        if args.workers > 1:
+            scObject.executor.shutdown()
+    timings["select_pairs"] = time.time() - start
+    numPairs = len(pairs)
+    # the spilled pairs are only kept until the output is written
+    spillFile = scObject.stats.pop("spillFile", None)
+
+    start = time.time()
+    if args.format == "pairs":
+        write_pairs(args.output, pairs, args.chunk_size)
+    elif args.format == "csr":
+        write_csr(args.output, pairs, len(data), args.chunk_size)
+    else:
+        write_pair_file(
+            args.output, pairs, len(data), chunk_rows=args.chunk_size
+        )
+    del pairs
+    if spillFile is not None:
+        os.remove(spillFile)
+    timings["write"] = time.time() - start
+
+    report = {
+        "numObjects": len(data),
+        "numPairs": numPairs,
+        "timings": timings,
+        "stats": scObject.stats,
+    }
+    report = json.dumps(_to_json(report), sort_keys=True)
+    if args.stats is None:
+        print(report)
+    else:
+        with open(args.stats, "w") as f:
+            f.write(report + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,40 @@
 import numpy as np
-import sklearn.decomposition
+
+
+def _check_random_state(random_state):
+    """Turn `random_state` into a random number generator.
+    Args:
+        random_state: None, an integer seed, or a random number generator
+                      (`numpy.random.Generator` or `numpy.random.RandomState`)
+    Returns:
+        Random number generator. Integer seeds give a new generator on every
+        call, so repeated calls draw the same numbers.
+    """
+    if random_state is None or isinstance(random_state, (int, np.integer)):
+        # numpy < 1.17 does not provide numpy.random.Generator
+        defaultRNG = getattr(np.random, "default_rng", np.random.RandomState)
+        return defaultRNG(random_state)
+    return random_state
+
+
+def _make_pca(dimLow):
+    """Scikit-learn PCA with `dimLow` components. Scikit-learn is imported
+    when the first reducer is constructed, which keeps `import
+    sparsecomputation` fast.
+    """
+    import sklearn.decomposition
+
+    return sklearn.decomposition.PCA(n_components=dimLow)
+
+
+def _clone_pca(pca, **params):
+    """Unfitted copy of a scikit-learn PCA with updated parameters. Each fit
+    trains its own copy and assigns it to the reducer once fitted, so fits of
+    one reducer in separate threads never write into the same estimator.
+    """
+    import sklearn.base
+
+    return sklearn.base.clone(pca).set_params(**params)
 
 
 class DimReducer:
@@ -33,10 +68,13 @@ class PCA(DimReducer):
             raise ValueError("dimLow should be positive")
         self.dimLow = dimLow
 
-        self._pca = sklearn.decomposition.PCA(n_components=self.dimLow)
+        self._pca = _make_pca(self.dimLow)
 
     def fit(self, data, **kwargs):
-        return self._pca.fit(data)
+        pca = _clone_pca(self._pca)
+        pca.fit(data)
+        self._pca = pca
+        return pca
 
     def fit_transform(self, data, **kwargs):
         """`fit_transform` projects the input data on a lower dimensional space
@@ -64,7 +102,9 @@ class PCA(DimReducer):
         if len(data[0]) < self.dimLow:
             raise ValueError("Data has less columns than dimLow")
 
-        reducedData = self._pca.fit_transform(data)
+        pca = _clone_pca(self._pca)
+        reducedData = pca.fit_transform(data)
+        self._pca = pca
         return reducedData
 
     def transform(self, data):
@@ -73,7 +113,13 @@ class PCA(DimReducer):
 
 class ApproximatePCA(DimReducer):
     def __init__(
-        self, dimLow, fracRow=0.01, fracCol=1.0, minRow=150, minCol=150
+        self,
+        dimLow,
+        fracRow=0.01,
+        fracCol=1.0,
+        minRow=150,
+        minCol=150,
+        random_state=None,
     ):
         """`ApproximatePCA` is a class of DimReducer
 
@@ -94,6 +140,13 @@ class ApproximatePCA(DimReducer):
                                fit the data.
             minRow (int): minimum number of columns to be used to fit the data
             minCol (int): minimum number of rows to be used to fit the data
+            random_state (int or numpy.random.Generator): seed or generator
+                used to sample rows and columns. The global numpy random
+                state is never used. An integer gives the same sample on
+                every fit. A generator is not thread-safe, so an instance
+                shared across threads should be given an integer or None.
+                Each fit trains a new scikit-learn PCA, see `_clone_pca`;
+                `transform` uses the last finished fit.
         """
         if not isinstance(dimLow, int):
             raise TypeError("dim Low should be an integer")
@@ -121,8 +174,36 @@ class ApproximatePCA(DimReducer):
         self.fracCol = fracCol
         self.minRow = minRow
         self.minCol = minCol
+        self.random_state = random_state
 
-        self._pca = sklearn.decomposition.PCA(n_components=self.dimLow)
+        self._pca = _make_pca(self.dimLow)
+
+    def _get_random_generator(self, seed=None):
+        """Random number generator for one fit.
+        Args:
+            seed=None: overrides `random_state` if set
+        Returns:
+            Random number generator
+        """
+        if seed is not None:
+            return _check_random_state(seed)
+        return _check_random_state(self.random_state)
+
+    def _fit_pca(self, data, rng):
+        """Fit a new PCA on the sampled data and assign it once fitted. The
+        randomized solvers of scikit-learn are seeded from `rng` instead of
+        the global random state.
+        Returns:
+            The fitted scikit-learn PCA
+        """
+        if hasattr(rng, "integers"):
+            pcaSeed = rng.integers(2 ** 31 - 1)
+        else:
+            pcaSeed = rng.randint(2 ** 31 - 1)
+        pca = _clone_pca(self._pca, random_state=int(pcaSeed))
+        pca.fit(data)
+        self._pca = pca
+        return pca
 
     def _get_proba_col(self, data):
         """
@@ -148,32 +229,36 @@ class ApproximatePCA(DimReducer):
         result /= sum(result)
         return result
 
-    def _col_reduction(self, data):
+    def _col_reduction(self, data, rng=None):
         """
         Compute the probability for each collumn and reduce the number of
         collumns accordingly, keeping only minCol or fracCol*#col
-        input: numpy array
+        input: numpy array, random number generator (optional)
         output: numpy array
         """
+        if rng is None:
+            rng = self._get_random_generator()
         proba_col = self._get_proba_col(data)
         n = len(data[0])
         n_col = max(self.minCol, n * self.fracCol, self.dimLow)
         n_col = int(min(n_col, len(data[0])))
         if n_col < n:
-            list_col = np.random.choice(range(n), n_col, 0, proba_col)
+            list_col = rng.choice(n, n_col, False, proba_col)
             factor = np.sqrt(np.array(proba_col)[list_col] * n_col)
             result = np.copy(data[:, list_col]) / factor
             return result
         else:
             return data
 
-    def _row_reduction(self, data):
+    def _row_reduction(self, data, rng=None):
         """
         Compute the probability for each row and reduce the number of
         rows accordingly, keeping only minRow or fracRow*#col
-        input: numpy array
+        input: numpy array, random number generator (optional)
         output: numpy array
         """
+        if rng is None:
+            rng = self._get_random_generator()
         proba_row = self._get_proba_row(data)
         n = len(data)
         n_row = max(self.minRow, n * self.fracRow)
@@ -181,7 +266,7 @@ class ApproximatePCA(DimReducer):
         if n == n_row:
             return data
         else:
-            list_rows = np.random.choice(range(0, n), n_row, 0, proba_row)
+            list_rows = rng.choice(n, n_row, False, proba_row)
             result = np.copy(data[list_rows, :])
             return result
 
@@ -192,11 +277,9 @@ class ApproximatePCA(DimReducer):
                 "reduced data."
             )
 
-        if seed:
-            np.random.seed(seed)
-
-        reduced_data = self._row_reduction(data)
-        self._pca.fit(reduced_data)
+        rng = self._get_random_generator(seed)
+        reduced_data = self._row_reduction(data, rng)
+        self._fit_pca(reduced_data, rng)
 
     def fit_transform(self, data, seed=None, **kwargs):
         """`fit_transform` projects the input data on a lower dimensional space
@@ -213,6 +296,7 @@ class ApproximatePCA(DimReducer):
             data (numpy.ndarray): input data that needs to be reduced.
                                   data should be a table of n lines being n
                                   observations, each line having p features.
+            seed (int): overrides `random_state` for this fit if set
 
         Returns:
             numpy.ndarray: reduced data, a table of n lines and `dimLow`
@@ -221,17 +305,15 @@ class ApproximatePCA(DimReducer):
         if not isinstance(data, np.ndarray):
             raise TypeError("Data should be a Numpy array")
 
+        rng = self._get_random_generator(seed)
         if abs(self.fracCol - 1.0) <= 1e-8:
             col_reduced_data = data
         else:
-            col_reduced_data = self._col_reduction(data)
-
-        if seed:
-            np.random.seed(seed)
+            col_reduced_data = self._col_reduction(data, rng)
 
-        reduced_data = self._row_reduction(col_reduced_data)
-        self._pca.fit(reduced_data)
-        return self._pca.transform(col_reduced_data)
+        reduced_data = self._row_reduction(col_reduced_data, rng)
+        pca = self._fit_pca(reduced_data, rng)
+        return pca.transform(col_reduced_data)
 
     def transform(self, data, **kwargs):
         return self._pca.transform(data)
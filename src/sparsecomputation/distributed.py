@@ -0,0 +1,637 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from . import kernels
+from .dimreducer import _check_random_state
+from .sparsecomputation import EXPANSION_PAIR_BYTES, SparseComputation
+
+
+class _SerialExecutor(object):
+    """Executor that runs each task immediately in the calling process."""
+
+    def submit(self, fn, *args):
+        return _CompletedTask(fn(*args))
+
+
+class _CompletedTask(object):
+    def __init__(self, value):
+        self._value = value
+
+    def result(self):
+        return self._value
+
+
+# Stats that are the same in every shard
+_CONSTANT_STATS = ("numShifts",)
+
+
+def _load_chunk(chunk):
+    """Observations of a chunk, given as a numpy array or as the path of a
+    .npy file, which is memory mapped."""
+    if isinstance(chunk, np.ndarray):
+        return chunk
+    return np.load(chunk, mmap_mode="r")
+
+
+def _part_path(workDir, shard, chunkIndex):
+    """File with the objects of a chunk sent to a shard."""
+    return os.path.join(workDir, "part-%d-%d.npz" % (shard, chunkIndex))
+
+
+def _transform_chunk(dimReducer, data):
+    """Project a chunk of the data with a fitted dimension reducer."""
+    if dimReducer is None:
+        return data
+    return dimReducer.transform(data)
+
+
+def _chunk_bounds(dimReducer, chunk):
+    """Smallest and largest reduced value of a chunk in each dimension."""
+    reducedData = _transform_chunk(dimReducer, _load_chunk(chunk))
+    return np.amin(reducedData, axis=0), np.amax(reducedData, axis=0)
+
+
+def _partition_chunk(
+    scObject,
+    dimReducer,
+    chunk,
+    offset,
+    bounds,
+    cuts,
+    labels,
+    workDir,
+    chunkIndex,
+    rescaled,
+):
+    """Project a chunk onto the grid and split it into shards.
+    Shard k owns the boxes with first grid index in [cuts[k - 1], cuts[k]).
+    Objects in the first layer of boxes of shard k are also sent to shard k - 1
+    as a halo, so that each shard sees all boxes adjacent to the boxes it owns.
+    The part of each shard is written to a file in `workDir`, which the shard
+    task reads, so the parts never pass through the driver.
+    Args:
+        scObject (SparseComputation): grid parameters
+        dimReducer (DimReducer): fitted dimension reducer or None
+        chunk: observations of the chunk, see `_load_chunk`
+        offset (int): index of the first observation of the chunk
+        bounds (tuple): global rescaling bounds
+        cuts (int numpy array): first grid index of each shard except shard 0
+        labels (numpy array): label of each observation of the chunk, or None
+        workDir (str): directory of the parts
+        chunkIndex (int): index of the chunk
+        rescaled (bool): also send the rescaled observations to the shards
+    """
+    reducedData = _transform_chunk(dimReducer, _load_chunk(chunk))
+    if rescaled:
+        rescaledData = np.asarray(
+            scObject._rescale_data(reducedData, bounds=bounds),
+            dtype=np.float64,
+        )
+        boxIDs = scObject._project_onto_grid(rescaledData, scObject.distance)
+    else:
+        boxIDs = scObject._rescale_and_project(
+            reducedData, scObject.distance, bounds=bounds
+        )
+
+    shards = np.searchsorted(cuts, boxIDs[:, 0], side="right")
+    isHalo = np.zeros(len(boxIDs), dtype=bool)
+    hasLowerCut = shards > 0
+    isHalo[hasLowerCut] = (
+        boxIDs[hasLowerCut, 0] == cuts[shards[hasLowerCut] - 1]
+    )
+
+    for shard in range(len(cuts) + 1):
+        rows = np.flatnonzero(
+            (shards == shard) | (isHalo & (shards == shard + 1))
+        )
+        part = {"indices": rows + offset, "boxIDs": boxIDs[rows]}
+        if labels is not None:
+            part["labels"] = labels[rows]
+        if rescaled:
+            part["rescaledData"] = rescaledData[rows]
+        np.savez(_part_path(workDir, shard, chunkIndex), **part)
+
+
+def _load_shard(workDir, shard, numChunks):
+    """Read and delete the parts of a shard written by `_partition_chunk`.
+    Returns:
+        Dict of the concatenated arrays of the parts.
+    """
+    parts = []
+    for chunkIndex in range(numChunks):
+        path = _part_path(workDir, shard, chunkIndex)
+        with np.load(path) as archive:
+            parts.append(dict((key, archive[key]) for key in archive.files))
+        os.remove(path)
+    return dict(
+        (key, np.concatenate([part[key] for part in parts]))
+        for key in parts[0]
+    )
+
+
+def _own_pairs(scObject, pairs, indices, inHalo):
+    """Global indices of the pairs owned by a shard. The pairs are filtered
+    in blocks of a quarter of `memoryLimit` bytes into an array, or into a
+    file in `spillDir` if they do not fit (see `_allocate_pairs`).
+    Args:
+        scObject (SparseComputation): grid parameters
+        pairs (k x 2 int numpy array): pairs of the shard (local indices)
+        indices (int numpy array): global index of each object of the shard
+        inHalo (bool numpy array): objects in the halo, or None
+    Returns:
+        Numpy array of pairs, or the path of the .npy file if spilled.
+    """
+    if scObject.memoryLimit is None:
+        blockSize = max(len(pairs), 1)
+    else:
+        blockSize = max(
+            scObject.memoryLimit // (2 * EXPANSION_PAIR_BYTES), 1
+        )
+    blocks = [
+        slice(start, start + blockSize)
+        for start in range(0, len(pairs), blockSize)
+    ]
+
+    def owned(block):
+        block = np.asarray(pairs[block])
+        if inHalo is None:
+            return block
+        return block[~(inHalo[block[:, 0]] & inHalo[block[:, 1]])]
+
+    numPairs = len(pairs)
+    if inHalo is not None:
+        numPairs = sum(len(owned(block)) for block in blocks)
+    out = scObject._allocate_pairs(numPairs)
+    position = 0
+    for block in blocks:
+        block = owned(block)
+        out[position:position + len(block)] = indices[block]
+        position += len(block)
+
+    if isinstance(pairs, np.memmap):
+        spillFile = pairs.filename
+        del pairs
+        os.remove(spillFile)
+    if isinstance(out, np.memmap):
+        out.flush()
+        return out.filename
+    return out
+
+
+def _shard_pairs(scObject, workDir, shard, numChunks, upperCut, topK):
+    """Select the pairs owned by one shard.
+    A pair is owned by the shard that owns the box with the smallest first grid
+    index, so pairs between two halo boxes are left to the next shard.
+    Args:
+        scObject (SparseComputation): grid parameters
+        workDir (str): directory of the parts of the shard
+        shard (int): index of the shard
+        numChunks (int): number of chunks
+        upperCut (int): first grid index of the next shard, or None
+        topK (int): number of closest pairs to select, or None for all pairs
+    Returns:
+        Pairs (global indices) as a k x 2 numpy array or the path of a .npy
+        file in `spillDir`, their squared distances if `topK` is set (None
+        otherwise), and the shard stats.
+    """
+    part = _load_shard(workDir, shard, numChunks)
+    indices, boxIDs = part["indices"], part["boxIDs"]
+    labels = part.get("labels")
+    grid = kernels.group_boxes(boxIDs)
+    inHalo = None if upperCut is None else boxIDs[:, 0] == upperCut
+
+    if topK is not None:
+        rescaledData = part["rescaledData"]
+        pairs = scObject._select_top_k(
+            grid, rescaledData, topK, labels, exclude=inHalo
+        )
+        differences = (
+            rescaledData[pairs[:, 0]] - rescaledData[pairs[:, 1]]
+        )
+        distances = np.einsum("ij,ij->i", differences, differences)
+        return indices[pairs].reshape(-1, 2), distances, scObject.stats
+
+    pairs = scObject._get_grid_method()(grid, labels)
+    stats = scObject.stats
+    # the intermediate spill file is deleted by `_own_pairs`
+    stats.pop("spillFile", None)
+    return _own_pairs(scObject, pairs, indices, inHalo), None, stats
+
+
+class DistributedSparseComputation(SparseComputation):
+    def __init__(
+        self,
+        dim_reducer,
+        distance=None,
+        resolution=None,
+        method="block_shifting",
+        rescale="min_max",
+        executor=None,
+        num_shards=4,
+        sample_size=None,
+        chunk_size=100000,
+        cache_memory=0,
+        pair_type=None,
+        rescale_sample_size=100000,
+        clip_quantile=0.01,
+        clip_zscore=3.0,
+        neighbor_search="probe",
+        memory_limit=None,
+        spill_dir=None,
+    ):
+        """Sparse computation with the grid sharded across workers.
+
+        The dimension reducer is fitted on a sample of the observations and
+        broadcast to the workers together with the rescaling bounds. The grid
+        is split into shards by ranges of the first grid index, each extended
+        with a halo of one box. Each worker selects the pairs of the boxes it
+        owns, so no pair is reported twice. The objects are sent from the
+        chunk tasks to the shard tasks through files in a temporary directory
+        in `spill_dir` (or in the system temporary directory), which should be
+        shared by the workers.
+
+        `select_pairs` and `select_pair_shards` are distributed.
+        `select_pairs_multi`, `select_cross_pairs` and `select_degrees` are
+        inherited from `SparseComputation` and run in the calling process.
+
+        Args:
+            dim_reducer (DimReducer): dimension reducer with `fit` and
+                `transform` methods, or None
+            distance, resolution, method, rescale: see `SparseComputation`
+            executor: object with a `submit(fn, *args)` method returning a
+                future with a `result()` method, such as a
+                `concurrent.futures.ProcessPoolExecutor` or a Dask client.
+                Tasks run in the calling process if None.
+            num_shards (int): number of shards of the grid
+            sample_size (int): number of observations used to fit the
+                dimension reducer and to balance the shards. All observations
+                are used if None.
+            chunk_size (int): number of observations projected per task if
+                the observations are given as a single array
+            cache_memory, pair_type: see `SparseComputation`
+            rescale_sample_size, clip_quantile, clip_zscore: see
+                `SparseComputation`. The robust rescaling methods are fitted
+                on the sample of the dimension reducer.
+            neighbor_search: see `SparseComputation`
+            memory_limit, spill_dir: see `SparseComputation`. The limit
+                applies to the pairs of each shard and to their
+                concatenation by `select_pairs`.
+        """
+        super(DistributedSparseComputation, self).__init__(
+            dim_reducer,
+            distance=distance,
+            resolution=resolution,
+            method=method,
+            rescale=rescale,
+            cache_memory=cache_memory,
+            pair_type=pair_type,
+            rescale_sample_size=rescale_sample_size,
+            clip_quantile=clip_quantile,
+            clip_zscore=clip_zscore,
+            neighbor_search=neighbor_search,
+            memory_limit=memory_limit,
+            spill_dir=spill_dir,
+        )
+
+        if not isinstance(num_shards, int) or num_shards < 1:
+            raise ValueError("num_shards should be a positive integer")
+        if not isinstance(chunk_size, int) or chunk_size < 1:
+            raise ValueError("chunk_size should be a positive integer")
+
+        self.executor = executor
+        self.numShards = num_shards
+        self.sampleSize = sample_size
+        self.chunkSize = chunk_size
+
+    def _get_executor(self):
+        if self.executor is None:
+            return _SerialExecutor()
+        return self.executor
+
+    def _get_shard_object(self):
+        """SparseComputation object with the grid parameters sent to the
+        tasks."""
+        return SparseComputation(
+            None,
+            distance=self.distance,
+            method=self.method,
+            rescale=self.rescale,
+            pair_type=self.pairType,
+            rescale_sample_size=self.rescaleSampleSize,
+            clip_quantile=self.clipQuantile,
+            clip_zscore=self.clipZscore,
+            neighbor_search=self.neighborSearch,
+            memory_limit=self.memoryLimit,
+            spill_dir=self.spillDir,
+        )
+
+    def _get_chunks(self, data):
+        """Split the observations into the chunks of the tasks.
+        Args:
+            data: n x p numpy array, or list of chunks that are numpy arrays
+                or paths of .npy files
+        Returns:
+            List of chunks and the index of the first observation of each
+            chunk, followed by the number of observations.
+        """
+        if isinstance(data, np.ndarray):
+            chunks = [
+                data[start:start + self.chunkSize]
+                for start in range(0, len(data), self.chunkSize)
+            ]
+        elif isinstance(data, (list, tuple)):
+            chunks = list(data)
+        else:
+            raise TypeError(
+                "data should be a numpy array or a list of chunks"
+            )
+        if not chunks:
+            raise ValueError("data should contain at least one observation")
+        sizes = [len(_load_chunk(chunk)) for chunk in chunks]
+        offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        return chunks, offsets
+
+    def _fit_sample(self, chunks, offsets, seed=None, reduced=False):
+        """Fit the dimension reducer on a sample of the observations. Only
+        the rows of the sample are read from the chunks.
+        Args:
+            chunks (list): chunks of the observations, see `_get_chunks`
+            offsets (int numpy array): index of the first observation of each
+                chunk, followed by the number of observations
+            seed=None: seed used to draw the sample and to fit the reducer
+            reduced=False (bool): `data` is already projected onto the
+                low-dimensional space and the dimension reducer is skipped.
+        Returns:
+            Reduced sample (s x dimLow numpy array)
+        """
+        numObjects = int(offsets[-1])
+        if self.sampleSize is None or self.sampleSize >= numObjects:
+            sample = np.concatenate(
+                [np.asarray(_load_chunk(chunk)) for chunk in chunks]
+            )
+        else:
+            rng = _check_random_state(seed)
+            rows = np.sort(rng.choice(numObjects, self.sampleSize, False))
+            chunkRows = np.searchsorted(offsets, rows, side="right") - 1
+            sample = np.concatenate(
+                [
+                    _load_chunk(chunks[i])[
+                        rows[chunkRows == i] - offsets[i]
+                    ]
+                    for i in np.unique(chunkRows)
+                ]
+            )
+
+        if reduced or self.dimReducer is None:
+            return sample
+        self.dimReducer.fit(sample, seed=seed)
+        return self.dimReducer.transform(sample)
+
+    def _get_cuts(self, sampleBoxIDs):
+        """Split the first grid index into ranges of similar occupancy.
+        Args:
+            sampleBoxIDs (s x p int numpy array): grid indices of the sample
+        Returns:
+            Sorted int numpy array with the first grid index of each shard
+            except the first one.
+        """
+        if self.numShards == 1 or len(sampleBoxIDs) == 0:
+            return np.zeros(0, dtype=np.int64)
+        quantiles = np.linspace(0, 100, self.numShards + 1)[1:-1]
+        cuts = np.percentile(sampleBoxIDs[:, 0], quantiles)
+        return np.unique(np.ceil(cuts).astype(np.int64))
+
+    def _merge_stats(self, shardStats, numPairs):
+        """Sum the stats of all shards. Box occupancy is merged by maximum,
+        by weighted mean and by adding the histograms; boxes in a halo are
+        counted by both shards. Settings of the run that are the same in all
+        shards, such as the number of shifts, are not summed.
+        """
+        stats = {}
+        for shardStat in shardStats:
+            for key, value in shardStat.items():
+                if key in _CONSTANT_STATS or key == "maxBoxOccupancy":
+                    stats[key] = max(stats.get(key, 0), value)
+                elif key == "meanBoxOccupancy":
+                    stats[key] = stats.get(key, 0) + value * shardStat[
+                        "numBoxes"
+                    ]
+                elif key == "boxOccupancyHistogram":
+                    histogram = stats.get(key, np.zeros(0, dtype=np.intp))
+                    if len(histogram) < len(value):
+                        histogram, value = value, histogram
+                    histogram = histogram.copy()
+                    histogram[:len(value)] += value
+                    stats[key] = histogram
+                else:
+                    stats[key] = stats.get(key, 0) + value
+        if stats.get("numBoxes"):
+            stats["meanBoxOccupancy"] /= float(stats["numBoxes"])
+        stats["numUniquePairs"] = numPairs
+        stats["numShards"] = len(shardStats)
+        return stats
+
+    def _run_shards(self, data, seed, reduced, labels, topK):
+        """Partition the chunks of the observations into shards and select
+        the pairs of each shard.
+        Args:
+            data: observations, see `_get_chunks`
+            seed: seed used to sample and fit the dimension reducer
+            reduced (bool): `data` is already projected onto the
+                low-dimensional space and the dimension reducer is skipped.
+            labels (n numpy array): label of each observation, or None
+            topK (int): number of closest pairs per shard, or None
+        Returns:
+            List with the result of `_shard_pairs` for each shard.
+        """
+        chunks, offsets = self._get_chunks(data)
+        labels = self._check_labels(labels, int(offsets[-1]))
+        self._get_grid_method()
+
+        executor = self._get_executor()
+        scObject = self._get_shard_object()
+        dimReducer = None if reduced else self.dimReducer
+        sampleReduced = self._fit_sample(
+            chunks, offsets, seed=seed, reduced=reduced
+        )
+
+        # broadcast the global rescaling bounds
+        bounds = None
+        if self.rescale == "min_max" and chunks:
+            tasks = [
+                executor.submit(_chunk_bounds, dimReducer, chunk)
+                for chunk in chunks
+            ]
+            extremes = np.concatenate(
+                [np.vstack(task.result()) for task in tasks]
+            )
+            bounds = scObject._get_min_max_bounds(extremes)
+        elif self.rescale is not None:
+            # the robust rescaling methods are fitted on the sample
+            bounds = scObject._fit_rescale(sampleReduced)
+
+        sampleBoxIDs = scObject._rescale_and_project(
+            sampleReduced, self.distance, bounds=bounds
+        )
+        cuts = self._get_cuts(sampleBoxIDs)
+
+        if labels is None:
+            chunkLabels = [None] * len(chunks)
+        else:
+            chunkLabels = [
+                labels[offsets[i]:offsets[i + 1]] for i in range(len(chunks))
+            ]
+
+        workDir = tempfile.mkdtemp(prefix="shards-", dir=self.spillDir)
+        try:
+            # shuffle the objects to the shards that need them through files
+            tasks = [
+                executor.submit(
+                    _partition_chunk,
+                    scObject,
+                    dimReducer,
+                    chunk,
+                    offsets[i],
+                    bounds,
+                    cuts,
+                    chunkLabels[i],
+                    workDir,
+                    i,
+                    topK is not None,
+                )
+                for i, chunk in enumerate(chunks)
+            ]
+            for task in tasks:
+                task.result()
+
+            tasks = [
+                executor.submit(
+                    _shard_pairs,
+                    scObject,
+                    workDir,
+                    shard,
+                    len(chunks),
+                    cuts[shard] if shard < len(cuts) else None,
+                    topK,
+                )
+                for shard in range(len(cuts) + 1)
+            ]
+            return [task.result() for task in tasks]
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    def select_pair_shards(
+        self, data, seed=None, reduced=False, labels=None
+    ):
+        """Selects the pairs of each shard, without concatenating them.
+        Args:
+            data: n x p numpy array of observations, or list of chunks of
+                observations that are numpy arrays or paths of .npy files
+                (memory mapped by the tasks)
+            seed=None: seed used to sample and fit the dimension reducer
+            reduced=False (bool): `data` is already projected onto the
+                low-dimensional space and the dimension reducer is skipped.
+            labels=None (n numpy array): label of each observation, see
+                `SparseComputation.select_pairs`
+        Returns:
+            List with a k x 2 numpy array of pairs for each shard. The pairs
+            of a shard that exceed `memory_limit` are written by the shard
+            task to a .npy file in `spill_dir`, which is memory mapped.
+        """
+        results = self._run_shards(data, seed, reduced, labels, None)
+        shards = [
+            pairs if isinstance(pairs, np.ndarray)
+            else np.load(pairs, mmap_mode="r")
+            for pairs, _, _ in results
+        ]
+        self.stats = self._merge_stats(
+            [stats for _, _, stats in results],
+            sum(len(pairs) for pairs in shards),
+        )
+        return shards
+
+    def select_pairs(
+        self,
+        data,
+        seed=None,
+        reduced=False,
+        as_array=False,
+        labels=None,
+        top_k=None,
+    ):
+        """Applies dimension reduction and selects pairs that are close in the
+        low-dimensional space, with the grid work distributed over shards.
+        The pairs of the shards are concatenated into an array, or into a
+        file in `spill_dir` if they exceed `memory_limit`, see
+        `SparseComputation.select_pairs`. Use `select_pair_shards` to keep
+        the pairs of each shard apart.
+        Args:
+            data: n x p numpy array of observations, or list of chunks, see
+                `select_pair_shards`
+            seed=None: seed used to sample and fit the dimension reducer
+            reduced=False (bool): `data` is already projected onto the
+                low-dimensional space and the dimension reducer is skipped.
+            as_array=False (bool): Return the pairs as a k x 2 numpy array.
+            labels=None (n numpy array): label of each observation, see
+                `SparseComputation.select_pairs`
+            top_k=None (int): Select only the `top_k` closest pairs. Each
+                shard selects its `top_k` closest pairs, which are merged.
+        Returns:
+            List of tuples where each tuple is a pair.
+        """
+        if top_k is not None and (not isinstance(top_k, int) or top_k < 1):
+            raise ValueError("top_k should be a positive integer")
+        if self.spillDir is not None and not as_array and top_k is None:
+            raise ValueError("spill_dir requires as_array=True")
+
+        if top_k is not None:
+            results = self._run_shards(data, seed, reduced, labels, top_k)
+            pairs = np.concatenate(
+                [np.zeros((0, 2), dtype=np.intp)]
+                + [pairs for pairs, _, _ in results]
+            )
+            distances = np.concatenate(
+                [np.zeros(0)] + [distances for _, distances, _ in results]
+            )
+            order = np.lexsort((pairs[:, 1], pairs[:, 0], distances))[:top_k]
+            pairs = pairs[order]
+            stats = self._merge_stats(
+                [stats for _, _, stats in results], len(pairs)
+            )
+            stats["topKDistance"] = (
+                float(np.sqrt(distances[order[-1]])) if len(order) else 0.0
+            )
+            self.stats = stats
+            return pairs if as_array else self._to_list(pairs)
+
+        shards = self.select_pair_shards(
+            data, seed=seed, reduced=reduced, labels=labels
+        )
+        spillFiles = [
+            shardPairs.filename
+            for shardPairs in shards
+            if isinstance(shardPairs, np.memmap)
+        ]
+        pairs = self._concatenate_shards(shards)
+        del shards
+        for spillFile in spillFiles:
+            os.remove(spillFile)
+        if isinstance(pairs, np.memmap):
+            self.stats["spillFile"] = pairs.filename
+        return pairs if as_array else self._to_list(pairs)
+
+    def _concatenate_shards(self, shards):
+        """Concatenate the pairs of the shards into an array, or into a file
+        in `spillDir` if they exceed `memoryLimit` (see `_allocate_pairs`)."""
+        pairs = self._allocate_pairs(sum(len(x) for x in shards))
+        position = 0
+        for shardPairs in shards:
+            pairs[position:position + len(shardPairs)] = shardPairs
+            position += len(shardPairs)
+        if isinstance(pairs, np.memmap):
+            pairs.flush()
+        return pairs
@@ -0,0 +1,208 @@
+"""Recall and precision of the selected pairs against exact radius neighbors.
+
+The exact pairs are the pairs of observations within Euclidean distance
+`radius` in the original space. They are computed once on a uniform sample of
+the observations, with a KD-tree or a chunked brute force, and every
+configuration of `SparseComputation` selects pairs on the full data. The
+selected pairs with both objects in the sample are compared with the exact
+pairs of the sample, which gives unbiased estimates of the recall and the
+precision without computing all exact pairs.
+
+Example:
+    evaluator = PairEvaluator(data, radius=0.5, sample_size=5000)
+    results = [evaluator.evaluate(SparseComputation(PCA(k), distance=d))
+               for k in (2, 3, 5) for d in (0.01, 0.02, 0.05)]
+    front = pareto_front(results)
+"""
+import time
+
+import numpy as np
+
+from .dimreducer import _check_random_state
+
+METHODS = ("kd_tree", "brute")
+
+
+def _brute_radius_pairs(data, radius, chunkSize):
+    """Pairs within `radius` by comparing chunks of rows with all later rows.
+    Squared distances are computed with dot products; candidates close to the
+    radius are checked again with the exact differences.
+    """
+    sqNorms = np.einsum("ij,ij->i", data, data)
+    # absolute error of the dot product formula
+    tolerance = 1e-8 * (radius ** 2 + 4 * sqNorms.max()) if len(data) else 0.0
+
+    pairs = [np.zeros((0, 2), dtype=np.int64)]
+    for start in range(0, len(data), chunkSize):
+        end = min(start + chunkSize, len(data))
+        sqDistances = data[start:end].dot(data[start:].T)
+        sqDistances *= -2
+        sqDistances += sqNorms[start:end, None]
+        sqDistances += sqNorms[None, start:]
+
+        # keep i < j only
+        rows, cols = np.nonzero(sqDistances <= radius ** 2 + tolerance)
+        isUpper = rows < cols
+        rows, cols = rows[isUpper] + start, cols[isUpper] + start
+
+        differences = data[rows] - data[cols]
+        isClose = np.einsum("ij,ij->i", differences, differences)
+        isClose = isClose <= radius ** 2
+        pairs.append(np.column_stack((rows[isClose], cols[isClose])))
+    return np.concatenate(pairs).astype(np.int64)
+
+
+def radius_pairs(data, radius, method="kd_tree", chunk_size=1024):
+    """Exact pairs of observations within Euclidean distance `radius`.
+    Args:
+        data (n x p numpy array): vectors corresponding to the observations
+        radius (float): largest distance of a pair
+        method="kd_tree" (str): "kd_tree" (`scipy.spatial.cKDTree`) or
+            "brute" (chunked dot products, better for many features)
+        chunk_size=1024 (int): rows compared at once by "brute"
+    Returns:
+        k x 2 int64 numpy array of pairs (i, j) with i < j, sorted.
+    """
+    if radius < 0:
+        raise ValueError("radius should be nonnegative")
+    if chunk_size < 1:
+        raise ValueError("chunk_size should be a positive integer")
+    data = np.asarray(data, dtype=np.float64)
+
+    if method == "kd_tree":
+        import scipy.spatial
+
+        pairs = scipy.spatial.cKDTree(data).query_pairs(
+            radius, output_type="ndarray"
+        )
+        pairs = pairs.astype(np.int64).reshape(-1, 2)
+    elif method == "brute":
+        pairs = _brute_radius_pairs(data, radius, chunk_size)
+    else:
+        raise ValueError(
+            "Current method: %s is not defined. " % method
+            + "Use one of %s." % ", ".join(METHODS)
+        )
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def _pair_codes(pairs, numObjects):
+    """Unique int64 code of each pair regardless of its order."""
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    return np.unique(pairs.min(axis=1) * numObjects + pairs.max(axis=1))
+
+
+class PairEvaluator(object):
+    def __init__(
+        self,
+        data,
+        radius,
+        sample_size=10000,
+        method="kd_tree",
+        random_state=None,
+    ):
+        """Evaluate selected pairs against the exact pairs within `radius`.
+
+        The exact pairs of a uniform sample of `sample_size` observations are
+        computed once, so many configurations can be compared on the same
+        data.
+
+        Args:
+            data (n x p numpy array): vectors corresponding to the observations
+            radius (float): largest distance of an exact pair in the original
+                space
+            sample_size=10000 (int): number of sampled observations. All
+                observations are used if None or larger than n.
+            method="kd_tree" (str): method of `radius_pairs`
+            random_state (int or numpy.random.Generator): seed or generator of
+                the sample
+        """
+        if not isinstance(data, np.ndarray):
+            raise TypeError("data should be a numpy array")
+        if sample_size is not None and sample_size < 1:
+            raise ValueError("sample_size should be a positive integer")
+
+        self.data = data
+        self.radius = radius
+        if sample_size is None or sample_size >= len(data):
+            self.sample = np.arange(len(data))
+        else:
+            rng = _check_random_state(random_state)
+            self.sample = np.sort(
+                rng.choice(len(data), sample_size, replace=False)
+            )
+
+        start = time.time()
+        exactPairs = radius_pairs(data[self.sample], radius, method=method)
+        self.exactTime = time.time() - start
+        self.numExactPairs = len(exactPairs)
+        self._exactCodes = _pair_codes(exactPairs, len(self.sample))
+
+    def _sample_pairs(self, pairs):
+        """Pairs with both objects in the sample, as sample positions."""
+        positions = np.full(len(self.data), -1, dtype=np.int64)
+        positions[self.sample] = np.arange(len(self.sample))
+        pairs = positions[np.asarray(pairs, dtype=np.int64).reshape(-1, 2)]
+        return pairs[(pairs >= 0).all(axis=1)]
+
+    def evaluate(self, sc_object, seed=None, pairs=None):
+        """Select the pairs of the full data and compare them with the exact
+        pairs on the sample.
+        Args:
+            sc_object (SparseComputation): configuration to evaluate
+            seed=None: seed passed on to `select_pairs`
+            pairs=None (k x 2 numpy array): pairs already selected by
+                `sc_object` on the full data. `select_pairs` is not run and
+                the time is None.
+        Returns:
+            dict with
+                recall: fraction of the exact sample pairs that are selected
+                precision: fraction of the selected sample pairs that are
+                    exact pairs
+                time: seconds of `select_pairs`
+                numPairs: number of selected pairs on the full data
+                numSamplePairs: number of selected pairs in the sample
+                numExactPairs: number of exact pairs in the sample
+                stats: `stats` of `sc_object`
+        """
+        elapsed = None
+        if pairs is None:
+            start = time.time()
+            pairs = sc_object.select_pairs(self.data, seed=seed, as_array=True)
+            elapsed = time.time() - start
+
+        codes = _pair_codes(self._sample_pairs(pairs), len(self.sample))
+        numCorrect = np.isin(codes, self._exactCodes, assume_unique=True)
+        numCorrect = int(numCorrect.sum())
+        return {
+            "recall": numCorrect / float(len(self._exactCodes))
+            if len(self._exactCodes) else 1.0,
+            "precision": numCorrect / float(len(codes)) if len(codes) else 1.0,
+            "time": elapsed,
+            "numPairs": len(pairs),
+            "numSamplePairs": len(codes),
+            "numExactPairs": len(self._exactCodes),
+            "stats": sc_object.stats,
+        }
+
+
+def pareto_front(results, cost="time", quality="recall"):
+    """Indices of the results that are not dominated, i.e. no other result
+    has a lower or equal cost and a higher or equal quality with at least one
+    strict inequality.
+    Args:
+        results (list of dict): results of `PairEvaluator.evaluate`
+        cost="time" (str): key to minimize, e.g. "time" or "numPairs"
+        quality="recall" (str): key to maximize
+    Returns:
+        List of indices sorted by increasing cost.
+    """
+    order = sorted(
+        range(len(results)),
+        key=lambda i: (results[i][cost], -results[i][quality]),
+    )
+    front = []
+    for i in order:
+        if not front or results[i][quality] > results[front[-1]][quality]:
+            front.append(i)
+    return front
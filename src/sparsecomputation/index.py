@@ -0,0 +1,561 @@
+from itertools import product
+import time
+
+import numpy as np
+
+from . import kernels
+from .sparsecomputation import SparseComputation
+
+
+class GridIndex(SparseComputation):
+    def __init__(
+        self,
+        dim_reducer,
+        distance=None,
+        resolution=None,
+        rescale="min_max",
+        rescale_sample_size=100000,
+        clip_quantile=0.01,
+        clip_zscore=3.0,
+    ):
+        """Grid of a fitted data set that serves candidate lookups.
+
+        `fit` reduces, rescales and projects the data once and stores the
+        objects per box. `query` projects new points with the fitted dimension
+        reducer and rescaling parameters and returns the objects in the same or
+        an adjacent box, i.e. the candidates `select_pairs` would pair them
+        with under block enumeration. Points outside the fitted range are
+        clipped onto the boundary boxes, unless `rescale` is None.
+
+        Args:
+            dim_reducer (DimReducer): dimension reducer with `fit_transform`
+                and `transform` methods, or None
+            distance, resolution, rescale, rescale_sample_size, clip_quantile,
+                clip_zscore: see `SparseComputation`
+        """
+        super(GridIndex, self).__init__(
+            dim_reducer,
+            distance=distance,
+            resolution=resolution,
+            method="block_enumeration",
+            rescale=rescale,
+            rescale_sample_size=rescale_sample_size,
+            clip_quantile=clip_quantile,
+            clip_zscore=clip_zscore,
+        )
+        self.grid = None
+        self._bounds = None
+        self._encoding = None
+        self._codes = None
+        self._keyRange = None
+        self._numFeatures = None
+
+    def fit(self, data, seed=None, reduced=False):
+        """Fit the dimension reducer and the rescaling, and build the grid.
+        Args:
+            data (n x p numpy array): vectors corresponding to the observations
+            seed=None: seed passed on to the dimension reducer
+            reduced=False (bool): `data` is already projected onto the
+                low-dimensional space and the dimension reducer is skipped.
+        Returns:
+            self
+        """
+        self._set_grid(self._fit_projection(data, seed=seed, reduced=reduced))
+        return self
+
+    def _fit_projection(self, data, seed=None, reduced=False):
+        """Fit the dimension reducer and the rescaling parameters.
+        Args:
+            data (n x p numpy array): vectors corresponding to the observations
+            seed=None: seed passed on to the dimension reducer
+            reduced=False (bool): `data` is already projected onto the
+                low-dimensional space and the dimension reducer is skipped.
+        Returns:
+            Grid indices of the observations (n x dimLow int numpy array)
+        """
+        reducedData = self._fit_reduction(data, seed=seed, reduced=reduced)
+        self._bounds = self._fit_rescale(reducedData)
+        return self._rescale_and_project(
+            reducedData, self.distance, bounds=self._bounds
+        )
+
+    def _fit_reduction(self, data, seed=None, reduced=False):
+        """Fit the dimension reducer.
+        Args:
+            data (n x p numpy array): vectors corresponding to the observations
+            seed=None: seed passed on to the dimension reducer
+            reduced=False (bool): `data` is already projected onto the
+                low-dimensional space and the dimension reducer is skipped.
+        Returns:
+            Reduced observations (n x dimLow numpy array)
+        """
+        if not isinstance(data, np.ndarray):
+            raise TypeError("data should be a numpy array")
+
+        if reduced or self.dimReducer is None:
+            reducedData = data
+        else:
+            reducedData = self.dimReducer.fit_transform(data, seed=seed)
+        # the input dimension is unknown if only reduced data is seen
+        if reduced and self.dimReducer is not None:
+            self._numFeatures = None
+        else:
+            self._numFeatures = data.shape[1]
+        return reducedData
+
+    def _set_grid(self, boxIDs):
+        """Group the objects by box and encode the keys of the boxes.
+        Args:
+            boxIDs (n x p int numpy array): grid indices of the objects
+        """
+        self.grid = self._get_box_grid(boxIDs)
+
+        # codes of the nonempty boxes are sorted because the keys are
+        self._encoding = kernels.get_key_encoding(self.grid.keys)
+        self._codes = None
+        if self._encoding is not None and len(self.grid.keys):
+            self._codes = kernels.encode_keys(self.grid.keys, self._encoding)
+            self._keyRange = (
+                np.amin(self.grid.keys, axis=0),
+                np.amax(self.grid.keys, axis=0),
+            )
+
+        self.stats = self._get_occupancy_stats(self.grid)
+
+    def _check_fitted(self):
+        if self.grid is None:
+            raise ValueError("The index is not fitted yet. Call fit first.")
+
+    def check_points(self, points, reduced=False):
+        """Check that query points match the dimension of the fitted data,
+        e.g. before sending them to `query` in a batch.
+        Args:
+            points (n x p numpy array): vectors of the points
+            reduced=False (bool): `points` are already projected onto the
+                low-dimensional space.
+        Raises:
+            TypeError if `points` is not a numpy array, and ValueError if the
+            index is not fitted or `points` has the wrong shape.
+        """
+        self._check_fitted()
+        if not isinstance(points, np.ndarray):
+            raise TypeError("points should be a numpy array")
+        if reduced or self.dimReducer is None:
+            numFeatures = self.grid.keys.shape[1]
+        else:
+            numFeatures = self._numFeatures
+        if points.ndim != 2 or (
+            numFeatures is not None and points.shape[1] != numFeatures
+        ):
+            raise ValueError(
+                "points should be a 2d array with %s columns, got shape %s"
+                % (numFeatures, points.shape)
+            )
+
+    def _reduce_points(self, points, reduced=False):
+        """Project new points with the fitted dimension reducer.
+        Args:
+            points (n x p numpy array): vectors of the points
+            reduced=False (bool): `points` are already projected onto the
+                low-dimensional space.
+        Returns:
+            n x dimLow numpy array
+        """
+        if not reduced and self.dimReducer is not None:
+            return self.dimReducer.transform(points)
+        return points
+
+    def _project_points(self, points, reduced=False):
+        """Grid indices of new points.
+        Args:
+            points (n x p numpy array): vectors of the points
+            reduced=False (bool): `points` are already projected onto the
+                low-dimensional space.
+        Returns:
+            n x dimLow int numpy array
+        """
+        return self._rescale_and_project(
+            self._reduce_points(points, reduced),
+            self.distance,
+            bounds=self._bounds,
+        )
+
+    def _lookup_boxes(self, keys):
+        """Identify pairs (i, j) of query boxes and nonempty boxes of the grid
+        that are equal or adjacent.
+        Args:
+            keys (m x p int numpy array): grid indices of the query boxes
+        Returns:
+            k x 2 numpy array of pairs of boxes.
+        """
+        numDims = keys.shape[1]
+        increments = tuple(product(range(-1, 2), repeat=numDims))
+        if self._encoding is None:
+            return self._match_boxes(keys, self.grid.keys, increments)
+
+        # probes outside the occupied range cannot match and may not be
+        # encodable
+        lower, upper = self._keyRange
+
+        boxPairs = [np.zeros((0, 2), dtype=np.intp)]
+        for increment in increments:
+            probes = keys + increment
+            valid = np.flatnonzero(
+                np.all((probes >= lower) & (probes <= upper), axis=1)
+            )
+            probeCodes = kernels.encode_keys(probes[valid], self._encoding)
+            positions = np.searchsorted(self._codes, probeCodes)
+            np.minimum(positions, len(self._codes) - 1, out=positions)
+            found = self._codes[positions] == probeCodes
+            boxPairs.append(
+                np.column_stack((valid[found], positions[found]))
+            )
+        return np.concatenate(boxPairs).astype(np.intp)
+
+    def _candidate_pairs(self, queryGrid):
+        """Pairs of query points and objects in equal or adjacent boxes.
+        Args:
+            queryGrid (BoxGrid): query points per box
+        Returns:
+            k x 2 int numpy array of (point, object) pairs
+        """
+        if len(self.grid.keys) == 0:
+            return np.zeros((0, 2), dtype=np.intp)
+
+        boxPairs = self._lookup_boxes(queryGrid.keys)
+        return kernels.between_box_pairs(
+            queryGrid.indptr,
+            queryGrid.members,
+            self.grid.indptr,
+            self.grid.members,
+            boxPairs,
+        )
+
+    def query_csr(self, points, reduced=False):
+        """Candidates of each point in compressed sparse row layout.
+        Args:
+            points (n x p numpy array): vectors of the query points
+            reduced=False (bool): `points` are already projected onto the
+                low-dimensional space.
+        Returns:
+            (indptr, candidates): the candidates of point i are
+            `candidates[indptr[i]:indptr[i + 1]]`, in increasing order.
+        """
+        self.check_points(points, reduced)
+        numPoints = len(points)
+
+        indptr = np.zeros(numPoints + 1, dtype=np.intp)
+        if numPoints == 0:
+            return indptr, np.zeros(0, dtype=np.intp)
+
+        # points in the same box share a single lookup
+        queryGrid = self._get_box_grid(self._project_points(points, reduced))
+        pairs = self._candidate_pairs(queryGrid)
+
+        order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+        np.cumsum(
+            np.bincount(pairs[:, 0], minlength=numPoints), out=indptr[1:]
+        )
+        return indptr, pairs[order, 1]
+
+    def query(self, points, reduced=False):
+        """Objects in the same or an adjacent box as each point.
+        Args:
+            points (n x p numpy array): vectors of the query points
+            reduced=False (bool): `points` are already projected onto the
+                low-dimensional space.
+        Returns:
+            List with for each point an int numpy array of candidates.
+        """
+        indptr, candidates = self.query_csr(points, reduced=reduced)
+        return np.split(candidates, indptr[1:-1])
+
+
+class StreamingGridIndex(GridIndex):
+    def __init__(
+        self,
+        dim_reducer,
+        distance=None,
+        resolution=None,
+        method="block_shifting",
+        rescale="min_max",
+        compact_fraction=0.25,
+        rescale_sample_size=100000,
+        clip_quantile=0.01,
+        clip_zscore=3.0,
+    ):
+        """Grid index of a sliding window over a stream of observations.
+
+        The dimension reducer is fitted once by `fit`. Observations are then
+        added with `add` and deleted with `remove` or `expire`. Deleted
+        observations are marked with tombstones and added observations are
+        kept in a small delta grid. Once the tombstones and the delta grid
+        exceed `compact_fraction` of the compacted objects, the storage is
+        compacted and the CSR grid rebuilt, so memory is proportional to the
+        number of live observations.
+
+        The rescaling is refitted on the live observations at each
+        compaction and all of them are projected again, so the grid follows
+        the window as it drifts. Between compactions, added observations
+        outside the fitted range are clipped onto the boundary boxes; their
+        number is `numClipped`.
+
+        Observations are identified by the ids returned by `fit` and `add`,
+        which are increasing and never reused.
+
+        Args:
+            dim_reducer (DimReducer): dimension reducer with `fit_transform`
+                and `transform` methods, or None
+            distance, resolution, method, rescale, rescale_sample_size,
+                clip_quantile, clip_zscore: see `SparseComputation`
+            compact_fraction=0.25 (float): fraction of tombstones and
+                uncompacted observations that triggers a compaction
+        """
+        super(StreamingGridIndex, self).__init__(
+            dim_reducer,
+            distance=distance,
+            resolution=resolution,
+            rescale=rescale,
+            rescale_sample_size=rescale_sample_size,
+            clip_quantile=clip_quantile,
+            clip_zscore=clip_zscore,
+        )
+        if compact_fraction <= 0:
+            raise ValueError("compact_fraction should be positive")
+
+        self.method = method
+        self.compactFraction = compact_fraction
+        self._clear(0)
+
+    def _clear(self, numDims):
+        """Remove all observations from the storage."""
+        self._reduced = np.zeros((0, numDims), dtype=np.float64)
+        self._boxIDs = np.zeros((0, numDims), dtype=np.int64)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._timestamps = np.zeros(0, dtype=np.float64)
+        self._alive = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._numCompacted = 0
+        self._numDead = 0
+        self._nextID = 0
+        self._deltaGrid = None
+        self.numCompactions = 0
+        self.numClipped = 0
+
+    def __len__(self):
+        return self._size - self._numDead
+
+    def fit(self, data, seed=None, reduced=False, timestamps=None):
+        """Fit the dimension reducer and the rescaling, and replace the stored
+        observations with `data`.
+        Args:
+            data (n x p numpy array): vectors corresponding to the observations
+            seed=None: seed passed on to the dimension reducer
+            reduced=False (bool): `data` is already projected onto the
+                low-dimensional space and the dimension reducer is skipped.
+            timestamps=None (n numpy array): time of each observation, used by
+                `expire`. Defaults to the current time.
+        Returns:
+            self
+        """
+        reducedData = self._fit_reduction(data, seed=seed, reduced=reduced)
+        self._clear(reducedData.shape[1])
+        self._bounds = self._fit_rescale(reducedData)
+        self._append(reducedData, timestamps)
+        self.compact()
+        return self
+
+    def add(self, data, timestamps=None, reduced=False):
+        """Add observations to the index.
+        Args:
+            data (n x p numpy array): vectors of the new observations
+            timestamps=None (n numpy array): time of each observation, used by
+                `expire`. Defaults to the current time.
+            reduced=False (bool): `data` is already projected onto the
+                low-dimensional space.
+        Returns:
+            int numpy array with the ids of the new observations.
+        """
+        self._check_fitted()
+        if not isinstance(data, np.ndarray):
+            raise TypeError("data should be a numpy array")
+
+        reducedData = self._reduce_points(data, reduced)
+        ids = self._append(reducedData, timestamps)
+        self.numClipped += self._count_clipped(reducedData)
+        self._maybe_compact()
+        return ids
+
+    def _count_clipped(self, reducedData):
+        """Number of reduced observations outside the fitted range, which
+        are clipped onto the boundary boxes."""
+        if self.rescale is None or len(reducedData) == 0:
+            return 0
+        if self.rescale == "quantile":
+            lower, upper = self._bounds[0], self._bounds[-1]
+        else:
+            lower, gap = self._bounds
+            upper = lower + gap
+        outside = (reducedData < lower) | (reducedData > upper)
+        return int(np.count_nonzero(outside.any(axis=1)))
+
+    def _append(self, reducedData, timestamps):
+        """Project reduced observations with the fitted rescaling and
+        append them to the uncompacted storage."""
+        numNew = len(reducedData)
+        if timestamps is None:
+            timestamps = np.full(numNew, time.time())
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if timestamps.shape != (numNew,):
+            raise ValueError(
+                "timestamps should have one entry per observation"
+            )
+
+        # grow the storage geometrically
+        size = self._size + numNew
+        if size > len(self._ids):
+            capacity = max(size, 2 * len(self._ids))
+            self._reduced = self._resize(self._reduced, capacity)
+            self._boxIDs = self._resize(self._boxIDs, capacity)
+            self._ids = self._resize(self._ids, capacity)
+            self._timestamps = self._resize(self._timestamps, capacity)
+            self._alive = self._resize(self._alive, capacity)
+
+        ids = np.arange(self._nextID, self._nextID + numNew, dtype=np.int64)
+        self._reduced[self._size:size] = reducedData
+        self._rescale_and_project(
+            reducedData,
+            self.distance,
+            out=self._boxIDs[self._size:size],
+            bounds=self._bounds,
+        )
+        self._ids[self._size:size] = ids
+        self._timestamps[self._size:size] = timestamps
+        self._alive[self._size:size] = True
+
+        self._size = size
+        self._nextID += numNew
+        self._deltaGrid = None
+        return ids
+
+    def _resize(self, array, capacity):
+        resized = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+        resized[:self._size] = array[:self._size]
+        return resized
+
+    def remove(self, ids):
+        """Remove observations from the index. Unknown ids are ignored.
+        Args:
+            ids (int numpy array): ids of the observations to remove
+        Returns:
+            Number of removed observations.
+        """
+        self._check_fitted()
+        ids = np.asarray(ids, dtype=np.int64).reshape(-1)
+
+        # ids are increasing in storage order
+        rows = np.searchsorted(self._ids[:self._size], ids)
+        rows = rows[rows < self._size]
+        rows = np.unique(rows[np.isin(self._ids[rows], ids)])
+        return self._remove_rows(rows[self._alive[rows]])
+
+    def expire(self, before):
+        """Remove all observations with a timestamp before `before`.
+        Args:
+            before (float): oldest timestamp to keep
+        Returns:
+            Number of removed observations.
+        """
+        self._check_fitted()
+        rows = np.flatnonzero(
+            self._alive[:self._size] & (self._timestamps[:self._size] < before)
+        )
+        return self._remove_rows(rows)
+
+    def _remove_rows(self, rows):
+        self._alive[rows] = False
+        self._numDead += len(rows)
+        self._maybe_compact()
+        return len(rows)
+
+    def _maybe_compact(self):
+        numPending = self._numDead + self._size - self._numCompacted
+        if numPending > self.compactFraction * max(self._numCompacted, 1):
+            self.compact()
+
+    def compact(self):
+        """Drop the removed observations, refit the rescaling on the live
+        observations and rebuild the grid of all observations."""
+        live = np.flatnonzero(self._alive[:self._size])
+        self._reduced = self._reduced[live]
+        if len(live):
+            self._bounds = self._fit_rescale(self._reduced)
+        self._boxIDs = self._rescale_and_project(
+            self._reduced, self.distance, bounds=self._bounds
+        )
+        self._ids = self._ids[live]
+        self._timestamps = self._timestamps[live]
+        self._alive = self._alive[live]
+
+        self._size = len(live)
+        self._numCompacted = len(live)
+        self._numDead = 0
+        self._deltaGrid = None
+        self._set_grid(self._boxIDs)
+        self.numClipped = 0
+        self.numCompactions += 1
+
+    def _get_delta_grid(self):
+        """Grid of the observations added since the last compaction."""
+        if self._deltaGrid is None:
+            grid = self._get_box_grid(
+                self._boxIDs[self._numCompacted:self._size]
+            )
+            self._deltaGrid = grid._replace(
+                members=grid.members + self._numCompacted
+            )
+        return self._deltaGrid
+
+    def _candidate_pairs(self, queryGrid):
+        """Pairs of query points and live observations in equal or adjacent
+        boxes, with the ids of the observations."""
+        pairs = [super(StreamingGridIndex, self)._candidate_pairs(queryGrid)]
+
+        if self._size > self._numCompacted:
+            deltaGrid = self._get_delta_grid()
+            numDims = queryGrid.keys.shape[1]
+            increments = tuple(product(range(-1, 2), repeat=numDims))
+            boxPairs = self._match_boxes(
+                queryGrid.keys, deltaGrid.keys, increments
+            )
+            pairs.append(
+                kernels.between_box_pairs(
+                    queryGrid.indptr,
+                    queryGrid.members,
+                    deltaGrid.indptr,
+                    deltaGrid.members,
+                    boxPairs,
+                )
+            )
+
+        pairs = np.concatenate(pairs)
+        if self._numDead:
+            pairs = pairs[self._alive[pairs[:, 1]]]
+        pairs[:, 1] = self._ids[pairs[:, 1]]
+        return pairs
+
+    def select_index_pairs(self, as_array=False):
+        """Select the pairs of stored observations that are close in the
+        low-dimensional space with `method`. The index is compacted first.
+        Args:
+            as_array=False (bool): Return the pairs as a k x 2 numpy array.
+        Returns:
+            List of tuples of ids where each tuple is a pair.
+        """
+        self._check_fitted()
+        if self._numDead or self._size > self._numCompacted:
+            self.compact()
+
+        rows = self._get_grid_method()(self.grid)
+        pairs = self._ids[rows].reshape(-1, 2)
+        return pairs if as_array else self._to_list(pairs)
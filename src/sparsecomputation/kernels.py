@@ -0,0 +1,688 @@
+"""Kernels that group objects by box and expand box pairs into object pairs.
+
+Box membership is stored in CSR layout: the objects of box `i` are
+`members[indptr[i]:indptr[i + 1]]`. Pair expansion writes into preallocated
+integer arrays whose size is known from the box sizes. The loops are compiled
+with numba if it is installed; otherwise vectorized NumPy implementations are
+used. numba is imported and the loops are compiled the first time an output
+of at least `NUMBA_MIN_PAIRS` pairs is expanded; the compiled loops are cached
+on disk for later processes.
+"""
+from collections import namedtuple
+from itertools import product
+
+import numpy as np
+
+# numba module once imported, False if it is not installed
+_numba = None
+_compiledLoops = {}
+
+
+BoxGrid = namedtuple("BoxGrid", ["keys", "indptr", "members", "labels"])
+BoxGrid.__doc__ = """Objects grouped by box.
+
+Attributes:
+    keys (m x p int numpy array): grid indices of the m nonempty boxes, in
+                                  lexicographic order
+    indptr (m + 1 int numpy array): offsets of each box in `members`
+    members (n int numpy array): objects ordered by box
+    labels (n int numpy array): box of each object
+"""
+
+# Largest code of an encoded box key
+_MAX_CODE = 2 ** 62
+
+# Smallest number of pairs expanded with numba by default. Smaller outputs
+# are expanded faster by NumPy than numba is imported and the loops compiled.
+NUMBA_MIN_PAIRS = 2 ** 20
+
+
+def get_key_encoding(boxIDs):
+    """Mixed-radix encoding of grid indices into single integers.
+    The encoding leaves room for one box on each side of the occupied range,
+    so codes of adjacent boxes can be computed by adding the code of the
+    increment. Codes preserve the lexicographic order of the grid indices.
+    Args:
+        boxIDs (n x p int numpy array): grid indices
+    Returns:
+        (offset, strides) tuple of p int numpy arrays, or None if the codes do
+        not fit in a 64-bit integer.
+    """
+    numDims = boxIDs.shape[1]
+    if len(boxIDs) == 0:
+        return np.zeros(numDims, dtype=np.int64), np.zeros(
+            numDims, dtype=np.int64
+        )
+
+    offset = boxIDs.min(axis=0).astype(np.int64) - 1
+    radix = boxIDs.max(axis=0).astype(np.int64) - offset + 2
+
+    strides = np.ones(numDims, dtype=np.int64)
+    total = 1
+    for dim in range(numDims - 1, -1, -1):
+        strides[dim] = total
+        total *= int(radix[dim])
+        if total > _MAX_CODE:
+            return None
+    return offset, strides
+
+
+def encode_keys(boxIDs, encoding):
+    """Encode grid indices with `get_key_encoding`.
+    Args:
+        boxIDs (n x p int numpy array): grid indices
+        encoding (tuple): offset and strides of the encoding
+    Returns:
+        n int numpy array of codes
+    """
+    offset, strides = encoding
+    return np.dot(boxIDs - offset, strides)
+
+
+def group_boxes(boxIDs):
+    """Group objects with the same grid indices.
+    Args:
+        boxIDs (n x p int numpy array): grid indices of each object
+    Returns:
+        BoxGrid with the nonempty boxes in lexicographic order.
+    """
+    numObjects, numDims = boxIDs.shape
+    encoding = get_key_encoding(boxIDs)
+    if encoding is not None:
+        codes = encode_keys(boxIDs, encoding)
+        _, first, labels = np.unique(
+            codes, return_index=True, return_inverse=True
+        )
+        keys = boxIDs[first]
+    else:
+        keys, labels = np.unique(boxIDs, axis=0, return_inverse=True)
+    labels = labels.reshape(-1).astype(np.intp)
+
+    counts = np.bincount(labels, minlength=len(keys))
+    indptr = np.zeros(len(keys) + 1, dtype=np.intp)
+    np.cumsum(counts, out=indptr[1:])
+    members = np.argsort(labels, kind="mergesort").astype(np.intp)
+    return BoxGrid(keys.reshape(-1, numDims), indptr, members, labels)
+
+
+def coarsen_boxes(grid, coarseKeys):
+    """Merge boxes that are assigned the same coarse grid indices.
+    Args:
+        grid (BoxGrid): objects grouped by box
+        coarseKeys (m x p int numpy array): coarse grid indices of each box
+    Returns:
+        BoxGrid of the coarse boxes. Objects are ordered by coarse box and by
+        fine box within each coarse box.
+    """
+    boxGrid = group_boxes(coarseKeys)
+    sizes = np.diff(grid.indptr)
+
+    boxSizes = sizes[boxGrid.members]
+    members = grid.members[
+        _ranges(grid.indptr[boxGrid.members], boxSizes)
+    ]
+    indptr = np.zeros(len(boxGrid.keys) + 1, dtype=np.intp)
+    np.cumsum(
+        np.bincount(
+            boxGrid.labels, weights=sizes, minlength=len(boxGrid.keys)
+        ).astype(np.intp),
+        out=indptr[1:],
+    )
+    return BoxGrid(boxGrid.keys, indptr, members, boxGrid.labels[grid.labels])
+
+
+def select_boxes(indptr, members, boxes):
+    """Restrict a CSR box membership to a subset of the boxes.
+    Args:
+        indptr (m + 1 int numpy array): box offsets
+        members (n int numpy array): objects ordered by box
+        boxes (int numpy array): boxes to keep
+    Returns:
+        (indptr, members) of the selected boxes
+    """
+    sizes = np.diff(indptr)[boxes]
+    selectedIndptr = np.zeros(len(boxes) + 1, dtype=np.intp)
+    np.cumsum(sizes, out=selectedIndptr[1:])
+    return selectedIndptr, members[_ranges(indptr[boxes], sizes)]
+
+
+def split_ranges(counts, chunkSize):
+    """Split consecutive items into ranges of about `chunkSize` counts. A
+    range holds at least one item, so a single item with a larger count is
+    a range on its own.
+    Args:
+        counts (int numpy array): count of each item
+        chunkSize (int): largest total count of a range of several items
+    Returns:
+        List of (start, end) tuples of the ranges
+    """
+    cumulative = np.cumsum(counts)
+    ranges = []
+    start = 0
+    while start < len(counts):
+        offset = cumulative[start - 1] if start > 0 else 0
+        end = int(np.searchsorted(cumulative, offset + chunkSize, "right"))
+        end = max(end, start + 1)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def count_box_pairs(indptr, boxPairs, indptr2=None):
+    """Number of pairs of each box pair, where a box pair (i, i) stands for
+    the pairs within box i.
+    Args:
+        indptr (m + 1 int numpy array): box offsets
+        boxPairs (k x 2 int numpy array): pairs of boxes
+        indptr2=None (int numpy array): box offsets of the second boxes if
+            they belong to another grid. No box pair is within a box then.
+    Returns:
+        k int numpy array
+    """
+    boxPairs = np.asarray(boxPairs, dtype=np.intp).reshape(-1, 2)
+    counts = count_between_box_pairs(
+        indptr, indptr if indptr2 is None else indptr2, boxPairs
+    )
+    if indptr2 is None:
+        isWithin = boxPairs[:, 0] == boxPairs[:, 1]
+        sizes = np.diff(indptr).astype(np.int64)[boxPairs[isWithin, 0]]
+        counts[isWithin] = sizes * (sizes - 1) // 2
+    return counts
+
+
+def split_box_pairs(indptr, boxPairs, chunkSize, indptr2=None):
+    """Split box pairs into slices of rows of their first box with at most
+    `chunkSize` pairs each, or a single row. A box pair (i, i) stands for the
+    pairs within box i, where a row pairs an object with the later objects of
+    the box. Box pairs with at most `chunkSize` pairs are a single slice.
+    Args:
+        indptr (m + 1 int numpy array): box offsets
+        boxPairs (k x 2 int numpy array): pairs of boxes
+        chunkSize (int): largest number of pairs of a slice of several rows
+        indptr2=None (int numpy array): box offsets of the second boxes if
+            they belong to another grid
+    Returns:
+        (slices, counts): k' x 4 int numpy array of slices (i, j, start, end)
+        holding rows `start:end` of box i, in the order of `boxPairs`, and the
+        number of pairs of each slice.
+    """
+    boxPairs = np.asarray(boxPairs, dtype=np.intp).reshape(-1, 2)
+    if indptr2 is None:
+        isWithin = boxPairs[:, 0] == boxPairs[:, 1]
+        indptr2 = indptr
+    else:
+        isWithin = np.zeros(len(boxPairs), dtype=bool)
+    numRows = np.diff(indptr).astype(np.int64)[boxPairs[:, 0]]
+    rowCounts = np.diff(indptr2).astype(np.int64)[boxPairs[:, 1]]
+    counts = numRows * rowCounts
+    counts[isWithin] = numRows[isWithin] * (numRows[isWithin] - 1) // 2
+
+    slices = np.zeros((len(boxPairs), 4), dtype=np.intp)
+    slices[:, :2] = boxPairs
+    slices[:, 3] = numRows
+    large = np.flatnonzero(counts > chunkSize)
+    if len(large) == 0:
+        return slices, counts
+
+    pieces, pieceCounts = [], []
+    previous = 0
+    for i in large:
+        pieces.append(slices[previous:i])
+        pieceCounts.append(counts[previous:i])
+        if isWithin[i]:
+            rows = np.arange(numRows[i] - 1, -1, -1, dtype=np.int64)
+        else:
+            rows = np.full(numRows[i], rowCounts[i], dtype=np.int64)
+        ranges = np.array(split_ranges(rows, chunkSize), dtype=np.intp)
+        cumulative = np.concatenate(([0], np.cumsum(rows)))
+
+        piece = np.empty((len(ranges), 4), dtype=np.intp)
+        piece[:, :2] = boxPairs[i]
+        piece[:, 2:] = ranges
+        pieces.append(piece)
+        pieceCounts.append(cumulative[ranges[:, 1]] - cumulative[ranges[:, 0]])
+        previous = i + 1
+    pieces.append(slices[previous:])
+    pieceCounts.append(counts[previous:])
+    return np.concatenate(pieces), np.concatenate(pieceCounts)
+
+
+def box_slice_pairs(
+    indptr,
+    members,
+    slices,
+    backend=None,
+    out=None,
+    indptr2=None,
+    members2=None,
+):
+    """All pairs of objects of slices of box pairs, see `split_box_pairs`.
+    Args:
+        indptr (m + 1 int numpy array): box offsets
+        members (n int numpy array): objects ordered by box
+        slices (k x 4 int numpy array): slices (i, j, start, end) of box pairs
+        backend=None (str): "numba" or "numpy", see `within_box_pairs`
+        out=None (k x 2 int numpy array): Array to write the pairs to
+        indptr2=None (int numpy array): box offsets of the second boxes if
+            they belong to another grid
+        members2=None (int numpy array): objects ordered by second box
+    Returns:
+        int numpy array of pairs with the object of the sliced box first.
+        Within a box, the first object of a pair precedes the second object
+        in `members`.
+    """
+    slices = np.asarray(slices, dtype=np.intp).reshape(-1, 4)
+    if indptr2 is None:
+        isWithin = slices[:, 0] == slices[:, 1]
+        indptr2, members2 = indptr, members
+    else:
+        isWithin = np.zeros(len(slices), dtype=bool)
+    numRows = slices[:, 3] - slices[:, 2]
+    rowStarts = indptr[slices[:, 0]] + slices[:, 2]
+
+    # the later objects of the box for a slice within a box, and the second
+    # box otherwise
+    otherStarts = np.where(
+        isWithin, rowStarts + numRows, indptr2[slices[:, 1]]
+    )
+    otherEnds = np.where(
+        isWithin, indptr[slices[:, 0] + 1], indptr2[slices[:, 1] + 1]
+    )
+
+    rowIndptr = np.zeros(len(slices) + 1, dtype=np.intp)
+    np.cumsum(numRows, out=rowIndptr[1:])
+    rowMembers = members[_ranges(rowStarts, numRows)]
+    otherIndptr = np.zeros(len(slices) + 1, dtype=np.intp)
+    np.cumsum(otherEnds - otherStarts, out=otherIndptr[1:])
+    otherMembers = members2[_ranges(otherStarts, otherEnds - otherStarts)]
+
+    withinIndptr, withinMembers = select_boxes(
+        rowIndptr, rowMembers, np.flatnonzero(isWithin)
+    )
+    numWithinPairs = int(count_within_box_pairs(withinIndptr).sum())
+    slicePairs = np.arange(len(slices), dtype=np.intp).repeat(2).reshape(-1, 2)
+    numPairs = numWithinPairs + int(
+        count_between_box_pairs(rowIndptr, otherIndptr, slicePairs).sum()
+    )
+
+    pairs = _check_out(out, numPairs)
+    within_box_pairs(
+        withinIndptr,
+        withinMembers,
+        backend=backend,
+        out=pairs[:numWithinPairs],
+    )
+    between_box_pairs(
+        rowIndptr,
+        rowMembers,
+        otherIndptr,
+        otherMembers,
+        slicePairs,
+        backend=backend,
+        out=pairs[numWithinPairs:],
+    )
+    return pairs if out is None else out
+
+
+def sweep_adjacent_boxes(keys, chunkSize=2 ** 20):
+    """Pairs of adjacent boxes found by joining the boxes dimension by
+    dimension. Boxes are grouped by the prefixes of their grid indices. Two
+    groups of prefixes of length d + 1 can only hold adjacent boxes if their
+    parent groups do, so each level joins the children of the adjacent parent
+    groups with binary searches on the sorted children. The work is
+    proportional to the number of adjacent nonempty prefix groups rather than
+    to the 3^p neighbors of each box.
+    Args:
+        keys (m x p int numpy array): grid indices of the nonempty boxes, in
+                                      lexicographic order
+        chunkSize=2**20 (int): number of group pairs joined at once
+    Returns:
+        k x 2 int numpy array of pairs (i, j) of adjacent boxes with i < j, and
+        the number of candidate groups joined.
+    """
+    numBoxes, numDims = keys.shape
+    if numBoxes == 0 or numDims == 0:
+        return np.zeros((0, 2), dtype=np.intp), 0
+
+    # prefix groups of each length: children of each group of the previous
+    # length and the sorted codes (parent, compressed key) of the groups
+    levels = []
+    starts = np.zeros(1, dtype=np.intp)
+    isNewGroup = np.zeros(numBoxes - 1, dtype=bool)
+    for dim in range(numDims):
+        isNewGroup |= keys[1:, dim] != keys[:-1, dim]
+        childStarts = np.concatenate(([0], np.flatnonzero(isNewGroup) + 1))
+        parents = np.searchsorted(starts, childStarts, side="right") - 1
+        numChildren = np.bincount(parents, minlength=len(starts))
+        firstChild = np.cumsum(numChildren) - numChildren
+
+        childKeys = _compress_keys(keys[childStarts, dim])
+        radix = int(childKeys.max()) + 2
+        codes = parents * radix + childKeys
+        levels.append((numChildren, firstChild, childKeys, radix, codes))
+        starts = childStarts
+
+    # depth first over chunks of pairs (g1, g2) of adjacent prefix groups
+    # with g1 <= g2, starting from the empty prefix shared by all boxes
+    boxPairs = [np.zeros((0, 2), dtype=np.intp)]
+    numCandidates = 0
+    stack = [(0, np.zeros((1, 2), dtype=np.intp))]
+    while stack:
+        dim, groupPairs = stack.pop()
+        if dim == numDims:
+            boxPairs.append(groupPairs[groupPairs[:, 0] != groupPairs[:, 1]])
+            continue
+        if len(groupPairs) > chunkSize:
+            for start in range(0, len(groupPairs), chunkSize):
+                stack.append((dim, groupPairs[start:start + chunkSize]))
+            continue
+
+        numChildren, firstChild, childKeys, radix, codes = levels[dim]
+        counts = numChildren[groupPairs[:, 0]]
+        children1 = _ranges(firstChild[groupPairs[:, 0]], counts)
+        groups2 = np.repeat(groupPairs[:, 1], counts)
+        isSameGroup = np.repeat(groupPairs[:, 0] == groupPairs[:, 1], counts)
+        numCandidates += len(children1)
+
+        probes = groups2 * radix + childKeys[children1]
+        lower = np.searchsorted(codes, probes - 1, side="left")
+        upper = np.searchsorted(codes, probes + 1, side="right")
+        lower[isSameGroup] = np.maximum(
+            lower[isSameGroup], children1[isSameGroup]
+        )
+        lengths = np.maximum(upper - lower, 0)
+
+        stack.append(
+            (
+                dim + 1,
+                np.column_stack(
+                    (np.repeat(children1, lengths), _ranges(lower, lengths))
+                ),
+            )
+        )
+
+    return np.concatenate(boxPairs).astype(np.intp), numCandidates
+
+
+def shift_adjacent_boxes(keys):
+    """Pairs of adjacent boxes found by block shifting. For each of the 2^p
+    binary shifts, the boxes are merged into the boxes of a shifted grid with
+    twice the block width, i.e. box `k` goes to `(k + shift) // 2`. Two boxes
+    are adjacent if and only if they share a coarse box for some shift. Each
+    shift encodes the coarse keys, sorts the boxes by code and emits the pairs
+    within each run of equal codes.
+
+    A pair of boxes shares a coarse box for several shifts if some of their
+    grid indices are equal. It is kept only for the shift where, along each
+    dimension, at least one of the boxes is the lower half of the coarse box,
+    so each pair is emitted exactly once and no deduplication is needed.
+    Args:
+        keys (m x p int numpy array): grid indices of the nonempty boxes
+    Returns:
+        k x 2 int numpy array of pairs (i, j) of adjacent boxes with i < j, in
+        increasing order, and the number of pairs over all shifts before
+        removing the duplicates.
+    """
+    numBoxes, numDims = keys.shape
+    if numBoxes < 2:
+        return np.zeros((0, 2), dtype=np.intp), 0
+
+    bounds = np.stack((keys.min(axis=0) // 2, (keys.max(axis=0) + 1) // 2))
+    encoding = get_key_encoding(bounds)
+    bits = np.left_shift(1, np.arange(numDims, dtype=np.int64))
+
+    shiftedKeys = np.empty(keys.shape, dtype=np.int64)
+    indptr = np.empty(numBoxes + 1, dtype=np.intp)
+    shiftPairs = [np.zeros((0, 2), dtype=np.intp)]
+    numPairs = 0
+    for shift in product((0, 1), repeat=numDims):
+        np.add(keys, shift, out=shiftedKeys)
+        # dimensions along which each box is the upper half of its coarse box
+        upperHalves = np.dot(shiftedKeys & 1, bits)
+        np.floor_divide(shiftedKeys, 2, out=shiftedKeys)
+        if encoding is not None:
+            codes = encode_keys(shiftedKeys, encoding)
+        else:
+            _, codes = np.unique(shiftedKeys, axis=0, return_inverse=True)
+            codes = codes.reshape(-1)
+
+        # stable sort, so the boxes of each run stay in increasing order
+        order = np.argsort(codes, kind="mergesort").astype(np.intp)
+        sortedCodes = codes[order]
+        runStarts = np.flatnonzero(sortedCodes[1:] != sortedCodes[:-1]) + 1
+        numRuns = len(runStarts) + 1
+        if numRuns == numBoxes:
+            continue
+        indptr[0] = 0
+        indptr[1:numRuns] = runStarts
+        indptr[numRuns] = numBoxes
+        pairs = within_box_pairs(indptr[:numRuns + 1], order)
+
+        numPairs += len(pairs)
+        sharedUpperHalves = upperHalves[pairs[:, 0]] & upperHalves[pairs[:, 1]]
+        shiftPairs.append(pairs[sharedUpperHalves == 0])
+
+    pairs = np.concatenate(shiftPairs)
+    codes = pairs[:, 0].astype(np.int64)
+    codes *= numBoxes
+    codes += pairs[:, 1]
+    codes.sort()
+
+    boxPairs = np.empty((len(codes), 2), dtype=np.intp)
+    np.floor_divide(codes, numBoxes, out=boxPairs[:, 0])
+    np.remainder(codes, numBoxes, out=boxPairs[:, 1])
+    return boxPairs, numPairs
+
+
+def _compress_keys(keys):
+    """Map grid indices to small nonnegative integers such that indices that
+    differ by at most one keep their difference and all other indices stay at
+    least two apart.
+    Args:
+        keys (int numpy array): grid indices
+    Returns:
+        int64 numpy array of compressed indices
+    """
+    uniqueKeys, inverse = np.unique(keys, return_inverse=True)
+    compressed = np.zeros(len(uniqueKeys), dtype=np.int64)
+    np.cumsum(np.minimum(np.diff(uniqueKeys), 2), out=compressed[1:])
+    return compressed[inverse.reshape(-1)] + 1
+
+
+def _ranges(starts, lengths):
+    """Concatenation of `arange(start, start + length)` for each range.
+    Args:
+        starts (int numpy array): first value of each range
+        lengths (int numpy array): length of each range
+    Returns:
+        int numpy array of length `sum(lengths)`
+    """
+    lengths = np.asarray(lengths, dtype=np.intp)
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.intp)
+    offsets = np.cumsum(lengths) - lengths
+    result = np.repeat(np.asarray(starts, dtype=np.intp) - offsets, lengths)
+    result += np.arange(total, dtype=np.intp)
+    return result
+
+
+def count_within_box_pairs(indptr):
+    """Number of pairs within each box.
+    Args:
+        indptr (m + 1 int numpy array): box offsets
+    Returns:
+        m int numpy array
+    """
+    sizes = np.diff(indptr).astype(np.int64)
+    return sizes * (sizes - 1) // 2
+
+
+def count_between_box_pairs(indptr1, indptr2, boxPairs):
+    """Number of pairs between the boxes of each box pair.
+    Args:
+        indptr1 (int numpy array): box offsets of the first boxes
+        indptr2 (int numpy array): box offsets of the second boxes
+        boxPairs (k x 2 int numpy array): pairs of boxes
+    Returns:
+        k int numpy array
+    """
+    sizes1 = np.diff(indptr1).astype(np.int64)
+    sizes2 = np.diff(indptr2).astype(np.int64)
+    return sizes1[boxPairs[:, 0]] * sizes2[boxPairs[:, 1]]
+
+
+def _within_box_pairs_numpy(indptr, members, out):
+    sizes = np.diff(indptr)
+    positions = np.arange(len(members), dtype=np.intp)
+    boxEnds = np.repeat(indptr[1:], sizes)
+    numLater = boxEnds - positions - 1
+
+    out[:, 0] = members[np.repeat(positions, numLater)]
+    out[:, 1] = members[_ranges(positions + 1, numLater)]
+
+
+def _between_box_pairs_numpy(
+    indptr1, members1, indptr2, members2, boxPairs, out
+):
+    sizes1 = np.diff(indptr1)[boxPairs[:, 0]]
+    sizes2 = np.diff(indptr2)[boxPairs[:, 1]]
+
+    positions1 = _ranges(indptr1[boxPairs[:, 0]], sizes1)
+    numPartners = np.repeat(sizes2, sizes1)
+    starts2 = np.repeat(indptr2[boxPairs[:, 1]], sizes1)
+
+    out[:, 0] = members1[np.repeat(positions1, numPartners)]
+    out[:, 1] = members2[_ranges(starts2, numPartners)]
+
+
+def _within_box_pairs_loop(indptr, members, out):
+    pos = 0
+    for box in range(len(indptr) - 1):
+        for i in range(indptr[box], indptr[box + 1]):
+            for j in range(i + 1, indptr[box + 1]):
+                out[pos, 0] = members[i]
+                out[pos, 1] = members[j]
+                pos += 1
+
+
+def _between_box_pairs_loop(
+    indptr1, members1, indptr2, members2, boxPairs, out
+):
+    pos = 0
+    for k in range(len(boxPairs)):
+        box1 = boxPairs[k, 0]
+        box2 = boxPairs[k, 1]
+        for i in range(indptr1[box1], indptr1[box1 + 1]):
+            for j in range(indptr2[box2], indptr2[box2 + 1]):
+                out[pos, 0] = members1[i]
+                out[pos, 1] = members2[j]
+                pos += 1
+
+
+def import_numba():
+    """Import numba on first use.
+    Returns:
+        The numba module, or None if it is not installed.
+    """
+    global _numba
+    if _numba is None:
+        try:
+            import numba
+
+            _numba = numba
+        except ImportError:  # pragma: no cover
+            _numba = False
+    return _numba or None
+
+
+def _get_compiled(loop):
+    """Compile a loop with numba on first use. The machine code is cached on
+    disk, so later processes load it instead of compiling the loop again.
+    """
+    if loop not in _compiledLoops:
+        _compiledLoops[loop] = import_numba().njit(nogil=True, cache=True)(
+            loop
+        )
+    return _compiledLoops[loop]
+
+
+def _check_out(out, numPairs):
+    """Output array of `numPairs` pairs, allocated if `out` is None."""
+    if out is None:
+        return np.empty((numPairs, 2), dtype=np.intp)
+    if out.shape != (numPairs, 2):
+        raise ValueError("out should have shape (%d, 2)" % numPairs)
+    # a plain view, so memory-mapped outputs are filled in place
+    return np.asarray(out)
+
+
+def within_box_pairs(indptr, members, backend=None, out=None):
+    """All pairs of objects that share a box.
+    Args:
+        indptr (m + 1 int numpy array): box offsets
+        members (n int numpy array): objects ordered by box
+        backend=None (str): "numba" or "numpy". Defaults to numba if it is
+                            installed, see `_get_backend`.
+        out=None (k x 2 int numpy array): Array to write the pairs to
+    Returns:
+        k x 2 int numpy array of pairs. Within each box, the first object of a
+        pair precedes the second object in `members`.
+    """
+    numPairs = int(count_within_box_pairs(indptr).sum())
+    pairs = _check_out(out, numPairs)
+    if _get_backend(backend, _within_box_pairs_loop, numPairs) == "numpy":
+        _within_box_pairs_numpy(indptr, members, pairs)
+    else:
+        _get_compiled(_within_box_pairs_loop)(indptr, members, pairs)
+    return pairs if out is None else out
+
+
+def between_box_pairs(
+    indptr1, members1, indptr2, members2, boxPairs, backend=None, out=None
+):
+    """All pairs of objects between the boxes of each box pair.
+    Args:
+        indptr1 (int numpy array): box offsets of the first boxes
+        members1 (int numpy array): objects ordered by first box
+        indptr2 (int numpy array): box offsets of the second boxes
+        members2 (int numpy array): objects ordered by second box
+        boxPairs (k x 2 int numpy array): pairs of boxes
+        backend=None (str): "numba" or "numpy". Defaults to numba if it is
+                            installed, see `_get_backend`.
+        out=None (k x 2 int numpy array): Array to write the pairs to
+    Returns:
+        int numpy array of pairs with the object of the first box first.
+    """
+    boxPairs = np.asarray(boxPairs, dtype=np.intp).reshape(-1, 2)
+    numPairs = int(count_between_box_pairs(indptr1, indptr2, boxPairs).sum())
+    pairs = _check_out(out, numPairs)
+    if _get_backend(backend, _between_box_pairs_loop, numPairs) == "numpy":
+        _between_box_pairs_numpy(
+            indptr1, members1, indptr2, members2, boxPairs, pairs
+        )
+    else:
+        _get_compiled(_between_box_pairs_loop)(
+            indptr1, members1, indptr2, members2, boxPairs, pairs
+        )
+    return pairs if out is None else out
+
+
+def _get_backend(backend, loop, numPairs):
+    """Backend that expands `numPairs` pairs. By default, numba is used if it
+    is installed and the loop is already compiled or there are at least
+    `NUMBA_MIN_PAIRS` pairs; small outputs do not pay for importing numba and
+    compiling the loop.
+    """
+    if backend is None:
+        if loop not in _compiledLoops and numPairs < NUMBA_MIN_PAIRS:
+            return "numpy"
+        return "numpy" if import_numba() is None else "numba"
+    if backend not in ("numba", "numpy"):
+        raise ValueError(
+            'Current backend: %s is not defined. ' % backend
+            + 'Set backend to "numba" or "numpy".'
+        )
+    if backend == "numba" and import_numba() is None:
+        raise ImportError("The numba backend requires numba to be installed")
+    return backend
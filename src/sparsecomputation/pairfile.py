@@ -0,0 +1,329 @@
+"""Compact binary file format for pairs.
+
+Pairs are stored in CSR layout: the pairs are sorted by source object, and the
+targets of each source are sorted and delta encoded. The first target of a
+source is stored as the zigzag-encoded difference to the source, the other
+targets as the difference to the previous target. The deltas are written as
+LEB128 varints, so pairs of nearby objects take two or three bytes instead of
+the sixteen bytes of an int64 pair.
+
+The sources are split into chunks of `chunk_rows` consecutive sources that
+are encoded independently, so any source can be decoded without reading the
+rest of the file. Layout (little endian, sections aligned to 8 bytes):
+
+    header         magic, version, flags, numObjects, numPairs, chunkRows,
+                   numChunks, offset of the chunk table
+    indptr         (numObjects + 1) int64: first pair of each source
+    chunk data     varint bytes of each chunk
+    chunk table    (numChunks + 1) int64: offset of each chunk in the file
+
+`PairFile` memory maps the file; the degrees and `indptr` are zero-copy
+views and chunks are decoded on demand.
+"""
+import numpy as np
+
+MAGIC = b"SCPAIRS\x00"
+VERSION = 1
+SYMMETRIC = 1
+
+_HEADER = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("flags", "<u4"),
+        ("numObjects", "<i8"),
+        ("numPairs", "<i8"),
+        ("chunkRows", "<i8"),
+        ("numChunks", "<i8"),
+        ("tableOffset", "<i8"),
+    ]
+)
+
+
+def encode_varints(values):
+    """Encode nonnegative integers as LEB128 varints.
+    Args:
+        values (int numpy array): nonnegative values
+    Returns:
+        uint8 numpy array
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    numBytes = np.ones(len(values), dtype=np.intp)
+    for shift in range(7, 64, 7):
+        numBytes += values >= np.uint64(1) << np.uint64(shift)
+
+    ends = np.cumsum(numBytes)
+    starts = ends - numBytes
+    out = np.empty(int(ends[-1]) if len(values) else 0, dtype=np.uint8)
+    for byte in range(int(numBytes.max()) if len(values) else 0):
+        rows = np.flatnonzero(numBytes > byte)
+        chunk = (values[rows] >> np.uint64(7 * byte)) & np.uint64(0x7F)
+        chunk[numBytes[rows] > byte + 1] |= np.uint64(0x80)
+        out[starts[rows] + byte] = chunk
+    return out
+
+
+def decode_varints(data):
+    """Decode LEB128 varints.
+    Args:
+        data (uint8 numpy array): encoded values
+    Returns:
+        uint64 numpy array
+    """
+    data = np.asarray(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+
+    shifts = np.arange(len(data), dtype=np.intp)
+    shifts -= np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7F).astype(np.uint64) << (7 * shifts).astype(np.uint64)
+    return np.bitwise_or.reduceat(parts, starts)
+
+
+def _zigzag(values):
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _unzigzag(values):
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(
+        values & np.uint64(1)
+    ).astype(np.int64)
+
+
+def _encode_rows(firstSource, indptr, targets):
+    """Encode the targets of consecutive sources.
+    Args:
+        firstSource (int): index of the first source
+        indptr (int numpy array): offsets of the sources in `targets`,
+            starting at 0
+        targets (int numpy array): sorted targets of each source
+    Returns:
+        uint8 numpy array
+    """
+    deltas = np.empty(len(targets), dtype=np.uint64)
+    deltas[1:] = np.diff(targets)
+    isFirst = np.zeros(len(targets), dtype=bool)
+    rowStarts = indptr[:-1][np.diff(indptr) > 0]
+    isFirst[rowStarts] = True
+
+    sources = firstSource + np.flatnonzero(np.diff(indptr) > 0)
+    deltas[isFirst] = _zigzag(targets[rowStarts] - sources)
+    return encode_varints(deltas)
+
+
+def _decode_rows(firstSource, indptr, data):
+    """Decode the targets of consecutive sources encoded by `_encode_rows`."""
+    deltas = decode_varints(data).astype(np.int64)
+    lengths = np.diff(indptr)
+    rowStarts = indptr[:-1][lengths > 0]
+    sources = firstSource + np.flatnonzero(lengths > 0)
+    deltas[rowStarts] = sources + _unzigzag(deltas[rowStarts].view(np.uint64))
+
+    # cumulative sum within each source
+    targets = np.cumsum(deltas)
+    rowOffsets = targets[rowStarts] - deltas[rowStarts]
+    targets -= np.repeat(rowOffsets, lengths[lengths > 0])
+    return targets
+
+
+def _align(f):
+    """Pad a file to a multiple of 8 bytes."""
+    position = f.tell()
+    f.write(b"\x00" * (-position % 8))
+    return f.tell()
+
+
+def write_pair_file(
+    path, pairs, num_objects=None, symmetric=False, chunk_rows=4096
+):
+    """Write pairs to a compact pair file.
+    Args:
+        path (str): output file
+        pairs (k x 2 int numpy array): pairs, e.g. from `select_pairs` with
+            `as_array=True`
+        num_objects=None (int): number of objects. Defaults to the largest
+            index plus one.
+        symmetric=False (bool): store each pair under both objects, so the
+            targets of an object are all its neighbors. Otherwise each pair is
+            stored once under its smaller object.
+        chunk_rows=4096 (int): number of sources encoded together. Smaller
+            chunks give faster random access and larger files.
+    Returns:
+        Number of bytes written.
+    """
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    if chunk_rows < 1:
+        raise ValueError("chunk_rows should be positive")
+    if len(pairs) and pairs.min() < 0:
+        raise ValueError("pairs should be nonnegative")
+    if num_objects is None:
+        num_objects = int(pairs.max()) + 1 if len(pairs) else 0
+    elif len(pairs) and pairs.max() >= num_objects:
+        raise ValueError("pairs should be smaller than num_objects")
+
+    if symmetric:
+        sources = np.concatenate((pairs[:, 0], pairs[:, 1]))
+        targets = np.concatenate((pairs[:, 1], pairs[:, 0]))
+    else:
+        sources = pairs.min(axis=1)
+        targets = pairs.max(axis=1)
+    order = np.lexsort((targets, sources))
+    sources, targets = sources[order], targets[order]
+
+    indptr = np.zeros(num_objects + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=num_objects), out=indptr[1:])
+
+    numChunks = -(-num_objects // chunk_rows)
+    header = np.zeros(1, dtype=_HEADER)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["flags"] = SYMMETRIC if symmetric else 0
+    header["numObjects"] = num_objects
+    header["numPairs"] = len(targets)
+    header["chunkRows"] = chunk_rows
+    header["numChunks"] = numChunks
+
+    chunkOffsets = np.zeros(numChunks + 1, dtype=np.int64)
+    with open(path, "wb") as f:
+        f.write(header.tobytes())
+        _align(f)
+        f.write(indptr.astype("<i8").tobytes())
+
+        for chunk in range(numChunks):
+            chunkOffsets[chunk] = f.tell()
+            first = chunk * chunk_rows
+            last = min(first + chunk_rows, num_objects)
+            rowIndptr = indptr[first:last + 1] - indptr[first]
+            data = _encode_rows(
+                first, rowIndptr, targets[indptr[first]:indptr[last]]
+            )
+            f.write(data.tobytes())
+        chunkOffsets[numChunks] = f.tell()
+
+        header["tableOffset"] = _align(f)
+        f.write(chunkOffsets.astype("<i8").tobytes())
+        size = f.tell()
+
+        f.seek(0)
+        f.write(header.tobytes())
+    return size
+
+
+class PairFile(object):
+    def __init__(self, path):
+        """Reader of a compact pair file written by `write_pair_file`.
+
+        The file is memory mapped. `indptr` and `degrees` are views of the
+        file; the targets are decoded one chunk at a time.
+
+        Args:
+            path (str): pair file
+        """
+        self._data = np.memmap(path, dtype=np.uint8, mode="r")
+        if len(self._data) < _HEADER.itemsize:
+            raise ValueError("%s is not a pair file" % path)
+        header = self._data[:_HEADER.itemsize].view(_HEADER)[0]
+        if self._data[:len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError("%s is not a pair file" % path)
+        if header["version"] != VERSION:
+            raise ValueError(
+                "Pair file version %d is not supported" % header["version"]
+            )
+
+        self.numObjects = int(header["numObjects"])
+        self.numPairs = int(header["numPairs"])
+        self.chunkRows = int(header["chunkRows"])
+        self.numChunks = int(header["numChunks"])
+        self.symmetric = bool(header["flags"] & SYMMETRIC)
+
+        start = _HEADER.itemsize + (-_HEADER.itemsize % 8)
+        self.indptr = self._data[
+            start:start + 8 * (self.numObjects + 1)
+        ].view("<i8")
+        tableOffset = int(header["tableOffset"])
+        self._chunkOffsets = self._data[
+            tableOffset:tableOffset + 8 * (self.numChunks + 1)
+        ].view("<i8")
+
+        self._cachedChunk = None
+        self._cachedTargets = None
+
+    def __len__(self):
+        return self.numPairs
+
+    @property
+    def degrees(self):
+        """Number of targets of each object."""
+        return np.diff(self.indptr)
+
+    def read_chunk(self, chunk):
+        """Decode the targets of the sources of one chunk.
+        Args:
+            chunk (int): index of the chunk
+        Returns:
+            int64 numpy array with the targets of the sources
+            `chunk * chunkRows` to `(chunk + 1) * chunkRows - 1`, in order.
+        """
+        if not 0 <= chunk < self.numChunks:
+            raise IndexError("chunk %d is out of range" % chunk)
+        if chunk != self._cachedChunk:
+            first = chunk * self.chunkRows
+            last = min(first + self.chunkRows, self.numObjects)
+            rowIndptr = self.indptr[first:last + 1] - self.indptr[first]
+            data = self._data[
+                self._chunkOffsets[chunk]:self._chunkOffsets[chunk + 1]
+            ]
+            self._cachedTargets = _decode_rows(first, rowIndptr, data)
+            self._cachedChunk = chunk
+        return self._cachedTargets
+
+    def neighbors(self, source):
+        """Targets of one object.
+        Args:
+            source (int): index of the object
+        Returns:
+            Sorted int64 numpy array
+        """
+        if not 0 <= source < self.numObjects:
+            raise IndexError("object %d is out of range" % source)
+        chunk = source // self.chunkRows
+        offset = self.indptr[chunk * self.chunkRows]
+        targets = self.read_chunk(chunk)
+        return targets[
+            self.indptr[source] - offset:self.indptr[source + 1] - offset
+        ]
+
+    def iter_pairs(self):
+        """Pairs of each chunk.
+        Yields:
+            k x 2 int64 numpy array of (source, target) pairs
+        """
+        for chunk in range(self.numChunks):
+            first = chunk * self.chunkRows
+            last = min(first + self.chunkRows, self.numObjects)
+            sources = np.repeat(
+                np.arange(first, last, dtype=np.int64),
+                np.diff(self.indptr[first:last + 1]),
+            )
+            yield np.column_stack((sources, self.read_chunk(chunk)))
+
+    def to_pairs(self):
+        """All (source, target) pairs as a k x 2 int64 numpy array."""
+        return np.concatenate(
+            [np.zeros((0, 2), dtype=np.int64)] + list(self.iter_pairs())
+        )
+
+    def to_csr(self):
+        """All pairs in CSR layout.
+        Returns:
+            (indptr, targets) int64 numpy arrays
+        """
+        targets = [np.zeros(0, dtype=np.int64)]
+        targets += [
+            self.read_chunk(chunk).copy() for chunk in range(self.numChunks)
+        ]
+        return np.array(self.indptr), np.concatenate(targets)
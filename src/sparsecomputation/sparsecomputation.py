@@ -1,7 +1,66 @@
+from collections import OrderedDict
 from itertools import product, combinations
-import six.moves
+import copy
+import hashlib
+import os
+import tempfile
 import numpy as np
 
+from . import kernels
+
+# Bytes of one pair of object indices
+PAIR_BYTES = 2 * np.dtype(np.intp).itemsize
+# Peak bytes per pair expanded in memory: the pairs, and a concatenated copy
+# or the temporary index arrays of the expansion
+EXPANSION_PAIR_BYTES = 2 * PAIR_BYTES
+# Peak bytes per pair converted into a list of tuples of Python ints
+LIST_PAIR_BYTES = 10 * PAIR_BYTES
+
+
+def _fingerprint(value):
+    """Hashable fingerprint of the input data or of a parameter of the
+    dimension reducer. Arrays are hashed by their bytes, since their repr
+    abbreviates large arrays."""
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        digest = hashlib.sha1(np.ascontiguousarray(value).view(np.uint8))
+        return (value.shape, value.dtype.str, digest.hexdigest())
+    return repr(value)
+
+
+def _is_generator(value):
+    """Whether `value` is a numpy random generator."""
+    generators = (np.random.RandomState,)
+    if hasattr(np.random, "Generator"):
+        generators += (np.random.Generator,)
+    return isinstance(value, generators)
+
+
+class PairMemoryError(MemoryError):
+    def __init__(self, numPairs, memoryLimit, pairBytes=EXPANSION_PAIR_BYTES):
+        """Raised before expanding more pairs than fit in `memory_limit`.
+        Args:
+            numPairs (int): estimated number of pairs
+            memoryLimit (int): memory limit in bytes
+            pairBytes=EXPANSION_PAIR_BYTES (int): estimated peak bytes per
+                pair, `LIST_PAIR_BYTES` for a list of tuples
+        """
+        self.numPairs = numPairs
+        self.estimatedBytes = numPairs * pairBytes
+        self.memoryLimit = memoryLimit
+        if pairBytes >= LIST_PAIR_BYTES:
+            hint = "Use as_array=True to get the pairs as a numpy array."
+        else:
+            hint = (
+                "Decrease the distance (increase the resolution), or set "
+                "spill_dir to write the pairs to disk."
+            )
+        super(PairMemoryError, self).__init__(
+            "Selecting about %d pairs needs %.1f MB, more than the "
+            "memory_limit of %.1f MB. %s"
+            % (numPairs, self.estimatedBytes / 2.0 ** 20,
+               memoryLimit / 2.0 ** 20, hint)
+        )
+
 
 class SparseComputation(object):
     def __init__(
@@ -11,6 +70,14 @@ class SparseComputation(object):
         resolution=None,
         method="block_shifting",
         rescale="min_max",
+        cache_memory=0,
+        pair_type=None,
+        rescale_sample_size=100000,
+        clip_quantile=0.01,
+        clip_zscore=3.0,
+        neighbor_search="probe",
+        memory_limit=None,
+        spill_dir=None,
     ):
         self.dimReducer = dim_reducer
 
@@ -30,8 +97,32 @@ class SparseComputation(object):
 
         self.rescale = rescale
         self.method = method
+        self.pairType = pair_type
+        self.neighborSearch = neighbor_search
+
+        if rescale_sample_size < 1:
+            raise ValueError("rescale_sample_size should be positive")
+        if not 0 <= clip_quantile < 0.5:
+            raise ValueError("clip_quantile should be in [0, 0.5)")
+        if clip_zscore <= 0:
+            raise ValueError("clip_zscore should be positive")
+        self.rescaleSampleSize = rescale_sample_size
+        self.clipQuantile = clip_quantile
+        self.clipZscore = clip_zscore
         self.stats = None
 
+        # bytes of pairs held in memory; larger outputs are written to a
+        # file in `spillDir` or raise a PairMemoryError
+        if memory_limit is not None and memory_limit < 0:
+            raise ValueError("memory_limit should be nonnegative")
+        self.memoryLimit = memory_limit
+        self.spillDir = spill_dir
+
+        if cache_memory < 0:
+            raise ValueError("cache_memory should be nonnegative")
+        self.cacheMemory = cache_memory
+        self._reducedCache = OrderedDict()
+
     @property
     def resolution(self):
         return 1 / float(self.distance)
@@ -40,49 +131,290 @@ class SparseComputation(object):
     def resolution(self, x):
         self.distance = 1 / float(x)
 
-    def _rescale_min_max(self, data, eps=1e-8):
+    def _get_cache_key(self, data, seed):
+        """Fingerprint of the input data and the dimension reducer.
+        Args:
+            data (n x p numpy array): vectors corresponding to the observations
+            seed: seed passed on to the dimension reducer
+        Returns:
+            Hashable key identifying the reduced data, or None if the seed or
+            a parameter of the reducer is a random generator, which draws a
+            different projection on every fit.
+        """
+        params = dict(
+            (key, value)
+            for key, value in vars(self.dimReducer).items()
+            if not key.startswith("_")
+        )
+        if _is_generator(seed) or any(map(_is_generator, params.values())):
+            return None
+        reducerParams = sorted(
+            (key, _fingerprint(value)) for key, value in params.items()
+        )
+        return (
+            _fingerprint(data),
+            type(self.dimReducer).__name__,
+            tuple(reducerParams),
+            seed,
+        )
+
+    def reduce_data(self, data, seed=None):
+        """Project the data onto the low-dimensional space.
+        Projections are cached by a fingerprint of the data and the parameters
+        of the dimension reducer, so repeated calls on the same data (e.g. a
+        sweep over `distance` or `method`) fit the reducer only once. The
+        least recently used projections are evicted when the cache exceeds
+        `cacheMemory` bytes. Caching is disabled if `cacheMemory` is 0, and
+        skipped if the seed or the reducer's `random_state` is a random
+        generator.
+        Args:
+            data (n x p numpy array): vectors corresponding to the observations
+            seed=None: seed passed on to the dimension reducer
+        Returns:
+            n x dimLow numpy array with the reduced data.
+        """
+        if self.dimReducer is None:
+            return data
+
+        if self.cacheMemory <= 0:
+            return self.dimReducer.fit_transform(data, seed=seed)
+
+        key = self._get_cache_key(data, seed)
+        if key is None:
+            return self.dimReducer.fit_transform(data, seed=seed)
+        if key in self._reducedCache:
+            reducedData = self._reducedCache.pop(key)
+            self._reducedCache[key] = reducedData
+            return reducedData
+
+        reducedData = self.dimReducer.fit_transform(data, seed=seed)
+        if reducedData.nbytes <= self.cacheMemory:
+            self._reducedCache[key] = reducedData
+            self._evict_least_recently_used()
+        return reducedData
+
+    def _evict_least_recently_used(self):
+        """Drop cached projections until the cache fits in `cacheMemory`."""
+        cachedBytes = sum(x.nbytes for x in self._reducedCache.values())
+        while self._reducedCache and cachedBytes > self.cacheMemory:
+            _, reducedData = self._reducedCache.popitem(last=False)
+            cachedBytes -= reducedData.nbytes
+
+    def evict(self, data, seed=None):
+        """Remove the cached projection of `data` if there is one.
+        Args:
+            data (n x p numpy array): vectors corresponding to the observations
+            seed=None: seed that was passed on to the dimension reducer
+        Returns:
+            True if a projection was removed from the cache.
+        """
+        if self.dimReducer is None:
+            return False
+        key = self._get_cache_key(data, seed)
+        return self._reducedCache.pop(key, None) is not None
+
+    def clear_cache(self):
+        """Remove all cached projections."""
+        self._reducedCache.clear()
+
+    def _get_min_max_bounds(self, data):
+        """Compute the offset and scale used by min-max rescaling.
+        Args:
+            data (n x p numpy array): Data to rescale
+        Returns:
+            minimum (1 x p numpy array): Smallest value in each dimension
+            gap (1 x p numpy array): Range of each dimension (1 if constant)
+        """
+        maximum = np.amax(data, axis=0, keepdims=True)
+        minimum = np.amin(data, axis=0, keepdims=True).astype(np.float64)
+
+        gap = maximum - minimum
+        gap[gap <= 0] = 1.0
+        return minimum, gap
+
+    def _rescale_min_max(self, data, eps=1e-8, out=None, bounds=None):
         """Rescale the data to interval [0, 1) in each dimension.
         Args:
             data (n x p numpy array): Data to rescale
             eps=1e-8 (float): Largest data point is projected to 1-eps
+            out=None (n x p float numpy array): Buffer for the result. May be
+                `data` itself to rescale in place.
+            bounds=None (tuple): minimum and gap to rescale with, e.g. computed
+                on a larger data set with `_get_min_max_bounds`
         Returns:
             rescaledData (n x p numpy array): Rescaled data
         """
-        maximum = np.amax(data, axis=0, keepdims=True)
-        minimum = np.amin(data, axis=0, keepdims=True)
+        if bounds is None:
+            bounds = self._get_min_max_bounds(data)
+        minimum, gap = bounds
 
-        gap = maximum - minimum
-        gap = np.where(gap > 0, gap, 1.0)
+        if out is None:
+            out = np.empty(data.shape, dtype=np.float64)
+        np.subtract(data, minimum, out=out)
+        np.divide(out, gap, out=out)
+        np.clip(out, 0.0, 1.0 - eps, out=out)
+        return out
 
-        rescaledData = (data - minimum) / gap
+    def _rescale_quantile(self, data, quantiles, eps=1e-8, out=None):
+        """Map each dimension to [0, 1) by its empirical distribution.
+        Args:
+            data (n x p numpy array): Data to rescale
+            quantiles (k x p numpy array): quantiles of each dimension at
+                k equally spaced levels
+            eps=1e-8 (float): Largest data point is projected to 1-eps
+            out=None (n x p float numpy array): Buffer for the result
+        Returns:
+            rescaledData (n x p numpy array): Rescaled data
+        """
+        if out is None:
+            out = np.empty(data.shape, dtype=np.float64)
+        levels = np.linspace(0.0, 1.0, len(quantiles))
+        for dim in range(data.shape[1]):
+            out[:, dim] = np.interp(data[:, dim], quantiles[:, dim], levels)
+        np.minimum(out, 1.0 - eps, out=out)
+        return out
 
-        rescaledData = np.where(rescaledData >= 1.0, 1.0 - eps, rescaledData)
-        return rescaledData
+    def _get_rescale_sample(self, data):
+        """Sample of at most `rescaleSampleSize` observations used to fit the
+        robust rescaling methods. The sample is fixed for given data and its
+        rows are drawn in O(`rescaleSampleSize`), not O(n).
+        """
+        if len(data) <= self.rescaleSampleSize:
+            return data
+        if hasattr(np.random, "default_rng"):
+            rows = np.random.default_rng(0).choice(
+                len(data), self.rescaleSampleSize, replace=False, shuffle=False
+            )
+        else:
+            # RandomState.choice permutes all n rows, sample with replacement
+            rows = np.unique(
+                np.random.RandomState(0).randint(
+                    0, len(data), self.rescaleSampleSize
+                )
+            )
+        return data[np.sort(rows)]
 
-    def _rescale_data(self, data):
+    def _fit_rescale(self, data):
+        """Fit the parameters of the rescaling method.
+        "min_max" uses the range of all data. The robust methods are fitted
+        on a sample: "quantile_min_max" maps the `clipQuantile` and
+        `1 - clipQuantile` quantiles to 0 and 1, "zscore" maps `clipZscore`
+        standard deviations below and above the mean to 0 and 1, and
+        "quantile" maps each dimension by its empirical distribution. Values
+        outside [0, 1) are clipped.
+        Args:
+            data (n x p numpy array): Data to rescale
+        Returns:
+            Offset and gap of each dimension (1 x p numpy arrays), or the
+            quantiles of each dimension for "quantile".
+        """
         if self.rescale is None:
-            return data
+            return None
         elif self.rescale == "min_max":
-            return self._rescale_min_max(data)
+            return self._get_min_max_bounds(data)
+
+        sample = self._get_rescale_sample(data)
+        if self.rescale == "quantile_min_max":
+            lower, upper = np.percentile(
+                sample,
+                [100 * self.clipQuantile, 100 * (1 - self.clipQuantile)],
+                axis=0,
+            )
+            minimum = lower.reshape(1, -1)
+            gap = (upper - lower).reshape(1, -1)
+        elif self.rescale == "zscore":
+            mean = np.mean(sample, axis=0, keepdims=True)
+            std = np.std(sample, axis=0, keepdims=True)
+            minimum = mean - self.clipZscore * std
+            gap = 2 * self.clipZscore * std
+        elif self.rescale == "quantile":
+            numQuantiles = min(1000, len(sample))
+            return np.percentile(
+                sample, np.linspace(0, 100, numQuantiles), axis=0
+            ).reshape(numQuantiles, -1)
         else:
             raise ValueError(
                 "Current rescaling method: %s is not defined." % self.rescale
-                + 'Set self.rescale to "min_max" or None.'
+                + 'Set self.rescale to "min_max", "quantile_min_max", '
+                + '"zscore", "quantile", or None.'
             )
 
-    def _project_onto_grid(self, data, distance):
+        gap[gap <= 0] = 1.0
+        return minimum, gap
+
+    def _rescale_data(self, data, out=None, bounds=None):
+        """Rescale the data with the rescaling method `self.rescale`.
+        Args:
+            data (n x p numpy array): Data to rescale
+            out=None (n x p float numpy array): Buffer for the result
+            bounds=None: fitted rescaling parameters (see `_fit_rescale`), e.g.
+                fitted on a larger data set. Fitted on `data` if None.
+        Returns:
+            rescaledData (n x p numpy array): Rescaled data
+        """
+        if self.rescale is None:
+            return data
+        if bounds is None:
+            bounds = self._fit_rescale(data)
+        if self.rescale == "quantile":
+            return self._rescale_quantile(data, bounds, out=out)
+        return self._rescale_min_max(data, out=out, bounds=bounds)
+
+    def _project_onto_grid(self, data, distance, out=None, buffer=None):
         """Project onto a grid with block width `distance`.
         Divide each datapoint along each dimension by the block width and round
         down.
         Args:
             data (n x p numpy array): data to project
             distance (int): grid width
+            out=None (n x p int numpy array): Buffer for the grid indices
+            buffer=None (n x p float numpy array): Scratch space for the
+                division. May be `data` itself if it can be overwritten.
         Returns:
             Grid indices (n x p numpy array)
         """
-        projectedData = data / float(distance)
-        projectedData = np.floor(projectedData).astype("int")
-        return projectedData
+        if buffer is None:
+            buffer = np.empty(data.shape, dtype=np.float64)
+        np.divide(data, float(distance), out=buffer)
+        np.floor(buffer, out=buffer)
+
+        if out is None:
+            out = np.empty(data.shape, dtype=np.int64)
+        np.copyto(out, buffer, casting="unsafe")
+        return out
+
+    def _rescale_and_project(self, data, distance, out=None, bounds=None):
+        """Rescale the data and project it onto a grid with block width
+        `distance` using a single float scratch buffer.
+        Args:
+            data (n x p numpy array): data to project
+            distance (float): grid width
+            out=None (n x p int numpy array): Buffer for the grid indices
+            bounds=None: rescaling parameters, see `_fit_rescale`
+        Returns:
+            Grid indices (n x p numpy array)
+        """
+        buffer = np.empty(data.shape, dtype=np.float64)
+        rescaledData = self._rescale_data(data, out=buffer, bounds=bounds)
+        return self._project_onto_grid(
+            rescaledData, distance, out=out, buffer=buffer
+        )
+
+    def _shift_box_ids(self, boxIDs, shift, out=None):
+        """Grid indices of shifted objects on a grid of twice the width.
+        Shifting an object by `shift * distance` and projecting it onto a grid
+        with block width `2 * distance` is equivalent to adding `shift` to its
+        grid indices at width `distance` and halving them (rounding down).
+        Args:
+            boxIDs (n x p int numpy array): grid indices at width `distance`
+            shift (tuple): binary shift vector
+            out=None (n x p int numpy array): Buffer for the shifted indices
+        Returns:
+            Grid indices (n x p numpy array) on the coarse grid
+        """
+        out = np.add(boxIDs, shift, out=out)
+        np.floor_divide(out, 2, out=out)
+        return out
 
     def _get_box_dict(self, data):
         """Identify groups of row entries with same vector in array.
@@ -123,58 +455,595 @@ class SparseComputation(object):
             shifts.append(tuple([int(x) for x in np.binary_repr(i, numDims)]))
         return shifts
 
-    def _block_enumeration(self, data):
-        """Identify pairs by enumerating adjacent blocks
+    def _get_box_grid(self, boxIDs):
+        """Group objects by box in CSR layout.
         Args:
-            data (n x p numpy array): vectors corresponding to the observations
+            boxIDs (n x p int numpy array): grid indices of each object
         Returns:
-            List of tuples where each tuple is a pair.
+            BoxGrid with the nonempty boxes and their objects.
         """
-        numDims = data.shape[1]
+        return kernels.group_boxes(boxIDs)
 
-        rescaledData = self._rescale_data(data)
-        boxIDs = self._project_onto_grid(rescaledData, self.distance)
-        boxDict = self._get_box_dict(boxIDs)
+    def _coarsen_box_grid(self, grid, shift=None):
+        """Merge boxes into the boxes of a grid with twice the block width.
+        Args:
+            grid (BoxGrid): objects per box
+            shift=None (tuple): binary shift vector applied to the objects
+                before merging, in units of the block width of `grid`
+        Returns:
+            BoxGrid of the coarse grid.
+        """
+        if shift is None:
+            shift = (0,) * grid.keys.shape[1]
+        coarseKeys = self._shift_box_ids(grid.keys, shift)
+        return kernels.coarsen_boxes(grid, coarseKeys)
 
-        pairs = []
+    def _expand_box_pairs(self, grid, boxPairs, labels=None):
+        """Expand pairs of adjacent boxes into pairs of objects.
+        Args:
+            grid (BoxGrid): objects per box
+            boxPairs (k x 2 int numpy array): pairs of adjacent boxes
+            labels=None (n numpy array): label of each object. Only pairs
+                accepted by the pair type are expanded if set.
+        Returns:
+            Numpy array of pairs within each box and between adjacent boxes,
+            and the number of pairs within boxes.
+        """
+        if labels is not None:
+            return self._expand_labeled_box_pairs(grid, boxPairs, labels)
+
+        # both parts are written into one array instead of concatenated
+        numWithinPairs = int(kernels.count_within_box_pairs(grid.indptr).sum())
+        numBetweenPairs = int(
+            kernels.count_between_box_pairs(
+                grid.indptr, grid.indptr, boxPairs
+            ).sum()
+        )
+        pairs = np.empty((numWithinPairs + numBetweenPairs, 2), dtype=np.intp)
+        kernels.within_box_pairs(
+            grid.indptr, grid.members, out=pairs[:numWithinPairs]
+        )
+        kernels.between_box_pairs(
+            grid.indptr,
+            grid.members,
+            grid.indptr,
+            grid.members,
+            boxPairs,
+            out=pairs[numWithinPairs:],
+        )
+        return pairs, numWithinPairs
+
+    def _expand_box_pairs_within_limit(self, grid, boxPairs, labels=None):
+        """Expand pairs of adjacent boxes like `_expand_box_pairs` within
+        `memoryLimit` bytes. The number of pairs is counted from the box sizes
+        (of the label groups accepted by the pair type, if labels are set)
+        before anything is expanded. The pairs are expanded in chunks into an
+        array, or into a file in `spillDir` if the array does not fit, see
+        `_allocate_pairs`.
+        Args:
+            grid (BoxGrid): objects per box
+            boxPairs (k x 2 int numpy array): pairs of adjacent boxes
+            labels=None (n numpy array): label of each object
+        Returns:
+            Numpy array (or numpy memmap if spilled) of pairs within each box
+            and between adjacent boxes, and the number of pairs within boxes.
+        """
+        if self.memoryLimit is None:
+            return self._expand_box_pairs(grid, boxPairs, labels)
+
+        if labels is None:
+            boxes = np.arange(len(grid.keys), dtype=np.intp)
+            expandedGrid = grid
+            expandedPairs = np.concatenate(
+                (np.column_stack((boxes, boxes)), boxPairs)
+            )
+            numWithinBoxPairs = len(boxes)
+        else:
+            expandedGrid, expandedPairs, numWithinBoxPairs = (
+                self._select_group_pairs(grid, boxPairs, labels)
+            )
+
+        counts = kernels.count_box_pairs(expandedGrid.indptr, expandedPairs)
+        pairs = self._allocate_pairs(int(counts.sum()))
+        self._fill_box_pairs(
+            expandedGrid.indptr, expandedGrid.members, expandedPairs, pairs
+        )
+        return pairs, int(counts[:numWithinBoxPairs].sum())
+
+    def _allocate_pairs(self, numPairs):
+        """Output array of pairs counted before their expansion. It is held
+        in memory if the pairs and the temporary arrays of their expansion fit
+        in `memoryLimit` bytes, and is a file in `spillDir` otherwise.
+        Args:
+            numPairs (int): number of pairs
+        Returns:
+            numPairs x 2 int numpy array or numpy memmap
+        Raises:
+            PairMemoryError if the pairs do not fit and `spillDir` is None.
+        """
+        if (
+            self.memoryLimit is None
+            or numPairs * EXPANSION_PAIR_BYTES <= self.memoryLimit
+        ):
+            return np.empty((numPairs, 2), dtype=np.intp)
+        if self.spillDir is None:
+            raise PairMemoryError(numPairs, self.memoryLimit)
+        return self._open_spill_file(numPairs)
+
+    def _open_spill_file(self, numPairs):
+        """Create a .npy file of pairs in `spillDir`. The file is not deleted.
+        Args:
+            numPairs (int): number of pairs
+        Returns:
+            numPairs x 2 numpy memmap
+        """
+        fd, path = tempfile.mkstemp(
+            prefix="pairs-", suffix=".npy", dir=self.spillDir
+        )
+        os.close(fd)
+        return np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.intp, shape=(numPairs, 2)
+        )
+
+    def _fill_box_pairs(
+        self, indptr, members, boxPairs, out, indptr2=None, members2=None
+    ):
+        """Expand box pairs into `out`, in the order of `boxPairs`. A box pair
+        (i, i) stands for the pairs within box i unless the second boxes
+        belong to another grid. With `memoryLimit`, the pairs are expanded in
+        chunks of a quarter of `memoryLimit` bytes of pairs. Box pairs with
+        more pairs are split into slices of rows of their first box, so the
+        temporary arrays of a chunk never exceed `memoryLimit`.
+        Args:
+            indptr (m + 1 int numpy array): box offsets
+            members (n int numpy array): objects ordered by box
+            boxPairs (k x 2 int numpy array): pairs of boxes
+            out (k x 2 int numpy array or memmap): array to write the pairs to
+            indptr2=None (int numpy array): box offsets of the second boxes if
+                they belong to another grid
+            members2=None (int numpy array): objects ordered by second box
+        """
+        if self.memoryLimit is None:
+            chunkSize = max(len(out), 1)
+        else:
+            chunkSize = max(self.memoryLimit // (2 * EXPANSION_PAIR_BYTES), 1)
+        slices, counts = kernels.split_box_pairs(
+            indptr, boxPairs, chunkSize, indptr2
+        )
+
+        position = 0
+        for start, end in kernels.split_ranges(counts, chunkSize):
+            numChunkPairs = int(counts[start:end].sum())
+            kernels.box_slice_pairs(
+                indptr,
+                members,
+                slices[start:end],
+                out=out[position:position + numChunkPairs],
+                indptr2=indptr2,
+                members2=members2,
+            )
+            position += numChunkPairs
+        if isinstance(out, np.memmap):
+            out.flush()
+
+    def _get_pair_mask(self):
+        """Vectorized test whether a pair of labels is selected.
+        Negative labels denote unlabeled objects.
+        Returns:
+            Function that maps two label arrays to a boolean array.
+        """
+        if self.pairType is None:
+            return lambda a, b: np.ones(len(a), dtype=bool)
+        elif callable(self.pairType):
+            return self.pairType
+        elif self.pairType == "labeled_unlabeled":
+            return lambda a, b: (a < 0) != (b < 0)
+        elif self.pairType == "cross_label":
+            return lambda a, b: a != b
+        elif self.pairType == "same_label":
+            return lambda a, b: a == b
+        elif self.pairType == "not_same_labeled":
+            return lambda a, b: (a != b) | (a < 0)
+        else:
+            raise ValueError(
+                "Current pair type: %s is not defined. " % self.pairType
+                + "Set self.pairType to None, a function, "
+                + "'labeled_unlabeled', 'cross_label', 'same_label', or "
+                + "'not_same_labeled'."
+            )
+
+    def _group_labels(self, grid, labels):
+        """Split the objects of each box by label.
+        Args:
+            grid (BoxGrid): objects per box
+            labels (n numpy array): label of each object
+        Returns:
+            BoxGrid of the label groups ordered by box, i.e. the label
+            histogram of each box, the label of each group, and the offsets
+            of the groups of each box.
+        """
+        labelValues, labelCodes = np.unique(labels, return_inverse=True)
+        groupGrid = kernels.group_boxes(
+            np.column_stack((grid.labels, labelCodes.reshape(-1)))
+        )
+        boxIndptr = np.zeros(len(grid.keys) + 1, dtype=np.intp)
+        np.cumsum(
+            np.bincount(groupGrid.keys[:, 0], minlength=len(grid.keys)),
+            out=boxIndptr[1:],
+        )
+        return groupGrid, labelValues[groupGrid.keys[:, 1]], boxIndptr
+
+    def _select_group_pairs(self, grid, boxPairs, labels):
+        """Split the objects of each box by label and select the pairs of
+        label groups in the same or adjacent boxes whose labels are accepted
+        by the pair type.
+        Args:
+            grid (BoxGrid): objects per box
+            boxPairs (k x 2 int numpy array): pairs of adjacent boxes
+            labels (n numpy array): label of each object
+        Returns:
+            BoxGrid of the label groups, the selected pairs of groups, where
+            (g, g) stands for the pairs within group g, and the number of
+            selected group pairs within a box, which come first.
+        """
+        isSelected = self._get_pair_mask()
+        groupGrid, groupLabels, boxIndptr = self._group_labels(grid, labels)
+        groups = np.arange(len(groupGrid.keys), dtype=np.intp)
+
+        withinGroupPairs = kernels.within_box_pairs(boxIndptr, groups)
+        betweenGroupPairs = kernels.between_box_pairs(
+            boxIndptr, groups, boxIndptr, groups, boxPairs
+        )
+        withinGroupPairs, betweenGroupPairs = [
+            groupPairs[
+                isSelected(
+                    groupLabels[groupPairs[:, 0]],
+                    groupLabels[groupPairs[:, 1]],
+                )
+            ]
+            for groupPairs in (withinGroupPairs, betweenGroupPairs)
+        ]
+        sameGroups = groups[isSelected(groupLabels, groupLabels)]
+
+        groupPairs = np.concatenate(
+            (
+                np.column_stack((sameGroups, sameGroups)),
+                withinGroupPairs,
+                betweenGroupPairs,
+            )
+        )
+        return groupGrid, groupPairs, len(sameGroups) + len(withinGroupPairs)
+
+    def _expand_labeled_box_pairs(self, grid, boxPairs, labels):
+        """Expand pairs of adjacent boxes into the pairs of objects whose
+        labels are accepted by the pair type.
+        The objects of each box are split by label. Pairs of these label
+        groups are tested against the pair type before any object pair is
+        generated, so box pairs without a valid label combination cost no
+        expansion.
+        Args:
+            grid (BoxGrid): objects per box
+            boxPairs (k x 2 int numpy array): pairs of adjacent boxes
+            labels (n numpy array): label of each object
+        Returns:
+            Numpy array of selected pairs and the number of selected pairs
+            within boxes.
+        """
+        groupGrid, groupPairs, numWithinBoxPairs = self._select_group_pairs(
+            grid, boxPairs, labels
+        )
+        counts = kernels.count_box_pairs(groupGrid.indptr, groupPairs)
+        pairs = np.empty((int(counts.sum()), 2), dtype=np.intp)
+        self._fill_box_pairs(
+            groupGrid.indptr, groupGrid.members, groupPairs, pairs
+        )
+        return pairs, int(counts[:numWithinBoxPairs].sum())
+
+    def _unique_pairs(self, pairs, numObjects, directed=False):
+        """Remove duplicate pairs.
+        Args:
+            pairs (k x 2 int numpy array): pairs of objects
+            numObjects (int): number of objects (of the second set if
+                `directed`)
+            directed=False (bool): (a, b) and (b, a) are different pairs, e.g.
+                because a and b are objects of different sets
+        Returns:
+            Numpy array of unique pairs, with a < b for each pair (a, b) unless
+            `directed`.
+        """
+        if directed:
+            first = pairs[:, 0].astype(np.int64)
+            second = pairs[:, 1]
+        else:
+            first = np.minimum(pairs[:, 0], pairs[:, 1]).astype(np.int64)
+            second = np.maximum(pairs[:, 0], pairs[:, 1])
+        first *= numObjects
+        first += second
+        first.sort()
+        isFirst = np.ones(len(first), dtype=bool)
+        np.not_equal(first[1:], first[:-1], out=isFirst[1:])
+        codes = first[isFirst]
+
+        uniquePairs = np.empty((len(codes), 2), dtype=np.intp)
+        np.floor_divide(codes, numObjects, out=uniquePairs[:, 0])
+        np.remainder(codes, numObjects, out=uniquePairs[:, 1])
+        return uniquePairs
+
+    def _to_list(self, pairs):
+        """Convert a numpy array of pairs into a list of tuples. Raises a
+        PairMemoryError if the list would exceed `memoryLimit` bytes."""
+        if (
+            self.memoryLimit is not None
+            and len(pairs) * LIST_PAIR_BYTES > self.memoryLimit
+        ):
+            raise PairMemoryError(
+                len(pairs), self.memoryLimit, pairBytes=LIST_PAIR_BYTES
+            )
+        return list(zip(pairs[:, 0].tolist(), pairs[:, 1].tolist()))
+
+    def _search_adjacent_boxes(self, keys):
+        """Identify pairs of adjacent nonempty boxes with the neighbor search
+        `neighborSearch`. "probe" looks up all 3^p - 1 neighbors of each box.
+        "sweep" joins the boxes dimension by dimension, so its cost tracks
+        the number of nonempty neighbors, which is much faster in higher
+        dimensions.
+        Args:
+            keys (m x p int numpy array): grid indices of the nonempty boxes,
+                in lexicographic order
+        Returns:
+            k x 2 numpy array of pairs of adjacent boxes and a dict with the
+            stats of the search.
+        """
+        stats = {}
+        if self.neighborSearch == "probe":
+            boxPairs, numAdjacentBoxes = self._find_adjacent_boxes(keys)
+            stats["numAdjacentBoxes"] = numAdjacentBoxes
+            stats["numEmptyAdjacentBoxes"] = numAdjacentBoxes - len(boxPairs)
+        elif self.neighborSearch == "sweep":
+            boxPairs, numCandidates = kernels.sweep_adjacent_boxes(keys)
+            stats["numSweepCandidates"] = numCandidates
+        else:
+            raise ValueError(
+                "Current neighbor search: %s is not defined. "
+                % self.neighborSearch
+                + 'Set self.neighborSearch to "probe" (default) or "sweep".'
+            )
+        stats["numNonemptyAdjacentBoxes"] = len(boxPairs)
+        return boxPairs, stats
+
+    def _find_adjacent_boxes(self, keys):
+        """Identify pairs of adjacent nonempty boxes by probing all boxes that
+        are adjacent to a nonempty box.
+        Args:
+            keys (m x p int numpy array): grid indices of the nonempty boxes
+        Returns:
+            k x 2 numpy array of pairs of adjacent boxes and the number of
+            probed boxes.
+        """
+        numBoxes, numDims = keys.shape
 
         increments = tuple(
             increment
             for increment in product(range(-1, 2), repeat=numDims)
             if increment > ((0,) * numDims)
         )
+        numAdjacentBoxes = numBoxes * len(increments)
+        return self._match_boxes(keys, keys, increments), numAdjacentBoxes
+
+    def _match_boxes(self, keys1, keys2, increments):
+        """Identify pairs of boxes (i, j) with `keys2[j] = keys1[i] + x` for an
+        increment x.
+        Args:
+            keys1 (m1 x p int numpy array): grid indices of the first boxes
+            keys2 (m2 x p int numpy array): grid indices of the second boxes,
+                in lexicographic order
+            increments (tuple): increments to probe from each first box
+        Returns:
+            k x 2 numpy array of pairs of boxes.
+        """
+        boxPairs = [np.zeros((0, 2), dtype=np.intp)]
+        if len(keys1) == 0 or len(keys2) == 0:
+            return boxPairs[0]
 
-        # initialize stats
-        numAdjacentBoxes = 0
-        numNonemptyAdjacentBoxes = 0
+        encoding = kernels.get_key_encoding(np.concatenate((keys1, keys2)))
+        if encoding is None:
+            return self._probe_boxes(keys1, keys2, increments)
 
-        for boxID, objects in boxDict.items():
-            pairs += combinations(objects, 2)
+        # codes2 are sorted because keys2 are in lexicographic order
+        codes1 = kernels.encode_keys(keys1, encoding)
+        codes2 = kernels.encode_keys(keys2, encoding)
+        for increment in increments:
+            incrementedCodes = codes1 + np.dot(increment, encoding[1])
+            positions = np.searchsorted(codes2, incrementedCodes)
+            np.minimum(positions, len(codes2) - 1, out=positions)
+            found = np.flatnonzero(codes2[positions] == incrementedCodes)
+            boxPairs.append(np.column_stack((found, positions[found])))
+
+        return np.concatenate(boxPairs).astype(np.intp)
+
+    def _probe_boxes(self, keys1, keys2, increments):
+        """Identify pairs of boxes (i, j) with `keys2[j] = keys1[i] + x` with
+        dict lookups. Used when the grid indices cannot be encoded in a single
+        integer.
+        Args:
+            keys1 (m1 x p int numpy array): grid indices of the first boxes
+            keys2 (m2 x p int numpy array): grid indices of the second boxes
+            increments (tuple): increments to probe from each first box
+        Returns:
+            k x 2 numpy array of pairs of boxes.
+        """
+        boxIndex = dict(
+            (tuple(key), j) for j, key in enumerate(keys2.tolist())
+        )
+
+        boxPairs = []
+        for i, boxID in enumerate(keys1.tolist()):
             for increment in increments:
                 incrementedID = tuple(
-                    a + b for a, b in six.moves.zip(boxID, increment)
+                    a + b for a, b in zip(boxID, increment)
                 )
+                if incrementedID in boxIndex:
+                    boxPairs.append((i, boxIndex[incrementedID]))
+        return np.array(boxPairs, dtype=np.intp).reshape(-1, 2)
 
-                numAdjacentBoxes += 1
-
-                if incrementedID in boxDict:
-                    pairs += product(objects, boxDict[incrementedID])
+    def _block_enumeration(self, data):
+        """Identify pairs by enumerating adjacent blocks
+        Args:
+            data (n x p numpy array): vectors corresponding to the observations
+        Returns:
+            Numpy array where each row is a pair.
+        """
+        boxIDs = self._rescale_and_project(data, self.distance)
+        return self._block_enumeration_on_grid(self._get_box_grid(boxIDs))
 
-                    numNonemptyAdjacentBoxes += 1
+    def _block_enumeration_on_grid(self, grid, labels=None):
+        """Identify pairs by enumerating adjacent blocks of a grid
+        Args:
+            grid (BoxGrid): objects per box
+            labels=None (n numpy array): label of each object, see
+                `select_pairs`
+        Returns:
+            Numpy array where each row is a pair.
+        """
+        boxPairs, stats = self._get_adjacent_boxes(grid)
+        pairs, _ = self._expand_box_pairs_within_limit(grid, boxPairs, labels)
 
         # assign stats
-        stats = {}
-        stats["numBoxes"] = len(boxDict)
+        stats.update(self._get_occupancy_stats(grid))
         stats["numUniquePairs"] = len(pairs)
-        stats["numAdjacentBoxes"] = numAdjacentBoxes
-        stats["numNonemptyAdjacentBoxes"] = numNonemptyAdjacentBoxes
-        stats["numEmptyAdjacentBoxes"] = (
-            numAdjacentBoxes - numNonemptyAdjacentBoxes
-        )
+        if isinstance(pairs, np.memmap):
+            stats["spillFile"] = pairs.filename
         self.stats = stats
 
         return pairs
 
+    def _get_adjacent_boxes(self, grid):
+        """Identify the pairs of adjacent nonempty boxes of a grid. Block
+        enumeration probes the neighbors of each box; the shifting methods
+        apply object shifting to the box representatives.
+        Args:
+            grid (BoxGrid): objects per box
+        Returns:
+            k x 2 numpy array of pairs of adjacent boxes (each pair once) and
+            a dict with the stats of the search.
+        """
+        if self.method == "block_enumeration":
+            return self._search_adjacent_boxes(grid.keys)
+        return self._shift_adjacent_boxes(grid.keys)
+
+    def _shift_adjacent_boxes(self, keys):
+        """Identify pairs of adjacent nonempty boxes by object shifting of
+        the box representatives. Shifting the representative of box `k` by
+        `shift * distance` puts it into box `(k + shift) // 2` of the grid
+        with twice the width, so the shifts work on the grid indices directly.
+        Args:
+            keys (m x p int numpy array): grid indices of the nonempty boxes
+        Returns:
+            k x 2 numpy array of pairs of adjacent boxes and a dict with the
+            stats of the search.
+        """
+        boxPairs, numPairs = kernels.shift_adjacent_boxes(keys)
+
+        stats = {}
+        stats["numTotalPairs"] = numPairs
+        stats["numDuplicatePairs"] = numPairs - len(boxPairs)
+        stats["numShifts"] = 2 ** keys.shape[1]
+        return boxPairs, stats
+
+    def _get_occupancy_stats(self, grid):
+        """Load balance of the nonempty boxes of a grid.
+        Args:
+            grid (BoxGrid): objects per box
+        Returns:
+            Dict with the number of nonempty boxes and the largest and mean
+            number of objects per nonempty box.
+        """
+        sizes = np.diff(grid.indptr)
+        stats = {}
+        stats["numBoxes"] = len(sizes)
+        stats["maxBoxOccupancy"] = int(sizes.max()) if len(sizes) else 0
+        stats["meanBoxOccupancy"] = float(sizes.mean()) if len(sizes) else 0.0
+        stats["boxOccupancyHistogram"] = np.bincount(sizes)
+        return stats
+
+    def _count_degrees(self, grid, out=None, labels=None):
+        """Number of selected pairs of each object, computed from the box
+        sizes over the box adjacency without expanding the pairs.
+        Args:
+            grid (BoxGrid): objects per box
+            out=None (n int numpy array): Buffer for the degrees
+            labels=None (n numpy array): label of each object. Only pairs
+                accepted by the pair type are counted if set.
+        Returns:
+            n int numpy array with the number of pairs of each object.
+        """
+        boxPairs, stats = self._get_adjacent_boxes(grid)
+        if labels is not None:
+            degrees, owners, numPairs = self._count_labeled_degrees(
+                grid, boxPairs, labels
+            )
+        else:
+            sizes = np.diff(grid.indptr)
+            degrees = np.bincount(
+                boxPairs[:, 0],
+                weights=sizes[boxPairs[:, 1]],
+                minlength=len(sizes),
+            )
+            degrees += np.bincount(
+                boxPairs[:, 1],
+                weights=sizes[boxPairs[:, 0]],
+                minlength=len(sizes),
+            )
+            degrees = degrees.astype(np.int64) + sizes - 1
+            owners = grid.labels
+            numPairs = int(
+                kernels.count_within_box_pairs(grid.indptr).sum()
+                + kernels.count_between_box_pairs(
+                    grid.indptr, grid.indptr, boxPairs
+                ).sum()
+            )
+
+        if out is None:
+            out = np.empty(len(grid.labels), dtype=np.int64)
+        np.take(degrees, owners, out=out)
+
+        stats.update(self._get_occupancy_stats(grid))
+        stats["numUniquePairs"] = numPairs
+        self.stats = stats
+        return out
+
+    def _count_labeled_degrees(self, grid, boxPairs, labels):
+        """Number of pairs accepted by the pair type of each label group of
+        each box, from the selected pairs of label groups in the same or
+        adjacent boxes, see `_select_group_pairs`.
+        Args:
+            grid (BoxGrid): objects per box
+            boxPairs (k x 2 int numpy array): pairs of adjacent boxes
+            labels (n numpy array): label of each object
+        Returns:
+            Degree of each label group, the label group of each object, and
+            the number of accepted pairs.
+        """
+        groupGrid, groupPairs, _ = self._select_group_pairs(
+            grid, boxPairs, labels
+        )
+        sizes = np.diff(groupGrid.indptr).astype(np.int64)
+        isSame = groupPairs[:, 0] == groupPairs[:, 1]
+        first, second = groupPairs[~isSame, 0], groupPairs[~isSame, 1]
+
+        degrees = np.bincount(
+            first, weights=sizes[second], minlength=len(sizes)
+        )
+        degrees += np.bincount(
+            second, weights=sizes[first], minlength=len(sizes)
+        )
+        degrees = degrees.astype(np.int64)
+        sameGroups = groupPairs[isSame, 0]
+        degrees[sameGroups] += sizes[sameGroups] - 1
+
+        numPairs = kernels.count_box_pairs(groupGrid.indptr, groupPairs)
+        return degrees, groupGrid.labels, int(numPairs.sum())
+
     def _select_within_block_pairs(self, boxDict):
         """Select all possible pairs within each box.
         Args:
@@ -196,33 +1065,77 @@ class SparseComputation(object):
         Args:
             data (n x p numpy array): vectors corresponding to the observations
         Returns:
-            List of tuples where each tuple is a pair.
+            Numpy array where each row is a pair.
         """
-        rescaledData = self._rescale_data(data)
-        shifts = self._generate_shifts(data.shape[1])
+        boxIDs = self._rescale_and_project(data, self.distance)
+        return self._object_shifting_on_grid(self._get_box_grid(boxIDs))
 
-        pairs = set()
+    def _object_shifting_on_grid(self, grid, labels=None):
+        """Identify pairs by shifting the objects of a grid. All objects in a
+        box are shifted together, so each shift merges the boxes into the
+        boxes of a shifted grid with twice the block width.
+        Args:
+            grid (BoxGrid): objects per box
+            labels=None (n numpy array): label of each object, see
+                `select_pairs`
+        Returns:
+            Numpy array where each row is a pair.
+        """
+        shifts = self._generate_shifts(grid.keys.shape[1])
+        self._check_shift_pairs(grid, shifts)
+
+        shiftPairs = [np.zeros((0, 2), dtype=np.intp)]
         numPairs = 0
 
         for shift in shifts:
-            shiftedData = rescaledData + [
-                float(x) * self.distance for x in shift
-            ]
-            boxIDs = self._project_onto_grid(shiftedData, 2 * self.distance)
-            boxDict = self._get_box_dict(boxIDs)
-            shiftPairs = self._select_within_block_pairs(boxDict)
+            shiftedGrid = self._coarsen_box_grid(grid, shift)
+            pairs, _ = self._expand_box_pairs(
+                shiftedGrid, np.zeros((0, 2), dtype=np.intp), labels
+            )
 
-            numPairs += len(shiftPairs)
-            pairs = pairs.union(shiftPairs)
+            numPairs += len(pairs)
+            shiftPairs.append(pairs)
 
-        stats = {}
+        # free the pairs of the shifts once they are concatenated
+        shiftPairs = np.concatenate(shiftPairs)
+        pairs = self._unique_pairs(shiftPairs, len(grid.members))
+
+        stats = self._get_occupancy_stats(grid)
         stats["numUniquePairs"] = len(pairs)
         stats["numTotalPairs"] = numPairs
         stats["numDuplicatePairs"] = numPairs - len(pairs)
         stats["numShifts"] = len(shifts)
         self.stats = stats
 
-        return list(pairs)
+        return pairs
+
+    def _check_shift_pairs(self, grid, shifts):
+        """Raise a PairMemoryError if the pairs of all shifts of object
+        shifting and their concatenated copy exceed `memoryLimit` bytes. The
+        pairs of the shifts are held
+        together until the duplicates are removed, so they cannot be spilled
+        in chunks. The pairs are counted from the sizes of the shifted boxes.
+        Args:
+            grid (BoxGrid): objects per box
+            shifts (list): binary shift vectors
+        """
+        if self.memoryLimit is None:
+            return
+
+        sizes = np.diff(grid.indptr)
+        numPairs = 0
+        for shift in shifts:
+            shiftedGrid = kernels.group_boxes(
+                self._shift_box_ids(grid.keys, shift)
+            )
+            shiftedSizes = np.bincount(
+                shiftedGrid.labels,
+                weights=sizes,
+                minlength=len(shiftedGrid.keys),
+            ).astype(np.int64)
+            numPairs += int((shiftedSizes * (shiftedSizes - 1) // 2).sum())
+        if numPairs * EXPANSION_PAIR_BYTES > self.memoryLimit:
+            raise PairMemoryError(numPairs, self.memoryLimit)
 
     def _block_shifting(self, data):
         """Identify pairs by computing non-empty block representatives and
@@ -230,63 +1143,640 @@ class SparseComputation(object):
         Args:
             data (n x p numpy array): vectors corresponding to the observations
         Returns:
-            List of tuples where each tuple is a pair.
+            Numpy array where each row is a pair.
+        """
+        boxIDs = self._rescale_and_project(data, self.distance)
+        return self._block_shifting_on_grid(self._get_box_grid(boxIDs))
+
+    def _block_shifting_on_grid(self, grid, labels=None):
+        """Identify pairs by applying object shifting to the representatives
+        of the non-empty blocks of a grid.
+        Args:
+            grid (BoxGrid): objects per box
+            labels=None (n numpy array): label of each object, see
+                `select_pairs`
+        Returns:
+            Numpy array where each row is a pair.
+        """
+        adjacentBoxes, stats = self._get_adjacent_boxes(grid)
+        pairs, numWithinBlockPairs = self._expand_box_pairs_within_limit(
+            grid, adjacentBoxes, labels
+        )
+
+        stats.update(self._get_occupancy_stats(grid))
+        stats["numUniquePairs"] = len(pairs)
+        stats["numTotalPairs"] += numWithinBlockPairs
+        if isinstance(pairs, np.memmap):
+            stats["spillFile"] = pairs.filename
+        self.stats = stats
+
+        return pairs
+
+    def _cross_block_enumeration(self, gridA, gridB):
+        """Identify pairs between two sets by enumerating the boxes of the
+        second set that are equal or adjacent to the boxes of the first set.
+        Args:
+            gridA (BoxGrid): objects of the first set per box
+            gridB (BoxGrid): objects of the second set per box
+        Returns:
+            Numpy array of pairs (a, b) with a in the first set and b in the
+            second set.
         """
-        rescaledData = self._rescale_data(data)
-        boxIDs = self._project_onto_grid(rescaledData, self.distance)
-        boxDict = self._get_box_dict(boxIDs)
-        boxes = list(boxDict.keys())
+        numDims = gridA.keys.shape[1]
+        increments = tuple(product(range(-1, 2), repeat=numDims))
+        boxPairs = self._match_boxes(gridA.keys, gridB.keys, increments)
+        pairs = self._expand_cross_box_pairs(gridA, gridB, boxPairs)
+
+        numAdjacentBoxes = len(gridA.keys) * len(increments)
+        stats = {}
+        stats["numBoxes"] = len(gridA.keys) + len(gridB.keys)
+        stats["numUniquePairs"] = len(pairs)
+        stats["numAdjacentBoxes"] = numAdjacentBoxes
+        stats["numNonemptyAdjacentBoxes"] = len(boxPairs)
+        stats["numEmptyAdjacentBoxes"] = numAdjacentBoxes - len(boxPairs)
+        if isinstance(pairs, np.memmap):
+            stats["spillFile"] = pairs.filename
+        self.stats = stats
+
+        return pairs
 
-        repData = self._create_representatives(boxes)
+    def _expand_cross_box_pairs(self, gridA, gridB, boxPairs):
+        """Expand pairs of boxes of two grids into pairs of objects. With
+        `memoryLimit`, the pairs are counted first and expanded in chunks into
+        an array or a file in `spillDir`, see `_allocate_pairs`.
+        Args:
+            gridA (BoxGrid): objects of the first set per box
+            gridB (BoxGrid): objects of the second set per box
+            boxPairs (k x 2 int numpy array): pairs of a box of each grid
+        Returns:
+            Numpy array (or numpy memmap if spilled) of pairs (a, b).
+        """
+        if self.memoryLimit is None:
+            return kernels.between_box_pairs(
+                gridA.indptr,
+                gridA.members,
+                gridB.indptr,
+                gridB.members,
+                boxPairs,
+            )
 
-        scObject = SparseComputation(
-            None,
-            distance=self.distance,
-            method="object_shifting",
-            rescale=None,
+        counts = kernels.count_between_box_pairs(
+            gridA.indptr, gridB.indptr, boxPairs
+        )
+        pairs = self._allocate_pairs(int(counts.sum()))
+        self._fill_box_pairs(
+            gridA.indptr,
+            gridA.members,
+            boxPairs,
+            pairs,
+            gridB.indptr,
+            gridB.members,
         )
-        adjacentBoxes = scObject.select_pairs(repData)
+        return pairs
 
-        pairs = self._select_within_block_pairs(boxDict)
-        numWithinBlockPairs = len(pairs)
+    def _check_cross_shift_pairs(self, gridA, gridB, shifts):
+        """Raise a PairMemoryError if the pairs of all shifts of cross object
+        shifting and their concatenated copy exceed `memoryLimit` bytes, like
+        `_check_shift_pairs`.
+        Args:
+            gridA (BoxGrid): objects of the first set per box
+            gridB (BoxGrid): objects of the second set per box
+            shifts (list): binary shift vectors
+        """
+        if self.memoryLimit is None:
+            return
+
+        numDims = gridA.keys.shape[1]
+        numPairs = 0
+        for shift in shifts:
+            shiftedA = self._coarsen_box_grid(gridA, shift)
+            shiftedB = self._coarsen_box_grid(gridB, shift)
+            boxPairs = self._match_boxes(
+                shiftedA.keys, shiftedB.keys, ((0,) * numDims,)
+            )
+            numPairs += int(
+                kernels.count_between_box_pairs(
+                    shiftedA.indptr, shiftedB.indptr, boxPairs
+                ).sum()
+            )
+        if numPairs * EXPANSION_PAIR_BYTES > self.memoryLimit:
+            raise PairMemoryError(numPairs, self.memoryLimit)
 
-        for box1, box2 in adjacentBoxes:
-            pairs += product(boxDict[boxes[box1]], boxDict[boxes[box2]])
+    def _cross_object_shifting(self, gridA, gridB):
+        """Identify pairs between two sets by shifting the objects of both
+        sets and matching the shifted boxes of the first set with those of the
+        second set.
+        Args:
+            gridA (BoxGrid): objects of the first set per box
+            gridB (BoxGrid): objects of the second set per box
+        Returns:
+            Numpy array of pairs (a, b) with a in the first set and b in the
+            second set.
+        """
+        numDims = gridA.keys.shape[1]
+        shifts = self._generate_shifts(numDims)
+        self._check_cross_shift_pairs(gridA, gridB, shifts)
 
-        stats = scObject.stats
+        shiftPairs = [np.zeros((0, 2), dtype=np.intp)]
+        numPairs = 0
+
+        for shift in shifts:
+            shiftedA = self._coarsen_box_grid(gridA, shift)
+            shiftedB = self._coarsen_box_grid(gridB, shift)
+            boxPairs = self._match_boxes(
+                shiftedA.keys, shiftedB.keys, ((0,) * numDims,)
+            )
+            pairs = kernels.between_box_pairs(
+                shiftedA.indptr,
+                shiftedA.members,
+                shiftedB.indptr,
+                shiftedB.members,
+                boxPairs,
+            )
+
+            numPairs += len(pairs)
+            shiftPairs.append(pairs)
+
+        shiftPairs = np.concatenate(shiftPairs)
+        pairs = self._unique_pairs(
+            shiftPairs, len(gridB.members), directed=True
+        )
+
+        stats = {}
         stats["numUniquePairs"] = len(pairs)
-        stats["numTotalPairs"] += numWithinBlockPairs
+        stats["numTotalPairs"] = numPairs
+        stats["numDuplicatePairs"] = numPairs - len(pairs)
+        stats["numShifts"] = len(shifts)
+        self.stats = stats
+
+        return pairs
+
+    def _cross_block_shifting(self, gridA, gridB):
+        """Identify pairs between two sets by applying object shifting to the
+        representatives of the nonempty boxes of both sets.
+        Args:
+            gridA (BoxGrid): objects of the first set per box
+            gridB (BoxGrid): objects of the second set per box
+        Returns:
+            Numpy array of pairs (a, b) with a in the first set and b in the
+            second set.
+        """
+        numBoxesA = len(gridA.keys)
+        unionGrid = kernels.group_boxes(
+            np.concatenate((gridA.keys, gridB.keys))
+        )
+        numBoxes = len(unionGrid.keys)
+
+        # box of each set in each box of the union, -1 if there is none
+        boxA = np.full(numBoxes, -1, dtype=np.intp)
+        boxA[unionGrid.labels[:numBoxesA]] = np.arange(numBoxesA)
+        boxB = np.full(numBoxes, -1, dtype=np.intp)
+        boxB[unionGrid.labels[numBoxesA:]] = np.arange(len(gridB.keys))
+
+        adjacentBoxes, stats = self._shift_adjacent_boxes(unionGrid.keys)
+
+        sameBoxes = np.arange(numBoxes).repeat(2).reshape(-1, 2)
+        candidates = np.concatenate(
+            (adjacentBoxes, adjacentBoxes[:, ::-1], sameBoxes)
+        )
+        boxPairs = np.column_stack(
+            (boxA[candidates[:, 0]], boxB[candidates[:, 1]])
+        )
+        boxPairs = boxPairs[(boxPairs >= 0).all(axis=1)]
+        pairs = self._expand_cross_box_pairs(gridA, gridB, boxPairs)
+
+        stats["numBoxes"] = numBoxes
+        stats["numUniquePairs"] = len(pairs)
+        if isinstance(pairs, np.memmap):
+            stats["spillFile"] = pairs.filename
         self.stats = stats
 
         return pairs
 
-    def select_pairs(self, data, seed=None):
+    def _get_box_lower_bounds(self, grid, rescaledData, boxPairs):
+        """Lower bounds on the squared distance between the objects of two
+        boxes, computed from the bounding boxes of their objects.
+        Args:
+            grid (BoxGrid): objects per box
+            rescaledData (n x p numpy array): rescaled observations
+            boxPairs (k x 2 int numpy array): pairs of boxes
+        Returns:
+            k float numpy array
+        """
+        if len(boxPairs) == 0:
+            return np.zeros(0, dtype=np.float64)
+
+        sortedData = rescaledData[grid.members]
+        lower = np.minimum.reduceat(sortedData, grid.indptr[:-1], axis=0)
+        upper = np.maximum.reduceat(sortedData, grid.indptr[:-1], axis=0)
+
+        gaps = np.maximum(
+            lower[boxPairs[:, 0]] - upper[boxPairs[:, 1]],
+            lower[boxPairs[:, 1]] - upper[boxPairs[:, 0]],
+        )
+        np.maximum(gaps, 0, out=gaps)
+        return np.einsum("ij,ij->i", gaps, gaps)
+
+    def _select_top_k(
+        self, grid, rescaledData, topK, labels=None, exclude=None
+    ):
+        """Select the `topK` closest pairs among the pairs of objects in the
+        same or adjacent boxes.
+        Box pairs are visited by increasing lower bound on their distance,
+        and from dense to sparse among equal bounds, and expanded in batches
+        of about `max(topK, 2 ** 16)` pairs. A box pair with more pairs is
+        split into slices of rows of its first box, which share its lower
+        bound. The closest pairs found so far are kept in a buffer of at most
+        `topK` pairs plus one batch. The search stops once the lower bound of
+        the next box pair exceeds the distance of the `topK`-th closest pair.
+        Args:
+            grid (BoxGrid): objects per box
+            rescaledData (n x p numpy array): rescaled observations
+            topK (int): number of pairs to select
+            labels=None (n numpy array): label of each object, see
+                `select_pairs`
+            exclude=None (n bool numpy array): pairs of two excluded objects
+                are not selected
+        Returns:
+            Numpy array of the selected pairs ordered by distance.
+        """
+        adjacentBoxes, stats = self._get_adjacent_boxes(grid)
+        boxes = np.arange(len(grid.keys), dtype=np.intp)
+        boxPairs = np.concatenate(
+            (np.column_stack((boxes, boxes)), adjacentBoxes)
+        ).astype(np.intp)
+
+        isWithin = boxPairs[:, 0] == boxPairs[:, 1]
+        counts = kernels.count_between_box_pairs(
+            grid.indptr, grid.indptr, boxPairs
+        )
+        counts[isWithin] = kernels.count_within_box_pairs(grid.indptr)
+        nonempty = counts > 0
+        boxPairs, counts = boxPairs[nonempty], counts[nonempty]
+
+        lowerBounds = self._get_box_lower_bounds(grid, rescaledData, boxPairs)
+        order = np.lexsort((-counts, lowerBounds))
+        boxPairs, lowerBounds = boxPairs[order], lowerBounds[order]
+        batchSize = max(topK, 2 ** 16)
+        slices, counts = kernels.split_box_pairs(
+            grid.indptr, boxPairs, batchSize
+        )
+        # box pair of each slice; the first slice of a box pair starts at 0
+        slicedBoxPairs = np.cumsum(slices[:, 2] == 0) - 1
+        lowerBounds = lowerBounds[slicedBoxPairs]
+        batchEnds = np.cumsum(counts)
+        pairMask = self._get_pair_mask() if labels is not None else None
+
+        pairs = np.zeros((0, 2), dtype=np.intp)
+        distances = np.zeros(0, dtype=np.float64)
+        numExpandedPairs = 0
+        start = 0
+        while start < len(slices):
+            if len(pairs) == topK and lowerBounds[start] > distances.max():
+                break
+            batchStart = batchEnds[start] - counts[start]
+            end = np.searchsorted(
+                batchEnds, batchStart + batchSize, side="right"
+            )
+            end = max(end, start + 1)
+
+            newPairs = kernels.box_slice_pairs(
+                grid.indptr, grid.members, slices[start:end]
+            )
+            numExpandedPairs += len(newPairs)
+            if pairMask is not None:
+                newPairs = newPairs[
+                    pairMask(labels[newPairs[:, 0]], labels[newPairs[:, 1]])
+                ]
+            if exclude is not None:
+                newPairs = newPairs[
+                    ~(exclude[newPairs[:, 0]] & exclude[newPairs[:, 1]])
+                ]
+
+            differences = (
+                rescaledData[newPairs[:, 0]] - rescaledData[newPairs[:, 1]]
+            )
+            pairs = np.concatenate((pairs, newPairs))
+            distances = np.concatenate(
+                (distances, np.einsum("ij,ij->i", differences, differences))
+            )
+            if len(pairs) > topK:
+                closest = np.argpartition(distances, topK - 1)[:topK]
+                pairs, distances = pairs[closest], distances[closest]
+            start = end
+
+        order = np.lexsort((pairs[:, 1], pairs[:, 0], distances))
+        stats["numUniquePairs"] = len(pairs)
+        stats["numBoxPairs"] = len(boxPairs)
+        stats["numExpandedBoxPairs"] = (
+            int(slicedBoxPairs[start - 1]) + 1 if start else 0
+        )
+        stats["numExpandedPairs"] = numExpandedPairs
+        stats["topKDistance"] = (
+            float(np.sqrt(distances.max())) if len(distances) else 0.0
+        )
+        self.stats = stats
+
+        return pairs[order]
+
+    def _get_grid_method(self, cross=False):
+        """Pair selection method that operates on the boxes of a grid.
+        Args:
+            cross=False (bool): Return the method that selects pairs between
+                the objects of two grids.
+        Returns:
+            Bound method taking a BoxGrid (or two BoxGrids if `cross`).
+        """
+        if self.method == "block_enumeration":
+            if cross:
+                return self._cross_block_enumeration
+            return self._block_enumeration_on_grid
+        elif self.method == "object_shifting":
+            if cross:
+                return self._cross_object_shifting
+            return self._object_shifting_on_grid
+        elif self.method == "block_shifting":
+            if cross:
+                return self._cross_block_shifting
+            return self._block_shifting_on_grid
+        else:
+            raise ValueError(
+                "Current method: %s is not defined. " % self.method
+                + "Set self.method to"
+                + "'block_enumeration', 'object_shifting', or "
+                + "'block_shifting' (default)."
+            )
+
+    def _check_labels(self, labels, numObjects):
+        """Validate the labels used to restrict the pair types.
+        Args:
+            labels (n numpy array): label of each object, or None
+            numObjects (int): number of objects
+        Returns:
+            Labels as numpy array, or None if all pairs are selected.
+        """
+        if self.pairType is None:
+            return None
+        if labels is None:
+            raise ValueError(
+                "labels should be set to select pairs of type %s"
+                % self.pairType
+            )
+        labels = np.asarray(labels)
+        if labels.shape != (numObjects,):
+            raise ValueError("labels should have one entry per observation")
+        self._get_pair_mask()
+        return labels
+
+    def select_pairs(
+        self,
+        data,
+        seed=None,
+        reduced=False,
+        as_array=False,
+        labels=None,
+        top_k=None,
+    ):
         """Applies dimension reduction and selects pairs that are close in the
         low-dimensional space.
+
+        If `memory_limit` is set, the number of pairs (of the pair type, if
+        set) is counted before they are expanded. If the pairs and the
+        temporary arrays of their expansion would take more than
+        `memory_limit` bytes, block enumeration and block shifting expand
+        them in chunks into a memory-mapped .npy file in `spill_dir` (the
+        file name is in `self.stats["spillFile"]`). Otherwise, or with object
+        shifting, a PairMemoryError with the estimated number of pairs is
+        raised. A list of tuples takes about ten times the memory of the
+        array, so it is checked against `memory_limit` as well, and
+        `spill_dir` requires `as_array=True`.
+
         Args:
             data (n x p numpy array): vectors corresponding to the observations
+            seed=None: seed passed on to the dimension reducer
+            reduced=False (bool): `data` is already projected onto the
+                low-dimensional space (e.g. with `reduce_data`) and the
+                dimension reducer is skipped.
+            as_array=False (bool): Return the pairs as a k x 2 numpy array.
+            labels=None (n numpy array): label or group of each observation,
+                negative for unlabeled observations. Required if `pairType` is
+                set; only pairs whose labels match `pairType` are selected:
+                "labeled_unlabeled" (exactly one labeled observation),
+                "cross_label" (different labels), "same_label",
+                "not_same_labeled" (all pairs except labeled pairs with the
+                same label), or a function mapping two label arrays to a
+                boolean array.
+            top_k=None (int): Select only the `top_k` closest pairs in the
+                rescaled low-dimensional space, ordered by distance. Only
+                about `top_k` pairs are held in memory at a time.
         Returns:
             List of tuples where each tuple is a pair.
         """
         if not isinstance(data, np.ndarray):
             raise TypeError("data should be a numpy array")
+        if top_k is not None and (not isinstance(top_k, int) or top_k < 1):
+            raise ValueError("top_k should be a positive integer")
+        labels = self._check_labels(labels, len(data))
+        if self.spillDir is not None and not as_array and top_k is None:
+            raise ValueError("spill_dir requires as_array=True")
 
         # Reduce dimensionality of data only if a dimReducer is provided
-        if self.dimReducer is None:
+        if reduced:
             reducedData = data
         else:
-            reducedData = self.dimReducer.fit_transform(data, seed=seed)
+            reducedData = self.reduce_data(data, seed=seed)
 
-        if self.method == "block_enumeration":
-            return self._block_enumeration(reducedData)
-        elif self.method == "object_shifting":
-            return self._object_shifting(reducedData)
-        elif self.method == "block_shifting":
-            return self._block_shifting(reducedData)
+        gridMethod = self._get_grid_method()
+        if top_k is None:
+            boxIDs = self._rescale_and_project(reducedData, self.distance)
+            pairs = gridMethod(self._get_box_grid(boxIDs), labels)
         else:
-            raise ValueError(
-                "Current method: %s is not defined. " % self.method
-                + "Set self.method to"
-                + "'block_enumeration', 'object_shifting', or "
-                + "'block_shifting' (default)."
+            rescaledData = np.asarray(
+                self._rescale_data(reducedData), dtype=np.float64
+            )
+            boxIDs = self._project_onto_grid(rescaledData, self.distance)
+            pairs = self._select_top_k(
+                self._get_box_grid(boxIDs), rescaledData, top_k, labels
             )
+        return pairs if as_array else self._to_list(pairs)
+
+    def select_degrees(
+        self, data, seed=None, reduced=False, out=None, labels=None
+    ):
+        """Number of pairs `select_pairs` selects for each observation,
+        without generating the pairs. Runs in time linear in the number of
+        pairs of adjacent boxes.
+        Args:
+            data (n x p numpy array): vectors corresponding to the observations
+            seed=None: seed passed on to the dimension reducer
+            reduced=False (bool): `data` is already projected onto the
+                low-dimensional space and the dimension reducer is skipped.
+            out=None (n int numpy array): Array to write the degrees to
+            labels=None (n numpy array): label of each observation. Required
+                if `pairType` is set; only pairs whose labels match
+                `pairType` are counted, see `select_pairs`.
+        Returns:
+            n int numpy array with the degree of each observation.
+            `self.stats` holds the total number of pairs and the histogram of
+            the box occupancy.
+        """
+        if not isinstance(data, np.ndarray):
+            raise TypeError("data should be a numpy array")
+        if out is not None and out.shape != (len(data),):
+            raise ValueError("out should have one entry per observation")
+        labels = self._check_labels(labels, len(data))
+        self._get_grid_method()
+
+        if reduced:
+            reducedData = data
+        else:
+            reducedData = self.reduce_data(data, seed=seed)
+
+        boxIDs = self._rescale_and_project(reducedData, self.distance)
+        return self._count_degrees(
+            self._get_box_grid(boxIDs), out=out, labels=labels
+        )
+
+    def select_cross_pairs(
+        self, dataA, dataB, seed=None, reduced=False, as_array=False
+    ):
+        """Selects pairs between two sets of observations that are close in the
+        low-dimensional space, e.g. between a test set and a training set.
+        Both sets are reduced with a single fit of the dimension reducer and
+        projected onto the same grid. Pairs within a set are never expanded.
+        `memory_limit` and `spill_dir` apply as in `select_pairs`.
+        Args:
+            dataA (n x p numpy array): observations of the first set
+            dataB (m x p numpy array): observations of the second set
+            seed=None: seed passed on to the dimension reducer
+            reduced=False (bool): both sets are already projected onto the
+                low-dimensional space and the dimension reducer is skipped.
+            as_array=False (bool): Return the pairs as a k x 2 numpy array.
+        Returns:
+            List of tuples (a, b) where a is the index of an observation in
+            `dataA` and b the index of an observation in `dataB`.
+        """
+        if not isinstance(dataA, np.ndarray) or not isinstance(
+            dataB, np.ndarray
+        ):
+            raise TypeError("dataA and dataB should be numpy arrays")
+        if dataA.shape[1:] != dataB.shape[1:]:
+            raise ValueError("dataA and dataB should have the same columns")
+        if self.spillDir is not None and not as_array:
+            raise ValueError("spill_dir requires as_array=True")
+        gridMethod = self._get_grid_method(cross=True)
+
+        data = np.concatenate((dataA, dataB))
+        if reduced:
+            reducedData = data
+        else:
+            reducedData = self.reduce_data(data, seed=seed)
+
+        boxIDs = self._rescale_and_project(reducedData, self.distance)
+        gridA = self._get_box_grid(boxIDs[: len(dataA)])
+        gridB = self._get_box_grid(boxIDs[len(dataA):])
+        pairs = gridMethod(gridA, gridB)
+        return pairs if as_array else self._to_list(pairs)
+
+    def select_pairs_multi(
+        self,
+        data,
+        resolutions,
+        seed=None,
+        reduced=False,
+        counts=False,
+        as_array=False,
+        labels=None,
+    ):
+        """Selects pairs at several resolutions in one pass.
+        The data is reduced and rescaled once. Grids whose resolution is a
+        power-of-two fraction of a finer requested resolution are not projected
+        again; their boxes are obtained by merging the boxes of the finer grid.
+        Args:
+            data (n x p numpy array): vectors corresponding to the observations
+            resolutions (list): resolutions at which to select pairs
+            seed=None: seed passed on to the dimension reducer
+            reduced=False (bool): `data` is already projected onto the
+                low-dimensional space and the dimension reducer is skipped.
+            counts=False (bool): Return the number of pairs per resolution
+                instead of the pairs. Without labels, the pairs are counted
+                from the box sizes and never generated.
+            as_array=False (bool): Return the pairs as k x 2 numpy arrays.
+            labels=None (n numpy array): label of each observation, see
+                `select_pairs`
+        Returns:
+            Dict with for each resolution the list of pairs (or the number of
+            pairs). `self.stats` holds a dict with the stats per resolution.
+        """
+        if not isinstance(data, np.ndarray):
+            raise TypeError("data should be a numpy array")
+        if any(resolution <= 0 for resolution in resolutions):
+            raise ValueError("resolutions should be positive")
+        self._get_grid_method()
+        labels = self._check_labels(labels, len(data))
+
+        if reduced:
+            reducedData = data
+        else:
+            reducedData = self.reduce_data(data, seed=seed)
+
+        rescaledData = self._rescale_data(reducedData)
+        buffer = np.empty(rescaledData.shape, dtype=np.float64)
+        boxIDs = np.empty(rescaledData.shape, dtype=np.int64)
+
+        grids = {}
+        result = {}
+        stats = {}
+        for resolution in sorted(set(resolutions), reverse=True):
+            grid = None
+            for finerResolution in sorted(grids):
+                numHalvings = self._count_halvings(finerResolution, resolution)
+                if numHalvings is not None:
+                    grid = grids[finerResolution]
+                    for _ in range(numHalvings):
+                        grid = self._coarsen_box_grid(grid)
+                    break
+
+            if grid is None:
+                self._project_onto_grid(
+                    rescaledData,
+                    1 / float(resolution),
+                    out=boxIDs,
+                    buffer=buffer,
+                )
+                grid = self._get_box_grid(boxIDs)
+            grids[resolution] = grid
+
+            scObject = copy.copy(self)
+            scObject.resolution = resolution
+            if counts and labels is None:
+                scObject._count_degrees(grid)
+                result[resolution] = scObject.stats["numUniquePairs"]
+            else:
+                pairs = scObject._get_grid_method()(grid, labels)
+                if counts:
+                    result[resolution] = len(pairs)
+                else:
+                    result[resolution] = (
+                        pairs if as_array else self._to_list(pairs)
+                    )
+            stats[resolution] = scObject.stats
+
+        self.stats = stats
+        return result
+
+    def _count_halvings(self, fineResolution, coarseResolution):
+        """Number of times the block width of a grid at `fineResolution` has to
+        be doubled to obtain a grid at `coarseResolution`.
+        Args:
+            fineResolution (float): resolution of the fine grid
+            coarseResolution (float): resolution of the coarse grid
+        Returns:
+            Positive integer, or None if the ratio of the resolutions is not a
+            power of two.
+        """
+        ratio = fineResolution / float(coarseResolution)
+        numHalvings = int(round(np.log2(ratio)))
+        if numHalvings < 1 or abs(2 ** numHalvings - ratio) > 1e-9 * ratio:
+            return None
+        return numHalvings
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def data():
+    np.random.seed(0)
+    return np.random.uniform(size=(300, 2))
+
+
+@pytest.fixture
+def index(data):
+    from sparsecomputation import GridIndex
+
+    return GridIndex(None, resolution=10).fit(data)
+
+
+def run(coroutine):
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.mark.parametrize("maxBatchSize", [1, 16, 1000])
+def test_query_batches(data, index, maxBatchSize):
+    import asyncio
+    from sparsecomputation.aio import AsyncGridIndex
+
+    asyncIndex = AsyncGridIndex(index, max_batch_size=maxBatchSize,
+                                max_delay=0.01)
+
+    async def query_all():
+        return await asyncio.gather(*[asyncIndex.query(x) for x in data])
+
+    results = run(query_all())
+    for expected, result in zip(index.query(data), results):
+        np.testing.assert_equal(result, expected)
+
+    stats = asyncIndex.stats
+    assert stats['numQueries'] == len(data)
+    assert stats['maxBatchSize'] <= maxBatchSize
+    assert stats['numBatches'] == -(-len(data) // min(maxBatchSize,
+                                                      len(data)))
+
+
+def test_query_exception(data):
+    from sparsecomputation import GridIndex
+    from sparsecomputation.aio import AsyncGridIndex
+
+    asyncIndex = AsyncGridIndex(GridIndex(None, resolution=10))
+    with pytest.raises(ValueError):
+        run(asyncIndex.query(data[0]))
+
+
+def test_query_wrong_shape(data, index):
+    import asyncio
+    from sparsecomputation.aio import AsyncGridIndex
+
+    asyncIndex = AsyncGridIndex(index, max_delay=0.01)
+
+    async def query_all():
+        return await asyncio.gather(
+            asyncIndex.query(data[0]),
+            asyncIndex.query(np.zeros(3)),
+            asyncIndex.query(data[1]),
+            return_exceptions=True,
+        )
+
+    first, wrong, second = run(query_all())
+    assert isinstance(wrong, ValueError)
+    np.testing.assert_equal(first, index.query(data[:1])[0])
+    np.testing.assert_equal(second, index.query(data[1:2])[0])
+    assert asyncIndex.stats['numQueries'] == 2
+
+
+def test_init_exceptions(index):
+    from sparsecomputation.aio import AsyncGridIndex
+
+    with pytest.raises(ValueError):
+        AsyncGridIndex(index, max_batch_size=0)
+
+    with pytest.raises(ValueError):
+        AsyncGridIndex(index, max_delay=-1)
@@ -0,0 +1,178 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def data():
+    np.random.seed(0)
+    return np.random.uniform(size=(300, 3))
+
+
+def sorted_pairs(pairs):
+    return sorted([tuple(sorted(x)) for x in pairs])
+
+
+@pytest.mark.parametrize("extension", ['.npy', '.npz', '.csv'])
+def test_main_pairs(tmpdir, capsys, data, extension):
+    from sparsecomputation import SparseComputation
+    from sparsecomputation.cli import main
+
+    path = str(tmpdir.join('data' + extension))
+    if extension == '.npy':
+        np.save(path, data)
+    elif extension == '.npz':
+        np.savez(path, features=data)
+    else:
+        np.savetxt(path, data, delimiter=',', header='a,b,c')
+    output = str(tmpdir.join('pairs.npy'))
+
+    args = [path, output, '--resolution', '10', '--method',
+            'block_enumeration']
+    if extension == '.csv':
+        args += ['--skip-rows', '1']
+    assert main(args) == 0
+
+    sc = SparseComputation(None, resolution=10, method='block_enumeration')
+    pairs = np.load(output)
+    assert pairs.dtype == np.int64
+    assert sorted_pairs(pairs.tolist()) == sorted_pairs(sc.select_pairs(data))
+
+    report = json.loads(capsys.readouterr()[0])
+    assert report['numObjects'] == len(data)
+    assert report['numPairs'] == len(pairs)
+    assert sorted(report['timings']) == ['load', 'select_pairs', 'write']
+    assert report['stats']['numUniquePairs'] == len(pairs)
+
+
+def test_main_csr(tmpdir, data):
+    from sparsecomputation import PCA, SparseComputation
+    from sparsecomputation.cli import main
+
+    path = str(tmpdir.join('data.npy'))
+    np.save(path, data)
+    output = str(tmpdir.join('csr'))
+    statsPath = str(tmpdir.join('stats.json'))
+
+    assert main([path, output, '--format', 'csr', '--distance', '0.1',
+                 '--reducer', 'pca', '--dim-low', '2', '--chunk-size', '7',
+                 '--stats', statsPath]) == 0
+
+    indptr = np.load(os.path.join(output, 'indptr.npy'))
+    indices = np.load(os.path.join(output, 'indices.npy'))
+    assert len(indptr) == len(data) + 1
+
+    sc = SparseComputation(PCA(2), distance=0.1)
+    expected = sc.select_pairs(data)
+    assert indptr[-1] == 2 * len(expected)
+
+    pairs = [(i, j) for i in range(len(data))
+             for j in indices[indptr[i]:indptr[i + 1]] if i < j]
+    assert sorted(pairs) == sorted_pairs(expected)
+    for i in range(len(data)):
+        assert np.all(np.diff(indices[indptr[i]:indptr[i + 1]]) > 0)
+
+    with open(statsPath) as f:
+        assert json.load(f)['numPairs'] == len(expected)
+
+
+def test_main_compact(tmpdir, data):
+    from sparsecomputation import SparseComputation
+    from sparsecomputation.cli import main
+    from sparsecomputation.pairfile import PairFile
+
+    path = str(tmpdir.join('data.npy'))
+    np.save(path, data)
+    output = str(tmpdir.join('pairs.bin'))
+
+    assert main([path, output, '--format', 'compact', '--resolution', '10',
+                 '--chunk-size', '16']) == 0
+
+    reader = PairFile(output)
+    assert reader.numObjects == len(data)
+    assert reader.chunkRows == 16
+
+    expected = SparseComputation(None, resolution=10).select_pairs(data)
+    assert sorted_pairs(reader.to_pairs().tolist()) == \
+        sorted_pairs(expected)
+
+
+def test_main_workers(tmpdir, data):
+    from sparsecomputation import SparseComputation
+    from sparsecomputation.cli import main
+
+    path = str(tmpdir.join('data.npy'))
+    np.save(path, data)
+    output = str(tmpdir.join('pairs.npy'))
+    assert main([path, output, '--resolution', '10', '--workers', '2',
+                 '--stats', str(tmpdir.join('stats.json'))]) == 0
+
+    sc = SparseComputation(None, resolution=10)
+    assert sorted_pairs(np.load(output).tolist()) == sorted_pairs(
+        sc.select_pairs(data))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_main_memory_limit(tmpdir, data, workers):
+    from sparsecomputation import SparseComputation
+    from sparsecomputation.cli import main
+
+    path = str(tmpdir.join('data.npy'))
+    np.save(path, data)
+    output = str(tmpdir.join('csr'))
+    spillDir = tmpdir.mkdir('spill')
+    statsPath = str(tmpdir.join('stats.json'))
+
+    assert main([path, output, '--format', 'csr', '--resolution', '10',
+                 '--memory-limit', '0.001', '--spill-dir', str(spillDir),
+                 '--workers', str(workers), '--chunk-size', '5',
+                 '--stats', statsPath]) == 0
+
+    indptr = np.load(os.path.join(output, 'indptr.npy'))
+    indices = np.load(os.path.join(output, 'indices.npy'))
+    expected = SparseComputation(None, resolution=10).select_pairs(data)
+    pairs = [(i, j) for i in range(len(data))
+             for j in indices[indptr[i]:indptr[i + 1]] if i < j]
+    assert sorted(pairs) == sorted_pairs(expected)
+    for i in range(len(data)):
+        assert np.all(np.diff(indices[indptr[i]:indptr[i + 1]]) > 0)
+    assert spillDir.listdir() == []
+
+    with open(statsPath) as f:
+        report = json.load(f)
+    assert report['numPairs'] == len(expected)
+    assert 'boxOccupancyHistogram' not in report['stats']
+    assert 'spillFile' not in report['stats']
+
+
+def test_main_parquet(tmpdir, data):
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+    from sparsecomputation.cli import load_data
+
+    path = str(tmpdir.join('data.parquet'))
+    table = pyarrow.table({'a': data[:, 0], 'b': data[:, 1], 'c': data[:, 2]})
+    pyarrow.parquet.write_table(table, path)
+
+    np.testing.assert_equal(load_data(path), data)
+    np.testing.assert_equal(load_data(path, columns=['c', 'a']),
+                            data[:, [2, 0]])
+
+
+def test_main_exceptions(tmpdir):
+    from sparsecomputation.cli import main
+
+    path = str(tmpdir.join('data.txt2'))
+    with pytest.raises(SystemExit):
+        main([path, 'out.npy', '--resolution', '10'])
+
+    with pytest.raises(SystemExit):
+        main([path, 'out.npy'])
+
+    with pytest.raises(SystemExit):
+        main([path, 'out.npy', '--resolution', '10', '--workers', '0'])
+
+    with pytest.raises(SystemExit):
+        main([path, 'out.npy', '--resolution', '10', '--memory-limit', '-1'])
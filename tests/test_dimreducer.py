@@ -1,6 +1,6 @@
 import numpy as np
 import pytest
-from mock import patch
+from mock import MagicMock
 
 
 @pytest.fixture
@@ -114,29 +114,29 @@ def test_row_probability_apca(APCA, data):
     np.testing.assert_allclose(APCA._get_proba_row(data), expectedResult)
 
 
-@patch('numpy.random.choice')
-def test_col_reduction_apca(m, APCA, data):
+def test_col_reduction_apca(APCA, data):
     expectedResult = np.array([
         [1, 0],
         [0, 1],
         [-1, 0],
     ]) / np.sqrt(np.array([2 / 3.0, 1 / 3.0]) * 2)
 
-    m.return_value = [0, 1]
+    m = MagicMock()
+    m.choice.return_value = [0, 1]
 
-    np.testing.assert_allclose(APCA._col_reduction(data), expectedResult,
+    np.testing.assert_allclose(APCA._col_reduction(data, m), expectedResult,
                                atol=1e-8)
 
 
-@patch('numpy.random.choice')
-def test_row_reduction_apca(m, APCA, data):
+def test_row_reduction_apca(APCA, data):
     expectedResult = np.array([
         [1, 0, 0],
     ])
 
-    m.return_value = [0, ]
+    m = MagicMock()
+    m.choice.return_value = [0, ]
 
-    np.testing.assert_allclose(APCA._row_reduction(data), expectedResult,
+    np.testing.assert_allclose(APCA._row_reduction(data, m), expectedResult,
                                atol=1e-8)
 
 
@@ -146,25 +146,83 @@ def test_dimreducer_fit_transform_not_array(dimReducer):
         dimReducer.fit_transform('test')
 
 
-@patch('numpy.random.choice')
-def test_fit_transform_apca(m, APCA, data, pcaResult):
+def test_fit_transform_apca(APCA, data, pcaResult):
     APCA.minRow = 3
     APCA.minCol = 3
 
-    m.return_value = (0, 1, 2)
+    APCA.random_state = MagicMock()
+    APCA.random_state.choice.return_value = (0, 1, 2)
 
     np.testing.assert_allclose(APCA.fit_transform(data), pcaResult,
                                atol=1e-8)
 
 
-@patch('numpy.random.choice')
-def test_fit_transform_separate_apca(m, APCA, data, pcaResult):
+def test_fit_transform_separate_apca(APCA, data, pcaResult):
     APCA.minRow = 3
     APCA.minCol = 3
     APCA.fracCol = 1.0
 
-    m.return_value = (0, 1, 2)
+    APCA.random_state = MagicMock()
+    APCA.random_state.choice.return_value = (0, 1, 2)
 
     APCA.fit(data)
     np.testing.assert_allclose(APCA.transform(data), pcaResult,
                                atol=1e-8)
+
+
+def test_apca_random_state():
+    from sparsecomputation import ApproximatePCA
+
+    np.random.seed(0)
+    data = np.random.normal(0, 1, size=(1000, 5))
+
+    APCA = ApproximatePCA(2, fracRow=0.1, minRow=10, random_state=3)
+    globalState = np.random.get_state()[1].copy()
+    first = APCA.fit_transform(data)
+    np.testing.assert_equal(np.random.get_state()[1], globalState)
+    np.testing.assert_allclose(APCA.fit_transform(data), first)
+
+    APCA.random_state = None
+    np.testing.assert_allclose(APCA.fit_transform(data, seed=3), first)
+    np.testing.assert_allclose(APCA.fit_transform(data, seed=0),
+                               ApproximatePCA(2, fracRow=0.1, minRow=10,
+                                              random_state=0
+                                              ).fit_transform(data))
+
+
+def test_apca_parallel_fits_match_serial_fits():
+    from concurrent.futures import ThreadPoolExecutor
+    from sparsecomputation import ApproximatePCA
+
+    np.random.seed(0)
+    data = np.random.normal(0, 1, size=(1000, 5))
+
+    def fit_transform(seed):
+        return ApproximatePCA(2, fracRow=0.05, minRow=10,
+                              random_state=seed).fit_transform(data)
+
+    serial = [fit_transform(seed) for seed in range(8)]
+    with ThreadPoolExecutor(4) as executor:
+        parallel = list(executor.map(fit_transform, range(8)))
+
+    for a, b in zip(serial, parallel):
+        np.testing.assert_allclose(a, b)
+
+
+def test_apca_shared_instance_parallel_fits():
+    from concurrent.futures import ThreadPoolExecutor
+    from sparsecomputation import ApproximatePCA
+
+    np.random.seed(0)
+    data = np.random.normal(0, 1, size=(1000, 5))
+    APCA = ApproximatePCA(2, fracRow=0.05, minRow=10)
+
+    def fit_transform(seed):
+        return APCA.fit_transform(data, seed=seed)
+
+    serial = [fit_transform(seed) for seed in range(8)]
+    with ThreadPoolExecutor(4) as executor:
+        parallel = list(executor.map(fit_transform, range(8)))
+
+    for a, b in zip(serial, parallel):
+        np.testing.assert_allclose(a, b)
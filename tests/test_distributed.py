@@ -0,0 +1,209 @@
+import os
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def data():
+    np.random.seed(0)
+    return np.random.normal(size=(500, 3))
+
+
+def sorted_pairs(pairs):
+    return sorted([tuple(sorted(x)) for x in pairs])
+
+
+@pytest.mark.parametrize("method", [
+    'block_enumeration', 'object_shifting', 'block_shifting'])
+@pytest.mark.parametrize("numShards", [1, 3, 8])
+def test_select_pairs_matches_sparse_computation(data, method, numShards):
+    from sparsecomputation import (SparseComputation,
+                                   DistributedSparseComputation)
+
+    sc = SparseComputation(None, resolution=10, method=method)
+    dsc = DistributedSparseComputation(None, resolution=10, method=method,
+                                       num_shards=numShards, chunk_size=128,
+                                       sample_size=100)
+
+    pairs = dsc.select_pairs(data)
+    assert len(pairs) == len(set(pairs))
+    assert sorted_pairs(pairs) == sorted_pairs(sc.select_pairs(data))
+    assert dsc.stats['numUniquePairs'] == len(pairs)
+    assert 1 <= dsc.stats['numShards'] <= numShards
+
+
+def test_select_pairs_executor(data):
+    from concurrent.futures import ProcessPoolExecutor
+    from sparsecomputation import (PCA, SparseComputation,
+                                   DistributedSparseComputation)
+
+    sc = SparseComputation(PCA(2), resolution=20)
+    with ProcessPoolExecutor(2) as executor:
+        dsc = DistributedSparseComputation(PCA(2), resolution=20,
+                                           executor=executor, chunk_size=200)
+        pairs = dsc.select_pairs(data, as_array=True)
+
+    assert isinstance(pairs, np.ndarray)
+    assert sorted_pairs(pairs.tolist()) == sorted_pairs(sc.select_pairs(data))
+
+
+def test_select_pairs_reduced(data):
+    from mock import MagicMock
+    from sparsecomputation import DistributedSparseComputation
+
+    dsc = DistributedSparseComputation(MagicMock(), resolution=10,
+                                       rescale=None)
+    dsc.select_pairs(data, reduced=True)
+    assert not dsc.dimReducer.fit.called
+    assert not dsc.dimReducer.transform.called
+
+
+def test_init_exceptions():
+    from sparsecomputation import DistributedSparseComputation
+
+    with pytest.raises(ValueError):
+        DistributedSparseComputation(None, resolution=10, num_shards=0)
+
+    with pytest.raises(ValueError):
+        DistributedSparseComputation(None, resolution=10, chunk_size=0)
+
+
+@pytest.mark.parametrize("rescale", ['quantile_min_max', 'zscore',
+                                     'quantile'])
+def test_select_pairs_robust_rescale(data, rescale):
+    from sparsecomputation import (SparseComputation,
+                                   DistributedSparseComputation)
+
+    sc = SparseComputation(None, resolution=10, rescale=rescale)
+    dsc = DistributedSparseComputation(None, resolution=10, rescale=rescale,
+                                       num_shards=3, chunk_size=128)
+
+    pairs = dsc.select_pairs(data)
+    assert sorted_pairs(pairs) == sorted_pairs(sc.select_pairs(data))
+    assert dsc.stats['maxBoxOccupancy'] == sc.stats['maxBoxOccupancy']
+    assert dsc.stats['meanBoxOccupancy'] > 0
+
+
+def test_merge_stats(data):
+    from sparsecomputation import (SparseComputation,
+                                   DistributedSparseComputation)
+
+    sc = SparseComputation(None, resolution=10)
+    sc.select_pairs(data)
+    dsc = DistributedSparseComputation(None, resolution=10, num_shards=4,
+                                       neighbor_search='sweep')
+    dsc.select_pairs(data)
+    assert dsc.stats['numShards'] > 1
+    assert dsc.stats['numShifts'] == sc.stats['numShifts']
+
+    dsc.method = 'block_enumeration'
+    pairs = dsc.select_pairs(data)
+    assert 'numSweepCandidates' in dsc.stats
+    assert sorted_pairs(pairs) == sorted_pairs(sc.select_pairs(data))
+
+
+def test_inherited_methods(data):
+    from sparsecomputation import (SparseComputation,
+                                   DistributedSparseComputation)
+
+    sc = SparseComputation(None, resolution=10)
+    dsc = DistributedSparseComputation(None, resolution=10, num_shards=3)
+    assert dsc.select_pairs_multi(data, [5, 10], counts=True) == \
+        sc.select_pairs_multi(data, [5, 10], counts=True)
+    assert sorted(dsc.select_cross_pairs(data[:200], data[200:])) == \
+        sorted(sc.select_cross_pairs(data[:200], data[200:]))
+    np.testing.assert_array_equal(dsc.select_degrees(data),
+                                  sc.select_degrees(data))
+
+
+@pytest.mark.parametrize("method", ['block_enumeration', 'block_shifting'])
+def test_select_pairs_labels(data, method):
+    from sparsecomputation import (SparseComputation,
+                                   DistributedSparseComputation)
+
+    labels = np.random.RandomState(0).randint(-1, 3, size=len(data))
+    sc = SparseComputation(None, resolution=10, method=method,
+                           pair_type='cross_label')
+    dsc = DistributedSparseComputation(None, resolution=10, method=method,
+                                       pair_type='cross_label', num_shards=3,
+                                       chunk_size=128)
+    pairs = dsc.select_pairs(data, labels=labels)
+    assert sorted_pairs(pairs) == sorted_pairs(
+        sc.select_pairs(data, labels=labels))
+
+    with pytest.raises(ValueError):
+        dsc.select_pairs(data)
+
+
+def test_select_pairs_top_k(data):
+    from sparsecomputation import (SparseComputation,
+                                   DistributedSparseComputation)
+
+    sc = SparseComputation(None, resolution=10)
+    dsc = DistributedSparseComputation(None, resolution=10, num_shards=4,
+                                       chunk_size=128)
+    pairs = dsc.select_pairs(data, top_k=50, as_array=True)
+    expected = sc.select_pairs(data, top_k=50, as_array=True)
+    assert sorted_pairs(pairs.tolist()) == sorted_pairs(expected.tolist())
+    assert dsc.stats['numUniquePairs'] == 50
+    assert dsc.stats['topKDistance'] == pytest.approx(
+        sc.stats['topKDistance'])
+
+
+def test_select_pairs_chunks(tmpdir, data):
+    from sparsecomputation import (SparseComputation,
+                                   DistributedSparseComputation)
+
+    paths = []
+    for i, start in enumerate(range(0, len(data), 150)):
+        paths.append(str(tmpdir.join('chunk%d.npy' % i)))
+        np.save(paths[-1], data[start:start + 150])
+
+    sc = SparseComputation(None, resolution=10)
+    dsc = DistributedSparseComputation(None, resolution=10, num_shards=3,
+                                       sample_size=100)
+    expected = sorted_pairs(sc.select_pairs(data))
+    assert sorted_pairs(dsc.select_pairs(paths)) == expected
+    assert sorted_pairs(dsc.select_pairs(
+        [data[:100], data[100:]])) == expected
+
+    shards = dsc.select_pair_shards(paths)
+    assert len(shards) == dsc.stats['numShards']
+    assert sorted_pairs(np.concatenate(shards).tolist()) == expected
+    # the parts of the shards are deleted
+    assert sorted(os.listdir(str(tmpdir))) == sorted(
+        os.path.basename(path) for path in paths)
+
+    with pytest.raises(TypeError):
+        dsc.select_pairs('test')
+
+
+def test_select_pairs_memory_limit(tmpdir, data):
+    from sparsecomputation import (DistributedSparseComputation,
+                                   PairMemoryError, SparseComputation)
+
+    sc = SparseComputation(None, resolution=10)
+    expected = sorted_pairs(sc.select_pairs(data))
+
+    dsc = DistributedSparseComputation(None, resolution=10, num_shards=3,
+                                       memory_limit=1000)
+    with pytest.raises(PairMemoryError):
+        dsc.select_pairs(data, as_array=True)
+
+    dsc.spillDir = str(tmpdir)
+    shards = dsc.select_pair_shards(data)
+    assert all(isinstance(pairs, np.memmap) for pairs in shards)
+    assert sorted_pairs(np.concatenate(shards).tolist()) == expected
+    del shards
+
+    # only the concatenated pairs are left in spill_dir
+    files = set(os.listdir(str(tmpdir)))
+    pairs = dsc.select_pairs(data, as_array=True)
+    assert isinstance(pairs, np.memmap)
+    assert sorted_pairs(pairs.tolist()) == expected
+    assert set(os.listdir(str(tmpdir))) - files == set([
+        os.path.basename(dsc.stats['spillFile'])])
+
+    with pytest.raises(ValueError):
+        dsc.select_pairs(data)
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def data():
+    np.random.seed(0)
+    return np.random.uniform(size=(500, 3))
+
+
+def brute_force(data, radius):
+    return sorted((i, j) for i in range(len(data))
+                  for j in range(i + 1, len(data))
+                  if np.linalg.norm(data[i] - data[j]) <= radius)
+
+
+@pytest.mark.parametrize("method", ['kd_tree', 'brute'])
+@pytest.mark.parametrize("chunkSize", [1, 7, 1024])
+def test_radius_pairs(data, method, chunkSize):
+    from sparsecomputation.evaluation import radius_pairs
+
+    pairs = radius_pairs(data, 0.1, method=method, chunk_size=chunkSize)
+    assert pairs.dtype == np.int64
+    assert [tuple(x) for x in pairs.tolist()] == brute_force(data, 0.1)
+
+    assert radius_pairs(data[:0], 0.1, method=method).shape == (0, 2)
+
+
+def test_radius_pairs_exceptions(data):
+    from sparsecomputation.evaluation import radius_pairs
+
+    with pytest.raises(ValueError):
+        radius_pairs(data, 0.1, method='ball_tree')
+    with pytest.raises(ValueError):
+        radius_pairs(data, -1)
+    with pytest.raises(ValueError):
+        radius_pairs(data, 0.1, chunk_size=0)
+
+
+def test_evaluate(data):
+    from sparsecomputation import PCA, SparseComputation
+    from sparsecomputation.evaluation import PairEvaluator
+
+    evaluator = PairEvaluator(data, 0.1, sample_size=None)
+    assert evaluator.numExactPairs == len(brute_force(data, 0.1))
+
+    # pairs within the block width are always in adjacent boxes
+    sc = SparseComputation(None, distance=0.1, rescale=None)
+    result = evaluator.evaluate(sc)
+    assert result['recall'] == 1.0
+    assert 0 < result['precision'] < 1
+    assert result['numPairs'] == result['numSamplePairs']
+    assert result['time'] >= 0
+    assert result['stats'] is sc.stats
+    assert result['numPairs'] == len(sc.select_pairs(data))
+
+    sc = SparseComputation(PCA(1), distance=0.01)
+    result = evaluator.evaluate(sc)
+    assert result['recall'] < 1
+
+    pairs = np.array(sorted(brute_force(data, 0.1)))[::2]
+    result = evaluator.evaluate(sc, pairs=pairs[:, ::-1])
+    assert result['precision'] == 1.0
+    assert result['recall'] == float(len(pairs)) / evaluator.numExactPairs
+    assert result['time'] is None
+
+
+def test_evaluate_sample(data):
+    from sparsecomputation import SparseComputation
+    from sparsecomputation.evaluation import PairEvaluator
+
+    evaluator = PairEvaluator(data, 0.1, sample_size=200, random_state=0)
+    assert len(evaluator.sample) == 200
+    assert len(np.unique(evaluator.sample)) == 200
+
+    sample = data[evaluator.sample]
+    assert evaluator.numExactPairs == len(brute_force(sample, 0.1))
+
+    sc = SparseComputation(None, distance=0.1, rescale=None)
+    result = evaluator.evaluate(sc)
+    assert result['recall'] == 1.0
+    assert result['numSamplePairs'] < result['numPairs']
+
+    sampleResult = PairEvaluator(sample, 0.1).evaluate(sc)
+    assert result['numSamplePairs'] == sampleResult['numSamplePairs']
+    assert result['precision'] == sampleResult['precision']
+
+    with pytest.raises(ValueError):
+        PairEvaluator(data, 0.1, sample_size=0)
+    with pytest.raises(TypeError):
+        PairEvaluator(data.tolist(), 0.1)
+
+
+def test_pareto_front():
+    from sparsecomputation.evaluation import pareto_front
+
+    results = [{'time': 1, 'recall': 0.5}, {'time': 2, 'recall': 0.4},
+               {'time': 3, 'recall': 0.9}, {'time': 0.5, 'recall': 0.2},
+               {'time': 1, 'recall': 0.6}, {'time': 4, 'recall': 0.9}]
+    assert pareto_front(results) == [3, 4, 2]
+    assert pareto_front([]) == []
@@ -0,0 +1,33 @@
+import subprocess
+import sys
+
+
+def test_import_is_lazy():
+    code = (
+        "import sys, sparsecomputation; "
+        "print(' '.join(sorted(m for m in ('sklearn', 'scipy', 'numba', "
+        "'six') if m in sys.modules)))"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code])
+    assert output.decode().strip() == ""
+
+
+def test_reducer_imports_sklearn():
+    code = (
+        "import sys, sparsecomputation; "
+        "sparsecomputation.PCA(2); "
+        "print('sklearn' in sys.modules)"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code])
+    assert output.decode().strip() == "True"
+
+
+def test_small_select_pairs_skips_numba():
+    code = (
+        "import sys, numpy as np, sparsecomputation; "
+        "sc = sparsecomputation.SparseComputation(None, resolution=20); "
+        "sc.select_pairs(np.random.uniform(size=(1000, 2))); "
+        "print('numba' in sys.modules)"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code])
+    assert output.decode().strip() == "False"
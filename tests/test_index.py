@@ -0,0 +1,203 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def data():
+    np.random.seed(0)
+    return np.random.uniform(size=(400, 2))
+
+
+@pytest.fixture
+def index(data):
+    from sparsecomputation import GridIndex
+
+    return GridIndex(None, resolution=10).fit(data)
+
+
+def test_query_matches_select_pairs(data, index):
+    from sparsecomputation import SparseComputation
+
+    sc = SparseComputation(None, resolution=10, method='block_enumeration')
+    neighbors = [set() for _ in range(len(data))]
+    for a, b in sc.select_pairs(data):
+        neighbors[a].add(b)
+        neighbors[b].add(a)
+
+    candidates = index.query(data)
+    assert len(candidates) == len(data)
+    for i, objects in enumerate(candidates):
+        assert np.all(np.diff(objects) > 0)
+        assert set(objects.tolist()) == neighbors[i] | {i}
+
+
+def test_query_csr(data, index):
+    indptr, candidates = index.query_csr(data[:5])
+    assert len(indptr) == 6
+    assert indptr[-1] == len(candidates)
+
+    for i, objects in enumerate(index.query(data[:5])):
+        np.testing.assert_equal(candidates[indptr[i]:indptr[i + 1]], objects)
+
+
+def test_query_outside_grid(data):
+    from sparsecomputation import GridIndex
+
+    index = GridIndex(None, resolution=10, rescale=None).fit(data)
+    candidates = index.query(np.array([[5.0, 5.0], [-3.0, 0.5]]))
+    assert [len(x) for x in candidates] == [0, 0]
+
+    indptr, candidates = index.query_csr(np.zeros((0, 2)))
+    np.testing.assert_equal(indptr, [0])
+    assert len(candidates) == 0
+
+
+def test_query_dim_reducer(data):
+    from mock import MagicMock
+    from sparsecomputation import GridIndex
+
+    dimReducer = MagicMock()
+    dimReducer.fit_transform.return_value = data
+    dimReducer.transform.return_value = data[:3]
+
+    index = GridIndex(dimReducer, resolution=10).fit(data, seed=1)
+    assert dimReducer.fit_transform.call_args[0][0] is data
+    assert dimReducer.fit_transform.call_args[1] == {'seed': 1}
+
+    points = np.zeros((3, data.shape[1]))
+    index.query(points)
+    assert dimReducer.transform.call_args[0][0] is points
+
+
+def test_query_exceptions(data):
+    from sparsecomputation import GridIndex
+
+    index = GridIndex(None, resolution=10)
+    with pytest.raises(ValueError):
+        index.query(data)
+
+    index.fit(data)
+    with pytest.raises(TypeError):
+        index.query('test')
+
+    index.check_points(data[:3])
+    with pytest.raises(ValueError):
+        index.check_points(data[:3, :1])
+    with pytest.raises(ValueError):
+        index.check_points(data[0])
+
+    with pytest.raises(TypeError):
+        index.fit('test')
+
+
+def brute_force_candidates(data, ids, resolution, points):
+    """Stored ids in equal or adjacent boxes of each point, rescaling off."""
+    boxIDs = np.floor(data * resolution).astype(int)
+    pointIDs = np.floor(points * resolution).astype(int)
+    return [
+        sorted(ids[np.all(np.abs(boxIDs - x) <= 1, axis=1)].tolist())
+        for x in pointIDs
+    ]
+
+
+@pytest.mark.parametrize("compactFraction", [0.01, 0.25, 100])
+def test_streaming_add_remove(data, compactFraction):
+    from sparsecomputation import StreamingGridIndex
+
+    index = StreamingGridIndex(None, resolution=10, rescale=None,
+                               compact_fraction=compactFraction)
+    index.fit(data[:100], timestamps=np.zeros(100))
+    np.testing.assert_equal(
+        index.add(data[100:250], timestamps=np.arange(150) + 1.0),
+        np.arange(100, 250))
+    np.testing.assert_equal(
+        index.add(data[250:], timestamps=np.arange(150) + 151.0),
+        np.arange(250, 400))
+
+    assert index.remove(np.arange(0, 400, 3)) == 134
+    assert index.remove(np.array([0, 3, 1000])) == 0
+    assert index.expire(before=100.0) == 199 - 67
+    assert len(index) == 400 - 134 - 132
+
+    isLive = np.ones(400, dtype=bool)
+    isLive[::3] = False
+    isLive[:199] = False
+    ids = np.flatnonzero(isLive)
+
+    points = np.random.uniform(size=(50, 2))
+    expected = brute_force_candidates(data[ids], ids, 10, points)
+    assert [x.tolist() for x in index.query(points)] == expected
+
+
+@pytest.mark.parametrize("method", [
+    'block_enumeration', 'object_shifting', 'block_shifting'])
+def test_streaming_select_index_pairs(data, method):
+    from sparsecomputation import SparseComputation, StreamingGridIndex
+
+    index = StreamingGridIndex(None, resolution=10, method=method,
+                               rescale=None, compact_fraction=100)
+    index.fit(data[:200])
+    index.add(data[200:])
+    index.remove(np.arange(0, 400, 2))
+    assert index.numCompactions == 1
+
+    pairs = index.select_index_pairs()
+    assert index.numCompactions == 2
+
+    sc = SparseComputation(None, resolution=10, method=method, rescale=None)
+    expected = [(2 * a + 1, 2 * b + 1) for a, b in sc.select_pairs(data[1::2])]
+    assert sorted(pairs) == sorted(expected)
+
+
+def test_streaming_refit_bounds(data):
+    from sparsecomputation import SparseComputation, StreamingGridIndex
+
+    index = StreamingGridIndex(None, resolution=10, method='block_enumeration',
+                               compact_fraction=100)
+    index.fit(data[:200])
+    # the window drifts out of the fitted range
+    index.add(data[200:] + 2)
+    assert index.numClipped == 200
+    index.remove(np.arange(200))
+
+    pairs = index.select_index_pairs()
+    assert index.numClipped == 0
+    sc = SparseComputation(None, resolution=10, method='block_enumeration')
+    expected = [(a + 200, b + 200) for a, b in sc.select_pairs(data[200:])]
+    assert sorted(pairs) == sorted(expected)
+
+    indptr, candidates = index.query_csr(data[200:] + 2)
+    assert indptr[-1] == len(data[200:]) + 2 * len(expected)
+
+
+def test_streaming_compaction_bounds_memory(data):
+    from sparsecomputation import StreamingGridIndex
+
+    index = StreamingGridIndex(None, resolution=10, rescale=None)
+    index.fit(data[:50], timestamps=np.zeros(50))
+    for step in range(1, 100):
+        index.add(data[step % 8 * 50:(step % 8 + 1) * 50],
+                  timestamps=np.full(50, float(step)))
+        index.expire(before=step - 3)
+
+    assert len(index) == 200
+    assert len(index._ids) <= 2 * 200
+    assert index.numCompactions > 1
+
+
+def test_streaming_exceptions(data):
+    from sparsecomputation import StreamingGridIndex
+
+    with pytest.raises(ValueError):
+        StreamingGridIndex(None, resolution=10, compact_fraction=0)
+
+    index = StreamingGridIndex(None, resolution=10)
+    with pytest.raises(ValueError):
+        index.add(data)
+
+    index.fit(data)
+    with pytest.raises(ValueError):
+        index.add(data, timestamps=np.zeros(3))
+
+    with pytest.raises(TypeError):
+        index.add('test')
@@ -0,0 +1,201 @@
+import numpy as np
+import pytest
+
+from sparsecomputation import kernels
+
+
+BACKENDS = ['numpy', pytest.param('numba', marks=pytest.mark.skipif(
+    kernels.import_numba() is None, reason='numba is not installed'))]
+
+
+@pytest.fixture
+def IDs():
+    """Grid indices of the objects"""
+    return np.array([
+        [2, 2],
+        [0, 0],
+        [2, 1],
+        [2, 2],
+        [1, 1],
+        [0, 0],
+        [2, 2],
+    ])
+
+
+def test_group_boxes(IDs):
+    from sparsecomputation.kernels import group_boxes
+
+    grid = group_boxes(IDs)
+    np.testing.assert_equal(grid.keys, [[0, 0], [1, 1], [2, 1], [2, 2]])
+    np.testing.assert_equal(grid.indptr, [0, 2, 3, 4, 7])
+    np.testing.assert_equal(grid.members, [1, 5, 4, 2, 0, 3, 6])
+    np.testing.assert_equal(grid.labels, [3, 0, 2, 3, 1, 0, 3])
+
+
+def test_group_boxes_without_encoding():
+    from sparsecomputation.kernels import group_boxes, get_key_encoding
+
+    IDs = np.array([[0, 2 ** 40], [2 ** 40, 0], [0, 2 ** 40]])
+    assert get_key_encoding(IDs) is None
+
+    grid = group_boxes(IDs)
+    np.testing.assert_equal(grid.keys, [[0, 2 ** 40], [2 ** 40, 0]])
+    np.testing.assert_equal(grid.indptr, [0, 2, 3])
+    np.testing.assert_equal(grid.labels, [0, 1, 0])
+
+
+def test_coarsen_boxes(IDs):
+    from sparsecomputation.kernels import group_boxes, coarsen_boxes
+
+    grid = group_boxes(IDs)
+    coarseGrid = coarsen_boxes(grid, grid.keys // 2)
+    np.testing.assert_equal(coarseGrid.keys, [[0, 0], [1, 0], [1, 1]])
+    np.testing.assert_equal(coarseGrid.indptr, [0, 3, 4, 7])
+    np.testing.assert_equal(coarseGrid.members, [1, 5, 4, 2, 0, 3, 6])
+    np.testing.assert_equal(coarseGrid.labels, [2, 0, 1, 2, 0, 0, 2])
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_within_box_pairs(IDs, backend):
+    from sparsecomputation.kernels import group_boxes, within_box_pairs
+
+    grid = group_boxes(IDs)
+    pairs = within_box_pairs(grid.indptr, grid.members, backend=backend)
+    assert pairs.tolist() == [[1, 5], [0, 3], [0, 6], [3, 6]]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_between_box_pairs(IDs, backend):
+    from sparsecomputation.kernels import group_boxes, between_box_pairs
+
+    grid = group_boxes(IDs)
+    boxPairs = np.array([[0, 1], [3, 2], [1, 1]])
+    pairs = between_box_pairs(grid.indptr, grid.members, grid.indptr,
+                              grid.members, boxPairs, backend=backend)
+    assert pairs.tolist() == [[1, 4], [5, 4], [0, 2], [3, 2], [6, 2],
+                              [4, 4]]
+
+    pairs = between_box_pairs(grid.indptr, grid.members, grid.indptr,
+                              grid.members, np.zeros((0, 2)),
+                              backend=backend)
+    assert pairs.shape == (0, 2)
+
+
+def test_unknown_backend(IDs):
+    from sparsecomputation.kernels import group_boxes, within_box_pairs
+
+    grid = group_boxes(IDs)
+    with pytest.raises(ValueError):
+        within_box_pairs(grid.indptr, grid.members, backend='test')
+
+
+@pytest.mark.parametrize("numDims", [1, 2, 4])
+@pytest.mark.parametrize("chunkSize", [3, 2 ** 20])
+def test_sweep_adjacent_boxes(numDims, chunkSize):
+    from sparsecomputation.kernels import group_boxes, sweep_adjacent_boxes
+
+    np.random.seed(numDims)
+    keys = group_boxes(np.random.randint(-3, 4, size=(300, numDims))).keys
+    keys[:, 0] *= 2 ** 40
+
+    boxPairs, numCandidates = sweep_adjacent_boxes(keys, chunkSize=chunkSize)
+    expected = sorted(
+        (i, j) for i in range(len(keys)) for j in range(i + 1, len(keys))
+        if np.abs(keys[i] - keys[j]).max() <= 1
+    )
+    assert sorted(map(tuple, boxPairs.tolist())) == expected
+    assert numCandidates >= len(expected)
+
+
+def test_sweep_adjacent_boxes_empty():
+    from sparsecomputation.kernels import sweep_adjacent_boxes
+
+    boxPairs, numCandidates = sweep_adjacent_boxes(np.zeros((0, 3), int))
+    assert boxPairs.shape == (0, 2)
+    assert numCandidates == 0
+
+
+@pytest.mark.parametrize("numDims", [1, 2, 3, 5])
+@pytest.mark.parametrize("scale", [1, 2 ** 40])
+def test_shift_adjacent_boxes(numDims, scale):
+    from sparsecomputation.kernels import shift_adjacent_boxes
+
+    np.random.seed(numDims)
+    keys = np.unique(np.random.randint(-3, 4, size=(300, numDims)), axis=0)
+    # large keys cannot be encoded in a single integer
+    keys = keys * scale
+
+    boxPairs, numPairs = shift_adjacent_boxes(keys)
+    expected = [
+        (i, j) for i in range(len(keys)) for j in range(i + 1, len(keys))
+        if np.abs(keys[i] - keys[j]).max() <= 1
+    ]
+    assert list(map(tuple, boxPairs.tolist())) == expected
+    assert numPairs >= len(expected)
+
+    boxPairs, numPairs = shift_adjacent_boxes(keys[:1])
+    assert boxPairs.shape == (0, 2)
+    assert numPairs == 0
+
+
+def test_split_ranges():
+    from sparsecomputation.kernels import split_ranges
+
+    counts = np.array([3, 4, 0, 12, 1, 1, 1, 0])
+    assert split_ranges(counts, 7) == [(0, 3), (3, 4), (4, 8)]
+    assert split_ranges(counts, 100) == [(0, 8)]
+    assert split_ranges(np.zeros(0, dtype=int), 5) == []
+
+
+@pytest.mark.parametrize("chunkSize", [1, 3, 7, 100])
+def test_split_box_pairs(IDs, chunkSize):
+    from sparsecomputation.kernels import (
+        box_slice_pairs, group_boxes, split_box_pairs)
+
+    grid = group_boxes(IDs)
+    boxPairs = np.array([[0, 0], [3, 3], [3, 2], [0, 3], [1, 2]])
+    slices, counts = split_box_pairs(grid.indptr, boxPairs, chunkSize)
+    assert (counts <= max(chunkSize, 3)).all()
+    assert (slices[:, 2] < slices[:, 3]).all()
+
+    expected = []
+    for i, j in boxPairs:
+        objects1 = grid.members[grid.indptr[i]:grid.indptr[i + 1]]
+        objects2 = grid.members[grid.indptr[j]:grid.indptr[j + 1]]
+        if i == j:
+            expected += [(a, b) for k, a in enumerate(objects1)
+                         for b in objects1[k + 1:]]
+        else:
+            expected += [(a, b) for a in objects1 for b in objects2]
+
+    pairs = [tuple(x) for x in box_slice_pairs(
+        grid.indptr, grid.members, slices).tolist()]
+    assert sorted(pairs) == sorted(expected)
+    assert counts.sum() == len(expected)
+
+    out = np.zeros((len(expected), 2), dtype=np.intp)
+    assert box_slice_pairs(grid.indptr, grid.members, slices, out=out) is out
+    assert sorted(map(tuple, out.tolist())) == sorted(expected)
+    with pytest.raises(ValueError):
+        box_slice_pairs(grid.indptr, grid.members, slices, out=out[1:])
+    for slice_, count in zip(slices, counts):
+        assert len(box_slice_pairs(
+            grid.indptr, grid.members, slice_[None])) == count
+
+
+def test_default_backend(monkeypatch):
+    from sparsecomputation.kernels import (
+        NUMBA_MIN_PAIRS, _get_backend, _within_box_pairs_loop)
+
+    monkeypatch.setattr(kernels, '_compiledLoops', {})
+    # small outputs never import numba or compile the loops
+    monkeypatch.setattr(kernels, 'import_numba', lambda: 1 / 0)
+    assert _get_backend(None, _within_box_pairs_loop, 10) == 'numpy'
+
+    monkeypatch.setattr(kernels, 'import_numba', lambda: None)
+    assert _get_backend(
+        None, _within_box_pairs_loop, NUMBA_MIN_PAIRS) == 'numpy'
+    monkeypatch.setattr(kernels, 'import_numba', lambda: object())
+    assert _get_backend(
+        None, _within_box_pairs_loop, NUMBA_MIN_PAIRS) == 'numba'
+    assert _get_backend('numpy', _within_box_pairs_loop, 10**9) == 'numpy'
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def pairs():
+    np.random.seed(0)
+    pairs = np.random.randint(0, 1000, size=(5000, 2))
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+    return pairs[np.random.permutation(len(pairs))]
+
+
+def sorted_pairs(pairs):
+    return sorted([tuple(sorted(x)) for x in pairs])
+
+
+@pytest.mark.parametrize("values", [
+    [], [0], [127, 128, 300, 2 ** 35], [2 ** 64 - 1, 1, 0]])
+def test_varints(values):
+    from sparsecomputation.pairfile import decode_varints, encode_varints
+
+    values = np.array(values, dtype=np.uint64)
+    encoded = encode_varints(values)
+    assert encoded.dtype == np.uint8
+    np.testing.assert_equal(decode_varints(encoded), values)
+
+    np.testing.assert_equal(encode_varints([1, 300]), [1, 0xAC, 0x02])
+
+
+@pytest.mark.parametrize("chunkRows", [1, 7, 4096])
+def test_write_read(tmpdir, pairs, chunkRows):
+    from sparsecomputation.pairfile import PairFile, write_pair_file
+
+    path = str(tmpdir.join('pairs.bin'))
+    size = write_pair_file(path, pairs, num_objects=1200,
+                           chunk_rows=chunkRows)
+    reader = PairFile(path)
+    assert size == tmpdir.join('pairs.bin').size()
+    assert reader.numObjects == 1200
+    assert len(reader) == len(pairs)
+    assert not reader.symmetric
+
+    result = reader.to_pairs()
+    assert np.all(result[:, 0] < result[:, 1])
+    assert sorted_pairs(result.tolist()) == sorted_pairs(pairs.tolist())
+
+    expected = np.bincount(pairs.min(axis=1), minlength=1200)
+    np.testing.assert_equal(reader.degrees, expected)
+
+    indptr, targets = reader.to_csr()
+    for source in [0, 5, 999, 1199, 500]:
+        neighbors = sorted(pairs[pairs.min(axis=1) == source].max(axis=1))
+        assert reader.neighbors(source).tolist() == neighbors
+        assert targets[indptr[source]:indptr[source + 1]].tolist() == \
+            neighbors
+
+
+def test_write_symmetric(tmpdir, pairs):
+    from sparsecomputation.pairfile import PairFile, write_pair_file
+
+    path = str(tmpdir.join('pairs.bin'))
+    write_pair_file(path, pairs, symmetric=True, chunk_rows=100)
+    reader = PairFile(path)
+    assert reader.symmetric
+    assert len(reader) == 2 * len(pairs)
+    assert reader.numObjects == pairs.max() + 1
+
+    for source in [0, 17, 999]:
+        isIncident = (pairs == source).any(axis=1)
+        neighbors = sorted(pairs[isIncident].sum(axis=1) - source)
+        assert reader.neighbors(source).tolist() == neighbors
+
+
+def test_write_compact(tmpdir):
+    from sparsecomputation import SparseComputation
+    from sparsecomputation.pairfile import write_pair_file
+
+    np.random.seed(0)
+    data = np.random.uniform(size=(20000, 2))
+    sc = SparseComputation(None, resolution=100)
+    pairs = sc.select_pairs(data, as_array=True)
+
+    size = write_pair_file(str(tmpdir.join('pairs.bin')), pairs)
+    assert size < 0.3 * pairs.astype(np.int64).nbytes
+
+
+def test_write_read_empty(tmpdir):
+    from sparsecomputation.pairfile import PairFile, write_pair_file
+
+    path = str(tmpdir.join('pairs.bin'))
+    write_pair_file(path, np.zeros((0, 2), dtype=int), num_objects=3)
+    reader = PairFile(path)
+    assert len(reader) == 0
+    assert reader.to_pairs().shape == (0, 2)
+    assert len(reader.neighbors(2)) == 0
+
+
+def test_exceptions(tmpdir, pairs):
+    from sparsecomputation.pairfile import PairFile, write_pair_file
+
+    path = str(tmpdir.join('pairs.bin'))
+    with pytest.raises(ValueError):
+        write_pair_file(path, pairs, num_objects=10)
+
+    with pytest.raises(ValueError):
+        write_pair_file(path, -pairs)
+
+    with pytest.raises(ValueError):
+        write_pair_file(path, pairs, chunk_rows=0)
+
+    write_pair_file(path, pairs)
+    reader = PairFile(path)
+    with pytest.raises(IndexError):
+        reader.neighbors(reader.numObjects)
+
+    tmpdir.join('other.bin').write(b'0' * 100)
+    with pytest.raises(ValueError):
+        PairFile(str(tmpdir.join('other.bin')))
@@ -256,3 +256,590 @@ def test_select_pairs_real_data(SC):
         tuple(sorted(x)) for x in SC.select_pairs(data)
         ])
     assert sortedPairsBE == sortedPairsOS
+
+
+def test_rescale_and_project(SC, data, IDs):
+    original = data.copy()
+    np.testing.assert_equal(SC._rescale_and_project(data, 0.25), IDs)
+    np.testing.assert_equal(data, original)
+
+    SC.rescale = 'min_max'
+    out = np.empty(data.shape, dtype=np.int64)
+    boxIDs = SC._rescale_and_project(data, 0.25, out=out)
+    assert boxIDs is out
+    np.testing.assert_equal(boxIDs, [
+        [0, 0],
+        [1, 1],
+        [2, 1],
+        [1, 2],
+        [2, 2],
+        [2, 2],
+        [3, 3],
+    ])
+    np.testing.assert_equal(data, original)
+
+
+def test_shift_box_ids(SC, data, IDs):
+    for shift in SC._generate_shifts(2):
+        shiftedData = data + [float(x) * SC.distance for x in shift]
+        np.testing.assert_equal(
+            SC._shift_box_ids(IDs, shift),
+            SC._project_onto_grid(shiftedData, 2 * SC.distance),
+        )
+
+
+def test_reduce_data_cache(SC, data):
+    from mock import MagicMock
+    from sparsecomputation.dimreducer import DimReducer
+
+    SC.dimReducer = DimReducer(2)
+    SC.dimReducer.fit_transform = MagicMock(
+        side_effect=lambda x, seed: x * 1.0)
+    assert SC.select_pairs(data) == SC.select_pairs(data)
+    assert SC.dimReducer.fit_transform.call_count == 2
+
+    SC.cacheMemory = data.nbytes
+    SC.select_pairs(data)
+    SC.distance = 0.5
+    SC.select_pairs(data)
+    assert SC.dimReducer.fit_transform.call_count == 3
+
+    # least recently used projection is evicted
+    SC.select_pairs(data + 1.0)
+    assert SC.dimReducer.fit_transform.call_count == 4
+    SC.select_pairs(data)
+    assert SC.dimReducer.fit_transform.call_count == 5
+
+    assert SC.evict(data)
+    assert not SC.evict(data)
+    SC.select_pairs(data)
+    SC.clear_cache()
+    SC.select_pairs(data)
+    assert SC.dimReducer.fit_transform.call_count == 7
+
+
+def test_reduce_data_cache_key(SC, data):
+    from mock import MagicMock
+    from sparsecomputation.dimreducer import DimReducer
+
+    SC.dimReducer = DimReducer(2)
+    SC.dimReducer.fit_transform = MagicMock(
+        side_effect=lambda x, seed: x * 1.0)
+    SC.cacheMemory = 10 * data.nbytes
+
+    # large array parameters that only differ beyond their repr
+    SC.dimReducer.weights = np.zeros(10000)
+    SC.reduce_data(data)
+    SC.dimReducer.weights = np.zeros(10000)
+    SC.dimReducer.weights[5000] = 1.0
+    SC.reduce_data(data)
+    assert SC.dimReducer.fit_transform.call_count == 2
+    SC.reduce_data(data)
+    assert SC.dimReducer.fit_transform.call_count == 2
+
+    # a random generator draws a new projection on every fit
+    SC.dimReducer.random_state = np.random.RandomState(0)
+    SC.reduce_data(data)
+    SC.reduce_data(data)
+    assert SC.dimReducer.fit_transform.call_count == 4
+    SC.dimReducer.random_state = 0
+    SC.reduce_data(data, seed=np.random.RandomState(0))
+    SC.reduce_data(data, seed=np.random.RandomState(0))
+    assert SC.dimReducer.fit_transform.call_count == 6
+
+
+def test_select_pairs_reduced(SC, data, pairs):
+    from mock import MagicMock
+
+    SC.dimReducer = MagicMock()
+    sortedPairs = sorted([
+        tuple(sorted(x)) for x in SC.select_pairs(data, reduced=True)
+        ])
+    assert sortedPairs == pairs
+    assert not SC.dimReducer.fit_transform.called
+
+
+@pytest.mark.parametrize("method", [
+    'block_enumeration', 'object_shifting', 'block_shifting'])
+def test_select_pairs_multi(SC, method):
+    np.random.seed(0)
+    data = np.random.uniform(size=(200, 2))
+    resolutions = [32, 8, 4, 5]
+
+    SC.method = method
+    SC.rescale = 'min_max'
+    result = SC.select_pairs_multi(data, resolutions)
+    assert sorted(result) == sorted(resolutions)
+    assert sorted(SC.stats) == sorted(resolutions)
+
+    for resolution in resolutions:
+        SC.resolution = resolution
+        expected = sorted([tuple(sorted(x)) for x in SC.select_pairs(data)])
+        assert sorted([
+            tuple(sorted(x)) for x in result[resolution]
+            ]) == expected
+
+    counts = SC.select_pairs_multi(data, resolutions, counts=True)
+    assert counts == {r: len(result[r]) for r in resolutions}
+
+
+def test_count_halvings(SC):
+    assert SC._count_halvings(32, 8) == 2
+    assert SC._count_halvings(10, 5) == 1
+    assert SC._count_halvings(8, 8) is None
+    assert SC._count_halvings(8, 5) is None
+    assert SC._count_halvings(8, 16) is None
+
+
+@pytest.mark.parametrize("method", [
+    'block_enumeration', 'object_shifting', 'block_shifting'])
+def test_select_pairs_as_array(SC, data, pairs, method):
+    SC.method = method
+    result = SC.select_pairs(data, as_array=True)
+    assert isinstance(result, np.ndarray)
+    assert result.shape == (len(pairs), 2)
+    assert sorted([tuple(sorted(x)) for x in result.tolist()]) == pairs
+
+
+@pytest.mark.parametrize("method", [
+    'block_enumeration', 'object_shifting', 'block_shifting'])
+def test_select_cross_pairs(SC, method):
+    np.random.seed(0)
+    dataA = np.random.uniform(size=(100, 2))
+    dataB = np.random.uniform(size=(150, 2))
+
+    SC.method = method
+    SC.rescale = 'min_max'
+    SC.resolution = 10
+    crossPairs = SC.select_cross_pairs(dataA, dataB)
+    numUniquePairs = SC.stats['numUniquePairs']
+
+    allPairs = SC.select_pairs(np.concatenate((dataA, dataB)))
+    expected = sorted([
+        (a, b - len(dataA)) for a, b in [sorted(x) for x in allPairs]
+        if a < len(dataA) <= b
+        ])
+    assert len(expected) > 0
+    assert sorted(crossPairs) == expected
+    assert numUniquePairs == len(expected)
+
+
+def test_select_cross_pairs_exceptions(SC, data):
+    with pytest.raises(TypeError):
+        SC.select_cross_pairs(data, 'test')
+
+    with pytest.raises(ValueError):
+        SC.select_cross_pairs(data, data[:, :1])
+
+
+@pytest.mark.parametrize("method", [
+    'block_enumeration', 'object_shifting', 'block_shifting'])
+@pytest.mark.parametrize("pairType,isSelected", [
+    ('labeled_unlabeled', lambda a, b: (a < 0) != (b < 0)),
+    ('cross_label', lambda a, b: a != b),
+    ('same_label', lambda a, b: a == b),
+    ('not_same_labeled', lambda a, b: a != b or a < 0),
+])
+def test_select_pairs_labels(SC, method, pairType, isSelected):
+    np.random.seed(0)
+    data = np.random.uniform(size=(300, 2))
+    labels = np.random.randint(-1, 3, size=300)
+
+    SC.method = method
+    SC.resolution = 10
+    allPairs = SC.select_pairs(data)
+    expected = sorted([
+        tuple(sorted(x)) for x in allPairs
+        if isSelected(labels[x[0]], labels[x[1]])
+        ])
+
+    SC.pairType = pairType
+    pairs = SC.select_pairs(data, labels=labels)
+    assert len(pairs) == len(set(pairs))
+    assert sorted([tuple(sorted(x)) for x in pairs]) == expected
+    assert SC.stats['numUniquePairs'] == len(expected)
+
+
+def test_select_pairs_labels_exceptions(SC, data):
+    SC.pairType = 'cross_label'
+    with pytest.raises(ValueError):
+        SC.select_pairs(data)
+
+    with pytest.raises(ValueError):
+        SC.select_pairs(data, labels=np.zeros(2))
+
+    SC.pairType = 'test'
+    with pytest.raises(ValueError):
+        SC.select_pairs(data, labels=np.zeros(len(data)))
+
+
+@pytest.mark.parametrize("rescale", [
+    'min_max', 'quantile_min_max', 'zscore', 'quantile'])
+def test_rescale_data_robust(SC, rescale):
+    np.random.seed(0)
+    data = np.random.normal(size=(1000, 2))
+    data[0] = 20.0
+
+    SC.rescale = rescale
+    rescaledData = SC._rescale_data(data)
+    assert rescaledData.shape == data.shape
+    assert np.all(rescaledData >= 0) and np.all(rescaledData < 1)
+
+    # rescaling is monotone in each dimension
+    for dim in range(data.shape[1]):
+        order = np.argsort(data[:, dim])
+        assert np.all(np.diff(rescaledData[order, dim]) >= 0)
+
+    # only min-max rescaling is squashed by the outlier
+    spread = np.std(rescaledData[1:], axis=0)
+    if rescale == 'min_max':
+        assert np.all(spread < 0.05)
+    else:
+        assert np.all(spread > 0.1)
+
+
+def test_fit_rescale_sample(SC):
+    np.random.seed(0)
+    data = np.random.uniform(size=(1000, 2))
+
+    SC.rescale = 'quantile_min_max'
+    SC.clipQuantile = 0.0
+    SC.rescaleSampleSize = 100
+    minimum, gap = SC._fit_rescale(data)
+    assert np.all(minimum >= np.amin(data, axis=0))
+    assert minimum.shape == gap.shape == (1, 2)
+
+    sample = SC._get_rescale_sample(data)
+    assert 0 < len(sample) <= 100
+    np.testing.assert_array_equal(sample, SC._get_rescale_sample(data))
+
+    SC.rescaleSampleSize = 1000
+    minimum, gap = SC._fit_rescale(data)
+    np.testing.assert_allclose(minimum, np.amin(data, axis=0, keepdims=True))
+
+
+def test_rescale_exceptions():
+    from sparsecomputation import SparseComputation
+
+    with pytest.raises(ValueError):
+        SparseComputation(None, resolution=4, rescale_sample_size=0)
+
+    with pytest.raises(ValueError):
+        SparseComputation(None, resolution=4, clip_quantile=0.5)
+
+    with pytest.raises(ValueError):
+        SparseComputation(None, resolution=4, clip_zscore=0)
+
+
+@pytest.mark.parametrize("method", [
+    'block_enumeration', 'object_shifting', 'block_shifting'])
+def test_select_pairs_occupancy_stats(SC, data, method):
+    SC.method = method
+    SC.select_pairs(data)
+    assert SC.stats['numBoxes'] == 6
+    assert SC.stats['maxBoxOccupancy'] == 2
+    assert SC.stats['meanBoxOccupancy'] == 7 / 6.0
+
+
+@pytest.mark.parametrize("method", [
+    'block_enumeration', 'object_shifting', 'block_shifting'])
+@pytest.mark.parametrize("topK", [1, 50, 100000])
+def test_select_pairs_top_k(SC, method, topK):
+    np.random.seed(0)
+    data = np.random.uniform(size=(4000, 3))
+
+    SC.method = method
+    SC.resolution = 10
+    allPairs = SC.select_pairs(data, as_array=True)
+    distances = np.linalg.norm(data[allPairs[:, 0]] - data[allPairs[:, 1]],
+                               axis=1)
+    expected = allPairs[np.argsort(distances)[:topK]]
+
+    pairs = SC.select_pairs(data, top_k=topK)
+    assert len(pairs) == min(topK, len(allPairs))
+    assert [tuple(sorted(x)) for x in pairs] == [
+        tuple(sorted(x)) for x in expected.tolist()]
+    assert SC.stats['numUniquePairs'] == len(pairs)
+    if 10 * topK < len(allPairs):
+        assert SC.stats['numExpandedPairs'] < len(allPairs)
+
+
+def test_select_pairs_top_k_labels(SC):
+    np.random.seed(0)
+    data = np.random.uniform(size=(300, 2))
+    labels = np.random.randint(-1, 3, size=300)
+
+    SC.pairType = 'cross_label'
+    SC.resolution = 10
+    allPairs = SC.select_pairs(data, labels=labels, as_array=True)
+    distances = np.linalg.norm(data[allPairs[:, 0]] - data[allPairs[:, 1]],
+                               axis=1)
+
+    pairs = SC.select_pairs(data, labels=labels, top_k=20, as_array=True)
+    assert all(labels[a] != labels[b] for a, b in pairs)
+    np.testing.assert_allclose(
+        np.linalg.norm(data[pairs[:, 0]] - data[pairs[:, 1]], axis=1),
+        np.sort(distances)[:20])
+
+
+def test_select_pairs_top_k_large_box(SC, monkeypatch):
+    from sparsecomputation import kernels
+
+    np.random.seed(0)
+    data = np.random.uniform(size=(5000, 2))
+    data[:600] *= 0.01
+
+    SC.resolution = 50
+    allPairs = SC.select_pairs(data, as_array=True)
+    distances = np.linalg.norm(data[allPairs[:, 0]] - data[allPairs[:, 1]],
+                               axis=1)
+
+    # the box of 600 objects is expanded in slices of the batch size
+    sizes = []
+    slicePairs = kernels.box_slice_pairs
+    monkeypatch.setattr(kernels, 'box_slice_pairs', lambda *args: sizes.append(
+        len(slicePairs(*args))) or slicePairs(*args))
+    pairs = SC.select_pairs(data, top_k=10, as_array=True)
+    assert max(sizes) <= 2 ** 16
+    assert SC.stats['numExpandedPairs'] < len(allPairs)
+    np.testing.assert_allclose(
+        np.linalg.norm(data[pairs[:, 0]] - data[pairs[:, 1]], axis=1),
+        np.sort(distances)[:10])
+
+
+def test_select_pairs_top_k_exceptions(SC, data):
+    with pytest.raises(ValueError):
+        SC.select_pairs(data, top_k=0)
+
+    with pytest.raises(ValueError):
+        SC.select_pairs(data, top_k=1.5)
+
+
+@pytest.mark.parametrize("method", [
+    'block_enumeration', 'object_shifting', 'block_shifting'])
+def test_select_degrees(SC, method):
+    np.random.seed(0)
+    data = np.random.uniform(size=(300, 2))
+
+    SC.method = method
+    SC.resolution = 10
+    pairs = SC.select_pairs(data, as_array=True)
+    expected = np.bincount(pairs.reshape(-1), minlength=len(data))
+
+    degrees = SC.select_degrees(data)
+    np.testing.assert_equal(degrees, expected)
+    assert SC.stats['numUniquePairs'] == len(pairs)
+
+    histogram = SC.stats['boxOccupancyHistogram']
+    assert histogram.sum() == SC.stats['numBoxes']
+    assert np.dot(histogram, np.arange(len(histogram))) == len(data)
+
+    out = np.zeros(len(data), dtype=np.int64)
+    assert SC.select_degrees(data, out=out) is out
+    np.testing.assert_equal(out, expected)
+
+
+@pytest.mark.parametrize("pairType", [
+    'labeled_unlabeled', 'cross_label', 'same_label', 'not_same_labeled'])
+def test_select_degrees_labels(SC, pairType):
+    np.random.seed(0)
+    data = np.random.uniform(size=(300, 2))
+    labels = np.random.randint(-1, 3, size=300)
+
+    SC.pairType = pairType
+    SC.resolution = 10
+    pairs = SC.select_pairs(data, labels=labels, as_array=True)
+    expected = np.bincount(pairs.reshape(-1), minlength=len(data))
+
+    degrees = SC.select_degrees(data, labels=labels)
+    np.testing.assert_equal(degrees, expected)
+    assert SC.stats['numUniquePairs'] == len(pairs)
+
+
+def test_select_degrees_exceptions(SC, data):
+    with pytest.raises(TypeError):
+        SC.select_degrees('test')
+
+    SC.pairType = 'cross_label'
+    with pytest.raises(ValueError):
+        SC.select_degrees(data)
+
+    with pytest.raises(ValueError):
+        SC.select_degrees(data, out=np.zeros(2, dtype=np.int64))
+
+
+def test_neighbor_search(SC):
+    np.random.seed(0)
+    data = np.random.uniform(size=(500, 3))
+
+    SC.method = 'block_enumeration'
+    SC.resolution = 5
+    expected = sorted(tuple(sorted(x)) for x in SC.select_pairs(data))
+    assert 'numEmptyAdjacentBoxes' in SC.stats
+
+    SC.neighborSearch = 'sweep'
+    pairs = SC.select_pairs(data)
+    assert sorted(tuple(sorted(x)) for x in pairs) == expected
+    assert SC.stats['numSweepCandidates'] > 0
+
+    SC.neighborSearch = 'test'
+    with pytest.raises(ValueError):
+        SC.select_pairs(data)
+
+
+def sorted_pairs(pairs):
+    return sorted(map(tuple, np.sort(pairs, axis=1).tolist()))
+
+
+@pytest.mark.parametrize("method", ['block_enumeration', 'object_shifting',
+                                    'block_shifting'])
+def test_memory_limit(method):
+    from sparsecomputation import PairMemoryError, SparseComputation
+
+    np.random.seed(0)
+    data = np.random.uniform(size=(2000, 2))
+    SC = SparseComputation(None, resolution=10, method=method)
+    expected = SC.select_pairs(data, as_array=True)
+    pairBytes = 2 * np.dtype(np.intp).itemsize
+
+    # object shifting holds the pairs of all shifts before deduplication
+    limit = 4 * pairBytes * len(expected)
+    SC = SparseComputation(None, resolution=10, method=method,
+                           memory_limit=limit)
+    pairs = SC.select_pairs(data, as_array=True)
+    assert sorted_pairs(pairs) == sorted_pairs(expected)
+
+    # a list of tuples takes about ten times the memory of the array
+    with pytest.raises(PairMemoryError) as error:
+        SC.select_pairs(data)
+    assert error.value.numPairs == len(expected)
+    assert error.value.estimatedBytes == 10 * pairBytes * len(expected)
+    assert 'as_array' in str(error.value)
+
+    # the expansion needs the pairs and temporary arrays of the same size
+    SC.memoryLimit = 2 * pairBytes * len(expected) - 1
+    with pytest.raises(PairMemoryError) as error:
+        SC.select_pairs(data, as_array=True)
+    assert error.value.numPairs >= len(expected)
+    assert error.value.estimatedBytes == 2 * pairBytes * error.value.numPairs
+    assert error.value.memoryLimit == SC.memoryLimit
+    assert isinstance(error.value, MemoryError)
+
+    with pytest.raises(ValueError):
+        SparseComputation(None, resolution=10, memory_limit=-1)
+
+
+@pytest.mark.parametrize("method", ['block_enumeration', 'block_shifting'])
+def test_memory_limit_spill(tmpdir, method):
+    import os
+
+    from sparsecomputation import PairMemoryError, SparseComputation
+
+    np.random.seed(0)
+    data = np.random.uniform(size=(2000, 2))
+    SC = SparseComputation(None, resolution=10, method=method)
+    expected = SC.select_pairs(data, as_array=True)
+
+    SC = SparseComputation(None, resolution=10, method=method,
+                           memory_limit=1000, spill_dir=str(tmpdir))
+    pairs = SC.select_pairs(data, as_array=True)
+    assert isinstance(pairs, np.memmap)
+    assert sorted_pairs(pairs) == sorted_pairs(expected)
+    assert SC.stats['numUniquePairs'] == len(expected)
+
+    spilled = np.load(SC.stats['spillFile'])
+    assert os.path.dirname(SC.stats['spillFile']) == str(tmpdir)
+    np.testing.assert_array_equal(spilled, pairs)
+
+    with pytest.raises(ValueError):
+        SC.select_pairs(data)
+
+    # labeled pairs are counted from the selected label groups and spilled
+    labels = np.random.randint(0, 3, size=len(data))
+    SC.pairType = 'same_label'
+    pairs = SC.select_pairs(data, labels=labels, as_array=True)
+    assert isinstance(pairs, np.memmap)
+    assert sorted_pairs(pairs) == sorted_pairs(
+        expected[labels[expected[:, 0]] == labels[expected[:, 1]]])
+
+    SC.spillDir = None
+    with pytest.raises(PairMemoryError) as error:
+        SC.select_pairs(data, labels=labels, as_array=True)
+    assert error.value.numPairs == len(pairs)
+
+
+@pytest.mark.parametrize("method", ['block_enumeration', 'block_shifting'])
+def test_memory_limit_labels(method):
+    from sparsecomputation import SparseComputation
+
+    np.random.seed(0)
+    data = np.random.uniform(size=(2000, 2))
+    labels = np.random.randint(0, 20, size=len(data))
+    SC = SparseComputation(None, resolution=10, method=method,
+                           pair_type='same_label')
+    expected = SC.select_pairs(data, labels=labels, as_array=True)
+
+    # the limit holds the selected pairs, not all pairs of the boxes
+    SC.memoryLimit = 4 * np.dtype(np.intp).itemsize * len(expected)
+    pairs = SC.select_pairs(data, labels=labels, as_array=True)
+    assert sorted_pairs(pairs) == sorted_pairs(expected)
+    assert SC.stats['numUniquePairs'] == len(expected)
+
+
+@pytest.mark.parametrize("method", ['block_enumeration', 'block_shifting',
+                                    'object_shifting'])
+def test_memory_limit_cross_pairs(tmpdir, method):
+    from sparsecomputation import PairMemoryError, SparseComputation
+
+    np.random.seed(0)
+    dataA = np.random.uniform(size=(1000, 2))
+    dataB = np.random.uniform(size=(1000, 2))
+    SC = SparseComputation(None, resolution=10, method=method)
+    expected = SC.select_cross_pairs(dataA, dataB, as_array=True)
+
+    SC = SparseComputation(None, resolution=10, method=method,
+                           memory_limit=1000)
+    with pytest.raises(PairMemoryError):
+        SC.select_cross_pairs(dataA, dataB, as_array=True)
+
+    SC.spillDir = str(tmpdir)
+    if method == 'object_shifting':
+        with pytest.raises(PairMemoryError):
+            SC.select_cross_pairs(dataA, dataB, as_array=True)
+        return
+    pairs = SC.select_cross_pairs(dataA, dataB, as_array=True)
+    assert isinstance(pairs, np.memmap)
+    assert sorted_pairs(pairs) == sorted_pairs(expected)
+    with pytest.raises(ValueError):
+        SC.select_cross_pairs(dataA, dataB)
+
+
+@pytest.mark.parametrize("memoryLimit", [2 ** 12, 2 ** 16, 2 ** 30])
+def test_memory_limit_large_box(tmpdir, monkeypatch, memoryLimit):
+    from sparsecomputation import SparseComputation, kernels
+
+    np.random.seed(0)
+    data = np.random.uniform(size=(1000, 2))
+    data[:600] *= 0.01
+    SC = SparseComputation(None, resolution=10,
+                           method='block_enumeration')
+    expected = SC.select_pairs(data, as_array=True)
+
+    # the box of about 600 objects is expanded in slices within the limit
+    sizes = []
+    slicePairs = kernels.box_slice_pairs
+
+    def box_slice_pairs(*args, **kwargs):
+        sizes.append(len(kwargs['out']))
+        return slicePairs(*args, **kwargs)
+
+    monkeypatch.setattr(kernels, 'box_slice_pairs', box_slice_pairs)
+    SC = SparseComputation(None, resolution=10, method='block_enumeration',
+                           memory_limit=memoryLimit, spill_dir=str(tmpdir))
+    pairs = SC.select_pairs(data, as_array=True)
+    assert sorted_pairs(pairs) == sorted_pairs(expected)
+    # a quarter of the limit, or one object paired with its box
+    pairBytes = 2 * np.dtype(np.intp).itemsize
+    assert max(sizes) <= max(memoryLimit // (4 * pairBytes),
+                             SC.stats['maxBoxOccupancy'])
+    assert isinstance(pairs, np.memmap) == (memoryLimit < 2 ** 30)